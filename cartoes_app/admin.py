@@ -1,11 +1,103 @@
+from django import forms
+from django.conf import settings
 from django.contrib import admin
-from .models import CartaoCredito, Gasto, GastoAnexo
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import CartaoCredito, Gasto, GastoAnexo, Organizacao, PerfilUsuario
+
+
+class PaginadorEstimado(Paginator):
+    """
+    Na listagem sem filtros usa a estimativa do PostgreSQL (pg_class.reltuples)
+    em vez de COUNT(*) na tabela inteira. Com filtro/busca, em outros bancos ou
+    em tabelas pequenas conta normalmente.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            conexao = connections[self.object_list.db]
+            if conexao.vendor == 'postgresql':
+                with conexao.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                        [self.object_list.model._meta.db_table],
+                    )
+                    linha = cursor.fetchone()
+                # -1: tabela ainda não analisada pelo autovacuum
+                if linha and linha[0] >= settings.ADMIN_CONTAGEM_ESTIMADA_MINIMA:
+                    return linha[0]
+        return super().count
+
+
+class FiltroAutocomplete(admin.RelatedFieldListFilter):
+    """
+    Filtro por chave estrangeira com o campo de busca do autocomplete do admin,
+    em vez de listar todos os usuários/cartões na barra lateral. O admin do
+    model relacionado precisa de search_fields.
+    """
+    template = 'admin/cartoes_app/filtro_autocomplete.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        # só o valor selecionado é carregado, pelo próprio widget
+        return []
+
+    def has_output(self):
+        return True
+
+    def campo_busca(self):
+        campo = forms.ModelChoiceField(
+            queryset=self.field.remote_field.model._default_manager.all(),
+            required=False,
+            widget=AutocompleteSelect(self.field, self.admin_site, attrs={'class': 'filtro-autocomplete'}),
+        )
+        valor = self.lookup_val[-1] if self.lookup_val else None
+        return campo.widget.render(self.lookup_kwarg, valor, attrs={'id': f'filtro_{self.lookup_kwarg}'})
+
+
+class ListaGrandeAdmin(admin.ModelAdmin):
+    """Base para tabelas grandes: contagem estimada, sem o COUNT(*) extra do total e com os filtros autocomplete."""
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        return (
+            super().media
+            + AutocompleteSelect(None, self.admin_site).media
+            + forms.Media(js=['cartoes_app/admin/filtro_autocomplete.js'])
+        )
+
+
+@admin.register(Organizacao)
+class OrganizacaoAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'slug', 'criado_em')
+    search_fields = ('nome', 'slug')
+    prepopulated_fields = {'slug': ('nome',)}
+
+@admin.register(PerfilUsuario)
+class PerfilUsuarioAdmin(admin.ModelAdmin):
+    list_display = ('usuario', 'organizacao')
+    list_select_related = ('usuario', 'organizacao')
+    search_fields = ('usuario__username', 'organizacao__nome')
+    list_filter = ('organizacao',)
+    autocomplete_fields = ('usuario', 'organizacao')
 
 @admin.register(CartaoCredito)
 class CartaoAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'bandeira', 'limite', 'vencimento_formatado', 'usuario')
+    list_display = ('nome', 'bandeira', 'limite', 'vencimento_formatado', 'usuario', 'organizacao')
+    list_select_related = ('usuario', 'organizacao')
     search_fields = ('nome', 'numero')
-    list_filter = ('bandeira',)
+    list_filter = ('organizacao', 'bandeira')
+    autocomplete_fields = ('organizacao', 'usuario')
 
     # # Se quiser evitar expor o número completo no Django Admin:
     # def mostrar_numero(self, obj):
@@ -13,13 +105,19 @@ class CartaoAdmin(admin.ModelAdmin):
     # mostrar_numero.short_description = 'Número'
 
 @admin.register(Gasto)
-class GastoAdmin(admin.ModelAdmin):
+class GastoAdmin(ListaGrandeAdmin):
     list_display = ('usuario', 'cartao', 'descricao', 'valor', 'data', 'created_at')
-    list_filter = ('data', 'usuario')
+    list_select_related = ('usuario', 'cartao')
+    list_filter = ('organizacao', ('usuario', FiltroAutocomplete), ('cartao', FiltroAutocomplete))
+    date_hierarchy = 'data'
     search_fields = ('descricao', 'usuario__username', 'cartao__nome')
+    autocomplete_fields = ('organizacao', 'usuario', 'cartao')
 
 @admin.register(GastoAnexo)
-class GastoAnexoAdmin(admin.ModelAdmin):
-    list_display = ('gasto', 'nome_original', 'uploaded_at')
+class GastoAnexoAdmin(ListaGrandeAdmin):
+    list_display = ('gasto', 'nome_original', 'tipo_conteudo', 'uploaded_at')
+    list_select_related = ('gasto__usuario',)
     search_fields = ('nome_original', 'gasto__descricao', 'gasto__usuario__username')
-    list_filter = ('uploaded_at',)
\ No newline at end of file
+    list_filter = (('gasto__usuario', FiltroAutocomplete),)
+    date_hierarchy = 'uploaded_at'
+    autocomplete_fields = ('gasto',)
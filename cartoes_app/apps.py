@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CartoesAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cartoes_app'
+
+    def ready(self):
+        from . import limites  # noqa: F401  registra o check de cache dos limites
@@ -0,0 +1,50 @@
+# cartoes_app/aquecimento.py
+import importlib
+import logging
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections
+from django.template import engines
+from django.urls import get_resolver
+from django.utils import formats, translation
+
+logger = logging.getLogger(__name__)
+
+MODULOS = (
+    'cartoes_app.views',
+    'cartoes_app.forms',
+    'cartoes_app.admin',
+    'django.contrib.humanize.templatetags.humanize',
+)
+
+
+def aquecer():
+    """
+    Carrega de antemão o que normalmente só é carregado na primeira requisição:
+    views/forms, templates compilados (guardados pelo cached loader), o resolver
+    de URLs e o catálogo de traduções/formatos.
+    Não consulta o banco, então pode rodar no master do gunicorn (--preload).
+    """
+    for modulo in MODULOS:
+        importlib.import_module(modulo)
+
+    # Popula reverse_dict/url_patterns do resolver (importa as urls e views)
+    resolver = get_resolver()
+    resolver.reverse_dict
+
+    # Compila todos os templates do app; com o cached loader ficam em memória
+    engine = engines['django']
+    pasta = Path(apps.get_app_config('cartoes_app').path) / 'templates'
+    total = 0
+    for arquivo in sorted(pasta.rglob('*.html')):
+        engine.get_template(arquivo.relative_to(pasta).as_posix())
+        total += 1
+
+    with translation.override(settings.LANGUAGE_CODE):
+        formats.get_format('DECIMAL_SEPARATOR')
+        formats.get_format('DATE_FORMAT')
+
+    connections.close_all()
+    logger.info('Aquecimento concluído: %s templates compilados.', total)
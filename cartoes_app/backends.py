@@ -0,0 +1,71 @@
+# cartoes_app/backends.py
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def chave_cache_usuario(user_id):
+    return f'cartoes:usuario:{user_id}'
+
+
+def chave_cache_permissoes(user_id):
+    return f'cartoes:permissoes:{user_id}'
+
+
+def chave_cache_organizacao(user_id):
+    return f'cartoes:organizacao:{user_id}'
+
+
+# Versão global das permissões: muda quando grupos/permissões são alterados,
+# invalidando de uma vez as permissões em cache de todos os usuários.
+CHAVE_VERSAO_PERMISSOES = 'cartoes:permissoes:versao'
+
+
+def invalidar_usuario_cache(user_id):
+    cache.delete_many([
+        chave_cache_usuario(user_id), chave_cache_permissoes(user_id), chave_cache_organizacao(user_id),
+    ])
+
+
+def invalidar_permissoes_cache():
+    try:
+        cache.incr(CHAVE_VERSAO_PERMISSOES)
+    except ValueError:
+        cache.set(CHAVE_VERSAO_PERMISSOES, 1, None)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend que guarda no cache o usuário da sessão e suas permissões,
+    evitando as consultas em auth_user/auth_permission a cada requisição.
+    A invalidação acontece pelos signals em cartoes_app.models (save/delete do
+    usuário e alterações de grupos/permissões).
+    """
+
+    def get_user(self, user_id):
+        timeout = settings.USER_CACHE_TIMEOUT
+        chave = chave_cache_usuario(user_id)
+        user = cache.get(chave)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(chave, user, timeout)
+            return user
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if obj is not None or not user_obj.is_active or user_obj.is_anonymous:
+            return super().get_all_permissions(user_obj, obj=obj)
+        if hasattr(user_obj, '_perm_cache'):
+            return user_obj._perm_cache
+
+        versao = cache.get_or_set(CHAVE_VERSAO_PERMISSOES, 1, None)
+        chave = chave_cache_permissoes(user_obj.pk)
+        em_cache = cache.get(chave)
+        if em_cache is not None and em_cache[0] == versao:
+            user_obj._perm_cache = em_cache[1]
+            return user_obj._perm_cache
+
+        perms = super().get_all_permissions(user_obj)
+        cache.set(chave, (versao, perms), settings.USER_CACHE_TIMEOUT)
+        return perms
@@ -0,0 +1,128 @@
+# cartoes_app/conteudo.py
+import os
+import struct
+
+# Quanto ler do início do arquivo; o restante do upload nunca é lido aqui.
+TAMANHO_CABECALHO = 4096
+# JPEG: os metadados (EXIF) podem empurrar o SOF para longe do início.
+LIMITE_BUSCA_JPEG = 256 * 1024
+
+# Proteção contra "decompression bombs": arquivos pequenos que declaram imagens enormes.
+MAX_LADO_IMAGEM = 12000
+MAX_PIXELS_IMAGEM = 50_000_000
+
+EXTENSOES = {
+    'application/pdf': ('.pdf',),
+    'image/png': ('.png',),
+    'image/jpeg': ('.jpg', '.jpeg'),
+    'image/gif': ('.gif',),
+    'image/webp': ('.webp',),
+}
+
+# Marcadores SOF do JPEG (C4, C8 e CC não são frames)
+SOF_JPEG = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ConteudoInvalido(ValueError):
+    pass
+
+
+def _dimensoes_png(cab):
+    if len(cab) < 24 or cab[12:16] != b'IHDR':
+        raise ConteudoInvalido('PNG corrompido.')
+    return struct.unpack('>II', cab[16:24])
+
+
+def _dimensoes_gif(cab):
+    if len(cab) < 10:
+        raise ConteudoInvalido('GIF corrompido.')
+    return struct.unpack('<HH', cab[6:10])
+
+
+def _dimensoes_webp(cab):
+    chunk = cab[12:16]
+    if chunk == b'VP8 ' and len(cab) >= 30 and cab[23:26] == b'\x9d\x01\x2a':
+        largura, altura = struct.unpack('<HH', cab[26:30])
+        return largura & 0x3FFF, altura & 0x3FFF
+    if chunk == b'VP8L' and len(cab) >= 25 and cab[20] == 0x2F:
+        bits = int.from_bytes(cab[21:25], 'little')
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(cab) >= 30:
+        return int.from_bytes(cab[24:27], 'little') + 1, int.from_bytes(cab[27:30], 'little') + 1
+    raise ConteudoInvalido('WEBP corrompido.')
+
+
+def _dimensoes_jpeg(arquivo):
+    """Percorre os segmentos pulando o conteúdo (seek) até o SOF."""
+    pos = 2
+    while pos < LIMITE_BUSCA_JPEG:
+        arquivo.seek(pos)
+        marcador = arquivo.read(4)
+        if len(marcador) < 4 or marcador[0] != 0xFF:
+            break
+        tipo = marcador[1]
+        if tipo == 0xFF:  # preenchimento
+            pos += 1
+            continue
+        if tipo in (0xD8, 0x01) or 0xD0 <= tipo <= 0xD7:  # marcadores sem tamanho
+            pos += 2
+            continue
+        tamanho = struct.unpack('>H', marcador[2:4])[0]
+        if tipo in SOF_JPEG:
+            dados = arquivo.read(5)
+            if len(dados) < 5:
+                break
+            altura, largura = struct.unpack('>HH', dados[1:5])
+            return largura, altura
+        if tipo == 0xDA or tamanho < 2:  # início dos dados sem ter achado o SOF
+            break
+        pos += 2 + tamanho
+    raise ConteudoInvalido('JPEG corrompido ou sem dimensões.')
+
+
+def detectar_tipo(arquivo):
+    """
+    Identifica o tipo real do upload pela assinatura (magic bytes), lendo só o
+    cabeçalho. Retorna o MIME (uma das chaves de EXTENSOES) ou levanta
+    ConteudoInvalido. Para imagens, valida largura/altura declaradas.
+    """
+    posicao = arquivo.tell()
+    try:
+        arquivo.seek(0)
+        cab = arquivo.read(TAMANHO_CABECALHO)
+        largura = altura = None
+
+        # %PDF- no início, admitindo só BOM UTF-8 e espaços antes (gerados por alguns programas)
+        if cab.removeprefix(b'\xef\xbb\xbf').lstrip(b' \t\r\n\f\x00').startswith(b'%PDF-'):
+            return 'application/pdf'
+        if cab.startswith(b'\x89PNG\r\n\x1a\n'):
+            tipo = 'image/png'
+            largura, altura = _dimensoes_png(cab)
+        elif cab.startswith(b'\xff\xd8\xff'):
+            tipo = 'image/jpeg'
+            largura, altura = _dimensoes_jpeg(arquivo)
+        elif cab[:6] in (b'GIF87a', b'GIF89a'):
+            tipo = 'image/gif'
+            largura, altura = _dimensoes_gif(cab)
+        elif cab[:4] == b'RIFF' and cab[8:12] == b'WEBP':
+            tipo = 'image/webp'
+            largura, altura = _dimensoes_webp(cab)
+        else:
+            raise ConteudoInvalido('Tipos permitidos: PDF, PNG, JPG, GIF, WEBP.')
+
+        if not largura or not altura:
+            raise ConteudoInvalido('Imagem sem dimensões válidas.')
+        if max(largura, altura) > MAX_LADO_IMAGEM or largura * altura > MAX_PIXELS_IMAGEM:
+            raise ConteudoInvalido(f'Imagem muito grande ({largura}x{altura} pixels).')
+        return tipo
+    finally:
+        arquivo.seek(posicao)
+
+
+def nome_com_extensao(nome, tipo):
+    """Ajusta a extensão ao tipo detectado, para o arquivo não ser servido como outra coisa."""
+    raiz, ext = os.path.splitext(os.path.basename(nome))
+    if ext.lower() in EXTENSOES[tipo]:
+        return nome
+    return f'{raiz or "arquivo"}{EXTENSOES[tipo][0]}'
+
@@ -0,0 +1,27 @@
+# cartoes_app/duplicados.py
+import datetime
+import hashlib
+import re
+import unicodedata
+from decimal import Decimal
+
+_ESPACOS = re.compile(r'\s+')
+
+
+def normalizar_descricao(descricao):
+    """'  Mercado  São João ' -> 'mercado sao joao' (sem acentos, caixa ou espaços extras)."""
+    texto = unicodedata.normalize('NFKD', descricao or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return _ESPACOS.sub(' ', texto).strip().lower()
+
+
+def impressao_digital(usuario_id, cartao_id, valor, data, descricao):
+    """
+    sha256 de (usuário, cartão, valor, data, descrição normalizada): dois gastos
+    com a mesma impressão digital são o mesmo lançamento repetido.
+    """
+    if isinstance(data, datetime.datetime):
+        data = data.date()
+    valor = Decimal(valor).quantize(Decimal('0.01'))
+    bruto = f'{usuario_id}|{cartao_id}|{valor}|{data.isoformat()}|{normalizar_descricao(descricao)}'
+    return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
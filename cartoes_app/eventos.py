@@ -0,0 +1,88 @@
+# cartoes_app/eventos.py
+"""
+Pub/sub em memória para as atualizações de saldo enviadas por SSE
+(eventos_saldos_view). Funciona dentro de um processo: quem publica (signals
+em models.py) e quem assina (dashboards abertos) precisam estar no mesmo
+processo ASGI. Valores em centavos (int); cada evento leva o organizacao_id
+e cada dashboard só recebe os da sua organização.
+"""
+import asyncio
+import json
+import threading
+from decimal import Decimal
+
+TAMANHO_FILA = 100
+INTERVALO_PING = 15  # segundos; mantém a conexão viva em proxies
+
+
+class Hub:
+    def __init__(self, tamanho_fila=TAMANHO_FILA):
+        self.tamanho_fila = tamanho_fila
+        self._assinantes = set()  # (loop, fila)
+        self._lock = threading.Lock()
+
+    def tem_assinantes(self):
+        return bool(self._assinantes)
+
+    def assinar(self):
+        """Cria a fila do assinante no event loop atual."""
+        assinante = (asyncio.get_running_loop(), asyncio.Queue(self.tamanho_fila))
+        with self._lock:
+            self._assinantes.add(assinante)
+        return assinante
+
+    def cancelar(self, assinante):
+        with self._lock:
+            self._assinantes.discard(assinante)
+
+    def publicar(self, evento):
+        """Pode ser chamado de qualquer thread (views síncronas, on_commit)."""
+        with self._lock:
+            assinantes = list(self._assinantes)
+        for assinante in assinantes:
+            loop, fila = assinante
+            try:
+                loop.call_soon_threadsafe(_entregar, fila, evento)
+            except RuntimeError:  # loop encerrado
+                self.cancelar(assinante)
+
+
+def _entregar(fila, evento):
+    try:
+        fila.put_nowait(evento)
+    except asyncio.QueueFull:
+        # cliente lento: descarta o acumulado e pede para recarregar a página
+        while not fila.empty():
+            fila.get_nowait()
+        fila.put_nowait({'tipo': 'recarregar'})
+
+
+hub = Hub()
+
+
+def centavos(valor):
+    return int(round(Decimal(str(valor or 0)) * 100))
+
+
+def publicar(evento):
+    hub.publicar(evento)
+
+
+async def fluxo_sse(organizacao_id):
+    """Gerador assíncrono no formato text/event-stream com os eventos da organização."""
+    assinante = hub.assinar()
+    _, fila = assinante
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            try:
+                evento = await asyncio.wait_for(fila.get(), INTERVALO_PING)
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            # eventos sem organização (descarte por fila cheia) valem para todos
+            if evento.get('organizacao_id', organizacao_id) != organizacao_id:
+                continue
+            yield f'event: {evento["tipo"]}\ndata: {json.dumps(evento)}\n\n'
+    finally:
+        hub.cancelar(assinante)
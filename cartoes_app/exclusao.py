@@ -0,0 +1,101 @@
+# cartoes_app/exclusao.py
+import logging
+import threading
+
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .models import CartaoCredito, Gasto, GastoAnexo, RemocaoArquivoPendente
+
+logger = logging.getLogger(__name__)
+
+LOTE_EXCLUSAO = 1000
+
+
+def excluir_lote_gastos(cartao_ids, tamanho_lote=LOTE_EXCLUSAO):
+    """
+    Apaga até `tamanho_lote` gastos (e seus anexos) dos cartões informados com DELETEs
+    diretos, sem carregar objetos nem disparar post_delete por anexo. Os arquivos vão
+    para a fila RemocaoArquivoPendente. Retorna quantos gastos foram apagados.
+    """
+    with transaction.atomic():
+        ids = list(
+            Gasto.objects.filter(cartao_id__in=cartao_ids)
+            .order_by()
+            .values_list('id', flat=True)[:tamanho_lote]
+        )
+        if not ids:
+            return 0
+
+        anexos = GastoAnexo.objects.filter(gasto_id__in=ids)
+        RemocaoArquivoPendente.objects.bulk_create([
+            RemocaoArquivoPendente(arquivo=nome)
+            for nomes in anexos.values_list('arquivo', 'arquivo_original')
+            for nome in nomes if nome
+        ])
+        anexos._raw_delete(anexos.db)
+        gastos = Gasto.objects.filter(id__in=ids)
+        gastos._raw_delete(gastos.db)
+    return len(ids)
+
+
+def excluir_cartoes(cartao_ids, tamanho_lote=LOTE_EXCLUSAO, progresso=None):
+    """
+    Exclui os cartões em lotes (uma transação por lote) e agenda a varredura dos
+    arquivos. `progresso(removidos)` é chamado após cada lote. Retorna o total de
+    gastos apagados.
+    """
+    total = 0
+    while True:
+        removidos = excluir_lote_gastos(cartao_ids, tamanho_lote)
+        if not removidos:
+            break
+        total += removidos
+        if progresso:
+            progresso(total)
+
+    CartaoCredito.objects.filter(pk__in=cartao_ids).delete()
+    transaction.on_commit(iniciar_varredura_em_segundo_plano)
+    return total
+
+
+def varrer_remocoes_pendentes(tamanho_lote=500, limite=None):
+    """Remove do storage os arquivos da fila, em lotes. Retorna quantos foram processados."""
+    processados = 0
+    while limite is None or processados < limite:
+        pendentes = list(RemocaoArquivoPendente.objects.order_by('id')[:tamanho_lote])
+        if not pendentes:
+            break
+        concluidos = []
+        for pendente in pendentes:
+            try:
+                default_storage.delete(pendente.arquivo)
+            except OSError:
+                logger.exception('Falha ao remover %s; fica na fila.', pendente.arquivo)
+                continue
+            concluidos.append(pendente.pk)
+        RemocaoArquivoPendente.objects.filter(pk__in=concluidos).delete()
+        processados += len(concluidos)
+        if not concluidos:
+            break
+    return processados
+
+
+_varredura_lock = threading.Lock()
+
+
+def iniciar_varredura_em_segundo_plano():
+    """Esvazia a fila numa thread daemon (uma por processo); o comando varrer_arquivos_removidos cobre o resto."""
+    if not _varredura_lock.acquire(blocking=False):
+        return
+
+    def executar():
+        try:
+            varrer_remocoes_pendentes()
+        except Exception:
+            logger.exception('Falha na varredura de arquivos removidos.')
+        finally:
+            connection.close()
+            _varredura_lock.release()
+
+    threading.Thread(target=executar, name='varredura-arquivos', daemon=True).start()
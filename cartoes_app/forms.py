@@ -1,9 +1,13 @@
 # cartoes_app/forms.py
+import uuid
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .conteudo import ConteudoInvalido, detectar_tipo
 from .models import CartaoCredito, Gasto
+from .organizacoes import usuarios_comuns
 
 
 # class CartaoCreditoForm(forms.ModelForm):
@@ -83,13 +87,95 @@ class CartaoCreditoAdminForm(forms.ModelForm):
             'bandeira': forms.Select(attrs={'class': 'form-select'}),
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, organizacao=None, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['usuario'].queryset = User.objects.filter(is_staff=False).order_by('username')
+        self.organizacao = organizacao
+        self.fields['usuario'].queryset = usuarios_comuns(organizacao).order_by('username')
         ano_atual = timezone.now().year
         # ✅ labels como string para evitar 2.025 etc.
         self.fields['ano_vencimento'].choices = [(y, str(y)) for y in range(ano_atual, ano_atual + 15)]
 
+    def save(self, commit=True):
+        cartao = super().save(commit=False)
+        cartao.organizacao = self.organizacao
+        if commit:
+            cartao.save()
+        return cartao
+
+
+class CartaoCreditoLoteForm(CartaoCreditoAdminForm):
+    """
+    Uma linha do CSV de importação em lote. Mesmas regras do CartaoCreditoAdminForm,
+    mas o dono vem pelo username e é resolvido num dicionário carregado uma única vez
+    (em vez de uma consulta por linha).
+    """
+    usuario = forms.CharField(label='Usuário')
+
+    def __init__(self, *args, usuarios_por_username=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.usuarios_por_username = usuarios_por_username or {}
+
+    def clean_usuario(self):
+        username = (self.cleaned_data.get('usuario') or '').strip()
+        usuario = self.usuarios_por_username.get(username)
+        if usuario is None:
+            raise forms.ValidationError(f'Usuário comum "{username}" não encontrado.')
+        return usuario
+
+    def _get_validation_exclusions(self):
+        # O dono já foi validado pelo dicionário; evita o SELECT da ForeignKey por linha
+        exclude = super()._get_validation_exclusions()
+        exclude.add('usuario')
+        return exclude
+
+
+class ImportarCartoesForm(forms.Form):
+    arquivo = forms.FileField(
+        label='Arquivo CSV',
+        help_text='Colunas: usuario, nome, numero, mes_vencimento, ano_vencimento, limite, bandeira',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,text/csv'})
+    )
+
+    def clean_arquivo(self):
+        arquivo = self.cleaned_data['arquivo']
+        if arquivo.size > 5 * 1024 * 1024:  # 5MB
+            raise forms.ValidationError('O arquivo CSV deve ter no máximo 5 MB.')
+        return arquivo
+
+
+class OperacaoLoteCartoesForm(forms.Form):
+    ACOES = [
+        ('recarregar', 'Recarregar saldo (+ valor)'),
+        ('ajustar_limite', 'Definir limite (= valor)'),
+        ('excluir', 'Excluir cartões'),
+    ]
+
+    acao = forms.ChoiceField(
+        choices=ACOES,
+        label='Ação',
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    valor = forms.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        min_value=0.01,
+        required=False,
+        label='Valor',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'})
+    )
+    # Os checkboxes são desenhados no template; o campo só valida os ids (uma consulta)
+    cartoes = forms.ModelMultipleChoiceField(queryset=CartaoCredito.objects.none())
+
+    def __init__(self, *args, organizacao=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['cartoes'].queryset = CartaoCredito.objects.da_organizacao(organizacao)
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get('acao') in ('recarregar', 'ajustar_limite') and cleaned.get('valor') is None:
+            self.add_error('valor', 'Informe o valor para esta ação.')
+        return cleaned
+
 
 class RecargaSaldoForm(forms.Form):
     valor = forms.DecimalField(
@@ -109,10 +195,16 @@ class RegistrarUsuarioComumForm(UserCreationForm):
         model = User
         fields = ("username", "email", "password1", "password2")
 
+    def __init__(self, *args, organizacao=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.organizacao = organizacao
+
     def save(self, commit=True):
         user = super().save(commit=False)
         user.is_staff = False
         user.is_superuser = False
+        # lida pelo signal que cria o perfil (cartoes_app.models.criar_perfil_usuario)
+        user._organizacao = self.organizacao
         if commit:
             user.save()
         return user
@@ -123,6 +215,15 @@ class MultipleFileInput(forms.ClearableFileInput):
     allow_multiple_selected = True
 
 
+class MultipleFileField(forms.FileField):
+    """FileField que aceita a lista de arquivos enviada pelo MultipleFileInput."""
+
+    def clean(self, data, initial=None):
+        if isinstance(data, (list, tuple)):
+            return [super(MultipleFileField, self).clean(d, initial) for d in data]
+        return [super().clean(data, initial)] if data else []
+
+
 class GastoForm(forms.ModelForm):
     cartao = forms.ModelChoiceField(
         queryset=CartaoCredito.objects.none(),
@@ -134,11 +235,18 @@ class GastoForm(forms.ModelForm):
         label='Data'
     )
     # ✅ Campo de anexos (múltiplos)
-    anexos = forms.FileField(
+    anexos = MultipleFileField(
         required=False,
         widget=MultipleFileInput(attrs={'class': 'form-control'}),
         label='Comprovantes (PDF/Imagens)'
     )
+    # Gerada ao exibir o formulário; reenviar o mesmo POST não duplica o gasto
+    chave_idempotencia = forms.UUIDField(required=False, widget=forms.HiddenInput)
+    confirmar_duplicado = forms.BooleanField(
+        required=False,
+        label='Registrar mesmo assim (já existe um gasto igual)',
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+    )
 
     class Meta:
         model = Gasto
@@ -151,6 +259,8 @@ class GastoForm(forms.ModelForm):
     def __init__(self, *args, user_alvo=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.user_alvo = user_alvo
+        if not self.is_bound:
+            self.initial['chave_idempotencia'] = uuid.uuid4()
         if user_alvo is not None:
             self.fields['cartao'].queryset = CartaoCredito.objects.filter(usuario=user_alvo).order_by('nome')
         else:
@@ -163,20 +273,23 @@ class GastoForm(forms.ModelForm):
         return cartao
 
     def clean_anexos(self):
-        # ✅ pega lista de arquivos mesmo sem 'multiple' no HTML (widget já permite)
-        files = self.files.getlist('anexos') if hasattr(self.files, 'getlist') else []
+        """
+        Valida cada upload pela assinatura do conteúdo (não pelo content_type
+        enviado pelo navegador). Retorna [(arquivo, tipo_detectado), ...].
+        """
+        files = self.cleaned_data.get('anexos') or []
         if not files:
             return files
 
-        allowed = {
-            'application/pdf',
-            'image/png', 'image/jpeg', 'image/jpg', 'image/gif', 'image/webp'
-        }
         max_size = 10 * 1024 * 1024  # 10MB
 
+        validados = []
         for f in files:
-            if f.content_type not in allowed:
-                raise forms.ValidationError('Tipos permitidos: PDF, PNG, JPG, GIF, WEBP.')
             if f.size > max_size:
                 raise forms.ValidationError('Cada arquivo deve ter no máximo 10 MB.')
-        return files
+            try:
+                tipo = detectar_tipo(f)
+            except ConteudoInvalido as e:
+                raise forms.ValidationError(f'{f.name}: {e}')
+            validados.append((f, tipo))
+        return validados
@@ -0,0 +1,194 @@
+# cartoes_app/imagens.py
+"""
+Recompressão opcional das fotos de comprovante (IMAGEM_OTIMIZAR=true): reduz ao
+lado máximo configurado e regrava no mesmo formato, sem EXIF. O upload grava o
+arquivo como veio e, após o commit, agenda os anexos numa fila em segundo plano
+(uma thread por processo); a thread manda a codificação para um pool de
+processos (iniciados com spawn) e grava o resultado. A requisição nunca espera
+a recompressão. Em erro, timeout ou sem Pillow o arquivo original fica como
+está; o que não foi processado (tamanho_original nulo) é recuperado por
+otimizar_imagens_anexos.
+"""
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as TempoEsgotado
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from .conteudo import MAX_PIXELS_IMAGEM, nome_com_extensao
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # opcional: pip install Pillow
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# GIF fica de fora: pode ser animado e raramente é foto
+FORMATOS = {'image/jpeg': 'JPEG', 'image/png': 'PNG', 'image/webp': 'WEBP'}
+
+_pool = None
+_pool_pid = None
+_fila = None
+_fila_pid = None
+
+
+def disponivel():
+    return settings.IMAGEM_OTIMIZAR and Image is not None
+
+
+def executor():
+    """
+    Pool criado na primeira imagem de cada processo (funciona com o fork do gunicorn).
+    Os processos do pool são iniciados com spawn: o worker tem threads (fila de
+    recompressão, logging) e conexões abertas, que um fork copiaria pela metade.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGEM_PROCESSOS, mp_context=multiprocessing.get_context('spawn'),
+        )
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def _descartar_pool(encerrar=False):
+    """
+    Abandona o pool atual (o próximo uso cria outro). Com `encerrar`, termina
+    também os processos, liberando os que ficaram presos numa imagem.
+    """
+    global _pool
+    if _pool is not None and _pool_pid == os.getpid():
+        processos = list((getattr(_pool, '_processes', None) or {}).values())
+        _pool.shutdown(wait=False, cancel_futures=True)
+        if encerrar:
+            for processo in processos:
+                processo.terminate()
+    _pool = None
+
+
+def resultado(futuro):
+    """
+    Espera o resultado de codificar() por até IMAGEM_TIMEOUT. No timeout cancela
+    a tarefa; se ela já estava rodando, o pool é descartado e seus processos
+    terminados, para a vaga não ficar ocupada. Levanta o erro original.
+    """
+    try:
+        return futuro.result(timeout=settings.IMAGEM_TIMEOUT)
+    except TempoEsgotado:
+        if not futuro.cancel():
+            _descartar_pool(encerrar=True)
+        raise
+    except BrokenProcessPool:
+        _descartar_pool()
+        raise
+
+
+def codificar(dados, formato, lado_maximo, qualidade):
+    """
+    Executada no processo do pool. Devolve os novos bytes ou None quando o
+    resultado não fica menor que o original.
+    """
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS_IMAGEM
+    with Image.open(io.BytesIO(dados)) as imagem:
+        imagem = ImageOps.exif_transpose(imagem)  # aplica a rotação antes de descartar o EXIF
+        imagem.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+        opcoes = {'optimize': True}
+        if formato == 'JPEG':
+            if imagem.mode not in ('RGB', 'L'):
+                imagem = imagem.convert('RGB')
+            opcoes.update(quality=qualidade, progressive=True)
+        elif formato == 'WEBP':
+            opcoes = {'quality': qualidade, 'method': 6}
+        saida = io.BytesIO()
+        imagem.save(saida, formato, **opcoes)
+    novos = saida.getvalue()
+    return novos if len(novos) < len(dados) else None
+
+
+def submeter(dados, tipo):
+    return executor().submit(
+        codificar, dados, FORMATOS[tipo], settings.IMAGEM_LADO_MAXIMO, settings.IMAGEM_QUALIDADE,
+    )
+
+
+def gravar(anexo, tamanho_original, novos):
+    """
+    Grava o resultado no anexo: `novos` None só marca a imagem como processada.
+    Com IMAGEM_MANTER_ORIGINAL o arquivo anterior vira arquivo_original; senão é apagado.
+    Se o anexo foi apagado (ou trocou de arquivo) durante a recompressão, nada é
+    gravado, o arquivo novo é removido e retorna False.
+    """
+    antigo = anexo.arquivo.name
+    anexo.tamanho_original = tamanho_original
+    campos = ['tamanho_original']
+    if novos is not None:
+        nome = nome_com_extensao(anexo.nome_original or os.path.basename(antigo), anexo.tipo_conteudo)
+        anexo.arquivo.save(nome, ContentFile(novos), save=False)
+        campos.append('arquivo')
+        if settings.IMAGEM_MANTER_ORIGINAL:
+            anexo.arquivo_original.name = antigo
+            campos.append('arquivo_original')
+
+    with transaction.atomic():
+        vigente = type(anexo).objects.select_for_update().filter(pk=anexo.pk, arquivo=antigo).exists()
+        if vigente:
+            anexo.save(update_fields=campos)
+    if not vigente:
+        if novos is not None:
+            anexo.arquivo.storage.delete(anexo.arquivo.name)
+        return False
+    if novos is not None and not settings.IMAGEM_MANTER_ORIGINAL:
+        anexo.arquivo.storage.delete(antigo)
+    return True
+
+
+def otimizar_anexo(anexo):
+    """Recomprime um anexo já gravado. True se foi processado (mesmo sem ganho)."""
+    try:
+        with anexo.arquivo.open('rb') as arquivo:
+            dados = arquivo.read()
+        novos = resultado(submeter(dados, anexo.tipo_conteudo))
+        return gravar(anexo, len(dados), novos)
+    except TempoEsgotado:
+        logger.warning(
+            'Recompressão do anexo #%s excedeu %ss; mantendo o original.', anexo.pk, settings.IMAGEM_TIMEOUT,
+        )
+    except Exception:
+        logger.exception('Falha ao recomprimir o anexo #%s; mantendo o original.', anexo.pk)
+    return False
+
+
+def _otimizar_pendentes(anexo_ids):
+    from .models import GastoAnexo
+
+    try:
+        pendentes = GastoAnexo.objects.filter(
+            pk__in=anexo_ids, tipo_conteudo__in=FORMATOS, tamanho_original__isnull=True,
+        ).exclude(arquivo='')
+        for anexo in pendentes:
+            otimizar_anexo(anexo)
+    except Exception:
+        logger.exception('Falha na fila de recompressão de imagens.')
+    finally:
+        connection.close()
+
+
+def agendar(anexo_ids):
+    """
+    Põe os anexos na fila da thread de recompressão deste processo. Chamar após o
+    commit (transaction.on_commit), para a thread enxergar os registros.
+    """
+    global _fila, _fila_pid
+    if not anexo_ids or not disponivel():
+        return
+    if _fila is None or _fila_pid != os.getpid():
+        _fila = ThreadPoolExecutor(max_workers=1, thread_name_prefix='imagens')
+        _fila_pid = os.getpid()
+    _fila.submit(_otimizar_pendentes, list(anexo_ids))
@@ -0,0 +1,149 @@
+# cartoes_app/limites.py
+import math
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import Error, Tags, register
+from django.http import HttpResponse
+
+UNIDADES = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def interpretar_taxa(taxa):
+    """'10/m' -> (10, 60). Vazio ou '0/...' desativa."""
+    if not taxa:
+        return 0, 0
+    quantidade, unidade = taxa.split('/')
+    return int(quantidade), UNIDADES[unidade.strip().lower()[0]]
+
+
+def _cache():
+    return caches[settings.RATE_LIMIT_CACHE]
+
+
+def ip_cliente(request):
+    if settings.RATE_LIMIT_TRUST_X_FORWARDED_FOR:
+        encaminhado = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if encaminhado:
+            # o último endereço é o acrescentado pelo nosso proxy
+            return encaminhado.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def consumir(chave, limite, janela):
+    """
+    Janela deslizante aproximada (contador da janela atual + fração da anterior),
+    com incr atômico no cache. Retorna 0 se liberado ou os segundos de espera.
+    """
+    cache = _cache()
+    agora = time.time()
+    indice = int(agora // janela)
+    atual = f'limite:{chave}:{indice}'
+    cache.add(atual, 0, janela * 2)
+    try:
+        usados = cache.incr(atual)
+    except ValueError:  # expirou entre o add e o incr
+        cache.set(atual, 1, janela * 2)
+        usados = 1
+
+    decorrido = agora - indice * janela
+    anteriores = cache.get(f'limite:{chave}:{indice - 1}', 0)
+    estimado = usados + anteriores * (1 - decorrido / janela)
+    if estimado <= limite:
+        return 0
+    return max(1, math.ceil(janela - decorrido))
+
+
+@contextmanager
+def concorrencia(chave, maximo, timeout=120):
+    """
+    Conta requisições em andamento no cache (compartilhado entre workers com
+    CACHE_URL). Entra com True se houver vaga. Cada entrada renova o timeout, que
+    só expira depois de `timeout` segundos sem requisições novas e limpa contagens
+    deixadas por um worker que morreu no meio da requisição.
+    """
+    cache = _cache()
+    chave = f'concorrencia:{chave}'
+    cache.add(chave, 0, timeout)
+    try:
+        em_andamento = cache.incr(chave)
+        cache.touch(chave, timeout)
+    except ValueError:
+        cache.set(chave, 1, timeout)
+        em_andamento = 1
+    try:
+        yield em_andamento <= maximo
+    finally:
+        try:
+            if cache.decr(chave) < 0:
+                # a contagem expirou com esta requisição em andamento
+                cache.set(chave, 0, timeout)
+        except ValueError:
+            pass
+
+
+CACHES_LOCAIS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def verificar_cache_concorrencia(app_configs, **kwargs):
+    """Os limites de concorrência só valem com um cache compartilhado entre os workers."""
+    maximos = [nome for nome in ('LOGIN_MAX_CONCORRENTES', 'GASTOS_MAX_CONCORRENTES') if getattr(settings, nome, 0)]
+    backend = settings.CACHES.get(settings.RATE_LIMIT_CACHE, {}).get('BACKEND')
+    if not settings.RATE_LIMIT_ENABLED or not maximos or backend not in CACHES_LOCAIS:
+        return []
+    return [Error(
+        f'Os limites de concorrência ({", ".join(maximos)}) exigem um cache compartilhado entre os workers, '
+        f'mas RATE_LIMIT_CACHE={settings.RATE_LIMIT_CACHE!r} usa {backend}.',
+        hint='Configure CACHE_URL (Redis) ou zere os limites de concorrência.',
+        id='cartoes_app.E001',
+    )]
+
+
+def resposta_limite(retry_after, mensagem='Muitas requisições. Tente novamente em instantes.'):
+    response = HttpResponse(mensagem, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def limitar(escopo, taxa, concorrentes=None, metodos=('POST',), campo_usuario=None):
+    """
+    Limita uma view por IP e por usuário. `taxa` e `concorrentes` são nomes de
+    settings (lidos a cada requisição), ex: limitar('login', 'RATE_LIMIT_LOGIN').
+    Para quem ainda não está autenticado, `campo_usuario` indica o campo do
+    POST que identifica a conta (ex: 'username' no login).
+    """
+    def decorator(view):
+        @wraps(view)
+        def _view(request, *args, **kwargs):
+            if not settings.RATE_LIMIT_ENABLED or request.method not in metodos:
+                return view(request, *args, **kwargs)
+
+            limite, janela = interpretar_taxa(getattr(settings, taxa))
+            if limite:
+                chaves = [f'{escopo}:ip:{ip_cliente(request)}']
+                if request.user.is_authenticated:
+                    chaves.append(f'{escopo}:usuario:{request.user.pk}')
+                elif campo_usuario and request.POST.get(campo_usuario):
+                    # por IP + conta: tentativas de terceiros não bloqueiam o dono da conta
+                    conta = request.POST[campo_usuario].strip().lower()[:150]
+                    chaves.append(f'{escopo}:conta:{ip_cliente(request)}:{conta}')
+                espera = max(consumir(chave, limite, janela) for chave in chaves)
+                if espera:
+                    return resposta_limite(espera)
+
+            maximo = getattr(settings, concorrentes) if concorrentes else 0
+            if not maximo:
+                return view(request, *args, **kwargs)
+            with concorrencia(escopo, maximo) as liberado:
+                if not liberado:
+                    return resposta_limite(1, 'Servidor ocupado. Tente novamente em instantes.')
+                return view(request, *args, **kwargs)
+        return _view
+    return decorator
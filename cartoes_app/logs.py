@@ -0,0 +1,181 @@
+# cartoes_app/logs.py
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import empty
+
+logger_acesso = logging.getLogger('creditmanager.acesso')
+
+_request_id = ContextVar('request_id', default=None)
+RE_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# Atributos que todo LogRecord tem; o resto veio de extra={...}
+ATRIBUTOS_PADRAO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class FiltroRequestId(logging.Filter):
+    """Acrescenta o request_id da requisição atual a qualquer log emitido durante ela."""
+
+    def filter(self, record):
+        if not hasattr(record, 'request_id'):
+            # django.request registra 404/500 depois que o middleware já terminou
+            request = getattr(record, 'request', None)
+            record.request_id = getattr(request, 'request_id', None) or _request_id.get()
+        return True
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro (journald/jq), com os campos de extra={...}."""
+
+    def format(self, record):
+        dados = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for chave, valor in vars(record).items():
+            if chave not in ATRIBUTOS_PADRAO and valor is not None and not chave.startswith('_'):
+                dados[chave] = valor
+        if record.exc_info:
+            dados['exc'] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+class HandlerAssincrono(QueueHandler):
+    """
+    Coloca o registro já formatado numa fila e uma thread escreve no stderr,
+    então o worker nunca espera pela escrita. Com a fila cheia o registro é
+    descartado (e contado) em vez de bloquear; quando a fila volta a ter espaço,
+    um aviso informa quantos se perderam. A thread é criada no primeiro log de
+    cada processo, o que funciona com o fork dos workers do gunicorn.
+    """
+
+    def __init__(self, tamanho_fila=10000):
+        super().__init__(queue.Queue(tamanho_fila))
+        self.descartados = 0
+        self._pid = None
+        self._listener = None
+
+    def _iniciar(self):
+        # após o fork: fila nova (a herdada pode ter estado inconsistente)
+        self.queue = queue.Queue(self.queue.maxsize)
+        destino = logging.StreamHandler(sys.stderr)
+        destino.setFormatter(logging.Formatter('%(message)s'))
+        self._listener = QueueListener(self.queue, destino)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._iniciar()
+        try:
+            if self.descartados:
+                self.queue.put_nowait(self._aviso_descartados())
+                self.descartados = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+    def _aviso_descartados(self):
+        aviso = logging.LogRecord(
+            __name__, logging.WARNING, __file__, 0,
+            '%d registros de log descartados: fila cheia.', (self.descartados,), None,
+        )
+        aviso.descartados = self.descartados
+        return self.prepare(aviso)
+
+    def close(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+        super().close()
+
+
+class _TempoBanco:
+    """execute_wrapper que soma tempo e quantidade de consultas."""
+
+    def __init__(self):
+        self.segundos = 0.0
+        self.consultas = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+class LogAcessoMiddleware:
+    """
+    Log de acesso estruturado: request_id, usuário, view, status, duração e
+    tempo de banco. Requisições rápidas e bem-sucedidas são amostradas
+    (LOG_ACESSO_AMOSTRAGEM); erros e lentas são sempre registradas.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recebido = request.headers.get('X-Request-ID', '')
+        request.request_id = recebido if RE_REQUEST_ID.match(recebido) else uuid.uuid4().hex
+        token = _request_id.set(request.request_id)
+        banco = _TempoBanco()
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(banco))
+                response = self.get_response(request)
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            response['X-Request-ID'] = request.request_id
+            if self._registrar(response.status_code, duracao_ms):
+                self._log(request, response, duracao_ms, banco)
+            return response
+        finally:
+            _request_id.reset(token)
+
+    def _registrar(self, status, duracao_ms):
+        if status >= 400 or duracao_ms >= settings.LOG_ACESSO_LENTO_MS:
+            return True
+        taxa = settings.LOG_ACESSO_AMOSTRAGEM
+        return taxa >= 1 or random.random() < taxa
+
+    def _log(self, request, response, duracao_ms, banco):
+        usuario = getattr(request, 'user', None)
+        # não força a leitura da sessão só para o log
+        if usuario is not None and getattr(usuario, '_wrapped', None) is not empty:
+            usuario_id = usuario.pk if usuario.is_authenticated else None
+        else:
+            usuario_id = None
+        match = request.resolver_match
+        logger_acesso.info(
+            '%s %s %s %.0fms', request.method, request.path, response.status_code, duracao_ms,
+            extra={
+                'request_id': request.request_id,
+                'metodo': request.method,
+                'caminho': request.path,
+                'status': response.status_code,
+                'duracao_ms': round(duracao_ms, 1),
+                'banco_ms': round(banco.segundos * 1000, 1),
+                'consultas': banco.consultas,
+                'usuario_id': usuario_id,
+                'view': match.view_name if match else None,
+                'amostragem': settings.LOG_ACESSO_AMOSTRAGEM,
+            },
+        )
@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência de uma requisição simulada (SELECT 1) abrindo uma conexão '
+        'nova a cada vez versus a configuração atual (CONN_MAX_AGE / pool).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=200)
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        n = options['requisicoes']
+        connection = connections[options['database']]
+        cfg = connection.settings_dict
+        pool = cfg.get('OPTIONS', {}).get('pool')
+
+        self.stdout.write(
+            f"Banco: {cfg['ENGINE']} | CONN_MAX_AGE={cfg.get('CONN_MAX_AGE')} | "
+            f"CONN_HEALTH_CHECKS={cfg.get('CONN_HEALTH_CHECKS')} | pool={pool or 'não'}"
+        )
+
+        # Sem reaproveitamento: abre e fecha uma conexão física por requisição
+        params = connection.get_connection_params()
+        params.pop('pool', None)
+
+        def sem_reuso():
+            conn = connection.Database.connect(**params)
+            try:
+                cur = conn.cursor()
+                cur.execute('SELECT 1')
+                cur.fetchone()
+            finally:
+                conn.close()
+
+        # Configuração atual: mesmo ciclo de sinais de uma requisição do Django
+        def configuracao_atual():
+            request_started.send(sender=self.__class__)
+            try:
+                with connection.cursor() as cur:
+                    cur.execute('SELECT 1')
+                    cur.fetchone()
+            finally:
+                request_finished.send(sender=self.__class__)
+
+        for nome, fn in (('sem reaproveitamento', sem_reuso), ('configuração atual', configuracao_atual)):
+            fn()  # aquece (primeira conexão / abertura do pool)
+            tempos = []
+            for _ in range(n):
+                inicio = time.perf_counter()
+                fn()
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            tempos.sort()
+            p95 = tempos[int(len(tempos) * 0.95) - 1] if len(tempos) >= 20 else tempos[-1]
+            self.stdout.write(
+                f'{nome:>22}: média {statistics.mean(tempos):.3f} ms | '
+                f'p50 {statistics.median(tempos):.3f} ms | p95 {p95:.3f} ms'
+            )
+
+        connection.close()
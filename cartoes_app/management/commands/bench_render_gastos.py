@@ -0,0 +1,82 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.contrib.messages.storage import default_storage as messages_storage
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory, override_settings
+
+from cartoes_app.models import CartaoCredito, Gasto, GastoAnexo
+from cartoes_app.views import gastos_view
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o tempo de resposta de gastos_view (consultas + renderização) para um '
+        'usuário com N gastos, com e sem cache de fragmentos. Os dados são criados '
+        'dentro de uma transação desfeita ao final.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gastos', type=int, default=500)
+        parser.add_argument('--cartoes', type=int, default=5)
+        parser.add_argument('--repeticoes', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self._popular(options['gastos'], options['cartoes'])
+
+            with override_settings(TEMPLATE_FRAGMENT_TIMEOUT=0):
+                self._medir('sem cache de fragmentos', user, options['repeticoes'])
+
+            frio = self._requisicao(user)
+            self.stdout.write(f'{"1ª renderização (frio)":>26}: {frio:.1f} ms')
+            self._medir('cache de fragmentos', user, options['repeticoes'])
+
+            transaction.set_rollback(True)
+
+    def _popular(self, n_gastos, n_cartoes):
+        user = User.objects.create_user(username=f'bench-{time.time_ns()}')
+        organizacao = user.perfil.organizacao
+        cartoes = CartaoCredito.objects.bulk_create([
+            CartaoCredito(
+                organizacao=organizacao, usuario=user, nome=f'Cartão {i}', numero=f'{i:016d}',
+                mes_vencimento=1, ano_vencimento=2030, limite=Decimal('5000'), bandeira='visa',
+            )
+            for i in range(n_cartoes)
+        ])
+        gastos = Gasto.objects.bulk_create([
+            Gasto(
+                organizacao=organizacao, usuario=user, cartao=cartoes[i % n_cartoes],
+                descricao=f'Gasto {i}', valor=Decimal('12.34'),
+            )
+            for i in range(n_gastos)
+        ])
+        GastoAnexo.objects.bulk_create([
+            GastoAnexo(gasto=g, arquivo=f'gastos/bench-{g.pk}.{"png" if i % 2 else "pdf"}', nome_original='bench')
+            for i, g in enumerate(gastos[::4])
+        ])
+        return user
+
+    def _requisicao(self, user):
+        request = RequestFactory().get('/gastos/', {'periodo': 'todos'})
+        request.user = user
+        request.organizacao = user.perfil.organizacao
+        request.session = SessionBase()
+        request._messages = messages_storage(request)
+        inicio = time.perf_counter()
+        response = gastos_view(request)
+        decorrido = (time.perf_counter() - inicio) * 1000
+        assert response.status_code == 200, response.status_code
+        return decorrido
+
+    def _medir(self, nome, user, repeticoes):
+        self._requisicao(user)
+        tempos = [self._requisicao(user) for _ in range(repeticoes)]
+        self.stdout.write(
+            f'{nome:>26}: média {statistics.mean(tempos):.1f} ms | '
+            f'p50 {statistics.median(tempos):.1f} ms | mín {min(tempos):.1f} ms'
+        )
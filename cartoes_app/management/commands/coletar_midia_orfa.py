@@ -0,0 +1,151 @@
+import hashlib
+import math
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from cartoes_app.models import Gasto, GastoAnexo, RemocaoArquivoPendente
+
+PASTA_ANEXOS = 'gastos'
+VARIANTES = ('.gz', '.br')  # irmãos pré-comprimidos (MidiaImutavelStorage)
+
+
+class FiltroBloom:
+    """Conjunto aproximado em memória fixa: sem falsos negativos, falsos positivos ~p."""
+
+    def __init__(self, capacidade, taxa_falso_positivo):
+        capacidade = max(capacidade, 1)
+        self.m = max(8, int(-capacidade * math.log(taxa_falso_positivo) / (math.log(2) ** 2)))
+        self.k = max(1, round(self.m / capacidade * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+
+    def _posicoes(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def add(self, item):
+        for pos in self._posicoes(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._posicoes(item))
+
+
+def percorrer(pasta):
+    """Percorre a árvore com os.scandir, sem montar listas de diretório em memória."""
+    pilha = [pasta]
+    while pilha:
+        atual = pilha.pop()
+        try:
+            with os.scandir(atual) as entradas:
+                for entrada in entradas:
+                    if entrada.is_dir(follow_symlinks=False):
+                        pilha.append(entrada.path)
+                    elif entrada.is_file(follow_symlinks=False):
+                        yield entrada
+        except FileNotFoundError:
+            continue
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara media/gastos/ com GastoAnexo.arquivo e informa arquivos órfãos (sem registro) '
+        'e registros sem arquivo. Memória limitada: os nomes do banco vão para um filtro de Bloom '
+        'montado em lotes e o disco é lido em streaming com os.scandir.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apagar', action='store_true', help='Apaga os arquivos órfãos encontrados.')
+        parser.add_argument(
+            '--idade-minima', type=int, default=60,
+            help='Ignora arquivos modificados há menos de N minutos (uploads em andamento).',
+        )
+        parser.add_argument('--falso-positivo', type=float, default=0.001)
+        parser.add_argument('--lote', type=int, default=5000)
+        parser.add_argument(
+            '--faltantes', action='store_true',
+            help='Também verifica registros cujo arquivo não existe (com --apagar, remove esses registros).',
+        )
+        parser.add_argument('--listar', type=int, default=20, help='Quantos nomes exibir de cada tipo.')
+
+    def handle(self, *args, **options):
+        raiz = os.fspath(settings.MEDIA_ROOT)
+        pasta = os.path.join(raiz, PASTA_ANEXOS)
+        if not os.path.isdir(pasta):
+            raise CommandError(f'Pasta não encontrada: {pasta}')
+        if not 0 < options['falso_positivo'] < 1:
+            raise CommandError('--falso-positivo deve estar entre 0 e 1.')
+
+        anexos = GastoAnexo.objects.exclude(arquivo='').order_by()
+        originais = GastoAnexo.objects.exclude(arquivo_original='').order_by()
+        filtro = FiltroBloom(anexos.count() + originais.count(), options['falso_positivo'])
+        for nome in anexos.values_list('arquivo', flat=True).iterator(chunk_size=options['lote']):
+            filtro.add(nome)
+        for nome in originais.values_list('arquivo_original', flat=True).iterator(chunk_size=options['lote']):
+            filtro.add(nome)
+        self.stdout.write(f'Índice: {filtro.m // 8 // 1024} KiB, {filtro.k} funções de hash.')
+
+        limite_mtime = time.time() - options['idade_minima'] * 60
+        verificados = orfaos = bytes_orfaos = 0
+        for entrada in percorrer(pasta):
+            verificados += 1
+            nome = os.path.relpath(entrada.path, raiz).replace(os.sep, '/')
+            base = nome[:-3] if nome.endswith(VARIANTES) else nome
+            if base in filtro:
+                continue
+            stat = entrada.stat(follow_symlinks=False)
+            if stat.st_mtime > limite_mtime:
+                continue
+
+            orfaos += 1
+            bytes_orfaos += stat.st_size
+            if orfaos <= options['listar']:
+                self.stdout.write(f'  órfão: {nome}')
+            if options['apagar']:
+                try:
+                    os.remove(entrada.path)
+                except FileNotFoundError:
+                    pass
+
+        acao = 'apagados' if options['apagar'] else 'encontrados'
+        self.stdout.write(
+            f'{verificados} arquivos verificados; {orfaos} órfãos {acao} '
+            f'({bytes_orfaos / (1024 * 1024):.1f} MiB).'
+        )
+
+        if options['faltantes']:
+            faltantes = []
+            linhas = anexos.values_list('pk', 'arquivo').iterator(chunk_size=options['lote'])
+            for pk, nome in linhas:
+                if not os.path.exists(os.path.join(raiz, nome)):
+                    faltantes.append(pk)
+                    if len(faltantes) <= options['listar']:
+                        self.stdout.write(f'  sem arquivo: GastoAnexo #{pk} ({nome})')
+            if options['apagar']:
+                for inicio in range(0, len(faltantes), options['lote']):
+                    self._remover_registros(faltantes[inicio:inicio + options['lote']])
+            self.stdout.write(f'{len(faltantes)} registros sem arquivo no disco {acao}.')
+
+    def _remover_registros(self, pks):
+        """
+        DELETE direto dos anexos sem arquivo. Sem o post_delete, faz aqui o que ele
+        faria: muda a versão dos gastos (cache das linhas) e manda o arquivo_original,
+        que continua no disco, para a fila do varrer_arquivos_removidos.
+        """
+        with transaction.atomic():
+            removidos = GastoAnexo.objects.filter(pk__in=pks)
+            gasto_ids = set()
+            pendentes = []
+            for gasto_id, original in removidos.values_list('gasto_id', 'arquivo_original'):
+                gasto_ids.add(gasto_id)
+                if original:
+                    pendentes.append(RemocaoArquivoPendente(arquivo=original))
+            RemocaoArquivoPendente.objects.bulk_create(pendentes)
+            removidos._raw_delete(removidos.db)
+            Gasto.objects.filter(pk__in=gasto_ids).update(atualizado_em=timezone.now())
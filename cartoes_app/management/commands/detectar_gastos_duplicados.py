@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+
+from cartoes_app.duplicados import normalizar_descricao
+from cartoes_app.models import Gasto
+
+
+class Command(BaseCommand):
+    help = (
+        'Lista gastos duplicados: idênticos (mesma impressão digital, agrupados no banco '
+        'pelo índice) e quase idênticos (mesmo cartão, valor e descrição com datas '
+        'próximas), numa única leitura ordenada da tabela.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--janela', type=int, default=3,
+            help='Diferença máxima em dias para considerar dois gastos quase idênticos.',
+        )
+        parser.add_argument('--usuario', type=int, help='Restringe a um usuário (id).')
+        parser.add_argument('--lote', type=int, default=5000)
+        parser.add_argument('--listar', type=int, default=50, help='Quantos grupos exibir de cada tipo.')
+
+    def handle(self, *args, **options):
+        gastos = Gasto.objects.order_by()
+        if options['usuario']:
+            gastos = gastos.filter(usuario_id=options['usuario'])
+
+        # 1) Idênticos: GROUP BY no índice de impressao_digital
+        grupos = (
+            gastos.exclude(impressao_digital='')
+            .values('impressao_digital')
+            .annotate(total=Count('id'), primeiro=Min('id'))
+            .filter(total__gt=1)
+            .order_by('primeiro')
+        )
+        exatos = 0
+        for grupo in grupos.iterator(chunk_size=options['lote']):
+            exatos += 1
+            if exatos <= options['listar']:
+                ids = list(
+                    gastos.filter(impressao_digital=grupo['impressao_digital'])
+                    .order_by('id').values_list('id', flat=True)
+                )
+                self.stdout.write(f'  idênticos: {ids}')
+        self.stdout.write(f'{exatos} grupos de gastos idênticos.')
+
+        # 2) Quase idênticos: leitura ordenada por (cartão, valor, data) e janela deslizante
+        janela = timedelta(days=options['janela'])
+        linhas = (
+            gastos.order_by('cartao_id', 'valor', 'data', 'id')
+            .values_list('id', 'cartao_id', 'valor', 'data', 'descricao', 'impressao_digital')
+            .iterator(chunk_size=options['lote'])
+        )
+        proximos = 0
+        recentes = []  # gastos do mesmo (cartão, valor) dentro da janela
+        for gasto_id, cartao_id, valor, data, descricao, impressao in linhas:
+            if recentes and (recentes[0][1], recentes[0][2]) != (cartao_id, valor):
+                recentes = []
+            recentes = [r for r in recentes if data - r[3] <= janela]
+
+            descricao = normalizar_descricao(descricao)
+            for outro in recentes:
+                # mesma data e descrição já aparece como idêntico acima
+                if outro[4] == descricao and outro[5] != impressao:
+                    proximos += 1
+                    if proximos <= options['listar']:
+                        self.stdout.write(
+                            f'  quase idênticos: #{outro[0]} ({outro[3]}) e #{gasto_id} ({data}) '
+                            f'- R$ {valor} "{descricao}"'
+                        )
+                    break
+            recentes.append((gasto_id, cartao_id, valor, data, descricao, impressao))
+        self.stdout.write(f'{proximos} pares de gastos quase idênticos (janela de {options["janela"]} dias).')
@@ -0,0 +1,105 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from cartoes_app import imagens
+from cartoes_app.models import GastoAnexo
+
+MIB = 1024 * 1024
+
+
+def _mib(valor):
+    return f'{valor / MIB:.1f} MiB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomprime as fotos de comprovante já gravadas (JPEG/PNG/WEBP ainda não otimizadas) '
+        'com IMAGEM_LADO_MAXIMO e IMAGEM_QUALIDADE, usando o pool de processos, e informa o '
+        'espaço economizado. Com IMAGEM_MANTER_ORIGINAL o arquivo anterior vira arquivo_original.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Só calcula a economia, sem gravar nada.')
+        parser.add_argument('--lote', type=int, default=50, help='Imagens lidas e enviadas ao pool por vez.')
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de anexos nesta execução.')
+        parser.add_argument(
+            '--relatorio', action='store_true',
+            help='Só mostra o total economizado pelas imagens já otimizadas.',
+        )
+
+    def handle(self, *args, **options):
+        if options['relatorio']:
+            return self._relatorio()
+        if imagens.Image is None:
+            raise CommandError('Pillow não está instalado (pip install Pillow).')
+
+        pendentes = (
+            GastoAnexo.objects.filter(tipo_conteudo__in=imagens.FORMATOS, tamanho_original__isnull=True)
+            .exclude(arquivo='')
+            .only('id', 'gasto_id', 'arquivo', 'nome_original', 'tipo_conteudo')
+            .order_by('pk')
+        )
+        ultimo = 0
+        processados = recomprimidos = falhas = 0
+        bytes_antes = bytes_depois = 0
+        while options['limite'] is None or processados + falhas < options['limite']:
+            tamanho = options['lote']
+            if options['limite'] is not None:
+                tamanho = min(tamanho, options['limite'] - processados - falhas)
+            lote = list(pendentes.filter(pk__gt=ultimo)[:tamanho])
+            if not lote:
+                break
+            ultimo = lote[-1].pk
+
+            # lê o lote e deixa o pool codificar em paralelo
+            tarefas = []
+            for anexo in lote:
+                try:
+                    with anexo.arquivo.open('rb') as arquivo:
+                        dados = arquivo.read()
+                except OSError as exc:
+                    falhas += 1
+                    self.stderr.write(f'  #{anexo.pk} {anexo.arquivo.name}: {exc}')
+                    continue
+                tarefas.append((anexo, dados, imagens.submeter(dados, anexo.tipo_conteudo)))
+
+            for anexo, dados, futuro in tarefas:
+                try:
+                    novos = imagens.resultado(futuro)
+                except Exception as exc:
+                    falhas += 1
+                    self.stderr.write(f'  #{anexo.pk} {anexo.arquivo.name}: {exc!r}')
+                    continue
+                processados += 1
+                bytes_antes += len(dados)
+                bytes_depois += len(novos) if novos else len(dados)
+                if novos:
+                    recomprimidos += 1
+                if not options['simular']:
+                    imagens.gravar(anexo, len(dados), novos)
+            self.stdout.write(
+                f'{processados} processadas, economia até agora {_mib(bytes_antes - bytes_depois)}'
+            )
+
+        acao = 'seriam recomprimidas' if options['simular'] else 'recomprimidas'
+        percentual = (1 - bytes_depois / bytes_antes) * 100 if bytes_antes else 0
+        self.stdout.write(
+            f'{processados} imagens processadas, {recomprimidos} {acao}, {falhas} falhas. '
+            f'{_mib(bytes_antes)} -> {_mib(bytes_depois)}: '
+            f'{_mib(bytes_antes - bytes_depois)} economizados ({percentual:.0f}%).'
+        )
+
+    def _relatorio(self):
+        otimizadas = GastoAnexo.objects.filter(tamanho_original__isnull=False).order_by()
+        totais = otimizadas.aggregate(quantidade=Count('id'), antes=Sum('tamanho_original'))
+        atual = 0
+        for anexo in otimizadas.only('id', 'arquivo').iterator(chunk_size=2000):
+            try:
+                atual += anexo.arquivo.size
+            except OSError:
+                pass
+        antes = totais['antes'] or 0
+        self.stdout.write(
+            f'{totais["quantidade"]} imagens otimizadas: {_mib(antes)} originais, {_mib(atual)} hoje, '
+            f'{_mib(antes - atual)} economizados.'
+        )
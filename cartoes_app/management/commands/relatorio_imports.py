@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Inicia a aplicação WSGI em um processo separado com "python -X importtime" '
+        'e lista os imports mais lentos da inicialização do worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=25, help='Quantidade de imports listados.')
+        parser.add_argument(
+            '--ordenar', choices=('acumulado', 'proprio'), default='acumulado',
+            help='acumulado = inclui sub-imports; proprio = só o tempo do módulo.',
+        )
+        parser.add_argument('--aquecer', action='store_true', help='Inclui o aquecimento (WARMUP_ON_START).')
+
+    def handle(self, *args, **options):
+        env = os.environ.copy()
+        env['DJANGO_SETTINGS_MODULE'] = os.environ.get('DJANGO_SETTINGS_MODULE', 'creditmanager.settings')
+        env['WARMUP_ON_START'] = 'True' if options['aquecer'] else 'False'
+
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import creditmanager.wsgi'],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise CommandError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else 'falha ao iniciar')
+
+        linhas = []
+        for linha in proc.stderr.splitlines():
+            if not linha.startswith('import time:'):
+                continue
+            partes = linha[len('import time:'):].split('|')
+            if len(partes) != 3 or not partes[0].strip().isdigit():
+                continue
+            proprio, acumulado = int(partes[0]), int(partes[1])
+            linhas.append((proprio, acumulado, partes[2].rstrip()))
+
+        if not linhas:
+            raise CommandError('Nenhuma linha de -X importtime encontrada.')
+
+        # Imports de topo (sem indentação) somam o tempo total de inicialização
+        total_us = sum(acc for _, acc, nome in linhas if not nome[1:].startswith(' '))
+        indice = 0 if options['ordenar'] == 'proprio' else 1
+        linhas.sort(key=lambda item: item[indice], reverse=True)
+
+        self.stdout.write(f'{len(linhas)} módulos importados em {total_us / 1000:.1f} ms\n')
+        self.stdout.write(f"{'próprio (ms)':>13} {'acumulado (ms)':>15}  módulo")
+        for proprio, acumulado, nome in linhas[:options['top']]:
+            self.stdout.write(f'{proprio / 1000:>13.1f} {acumulado / 1000:>15.1f}  {nome.strip()}')
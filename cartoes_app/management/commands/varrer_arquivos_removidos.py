@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from cartoes_app.exclusao import varrer_remocoes_pendentes
+from cartoes_app.models import RemocaoArquivoPendente
+
+
+class Command(BaseCommand):
+    help = (
+        'Remove do storage os arquivos de anexos apagados em lote (fila RemocaoArquivoPendente). '
+        'Pode rodar periodicamente via cron/systemd timer.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500)
+        parser.add_argument('--limite', type=int, default=None, help='Máximo de arquivos nesta execução.')
+
+    def handle(self, *args, **options):
+        processados = varrer_remocoes_pendentes(tamanho_lote=options['lote'], limite=options['limite'])
+        restantes = RemocaoArquivoPendente.objects.count()
+        self.stdout.write(f'{processados} arquivos removidos; {restantes} ainda na fila.')
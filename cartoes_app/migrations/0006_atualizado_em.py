@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 12:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0005_merge_20251003_1157'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartaocredito',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='gasto',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
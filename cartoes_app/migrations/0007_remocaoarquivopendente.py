@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0006_atualizado_em'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RemocaoArquivoPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('arquivo', models.CharField(max_length=255)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+EXTENSOES = {
+    'application/pdf': ('.pdf',),
+    'image/png': ('.png',),
+    'image/jpeg': ('.jpg', '.jpeg'),
+    'image/gif': ('.gif',),
+    'image/webp': ('.webp',),
+}
+
+
+def preencher_tipo_por_extensao(apps, schema_editor):
+    # Anexos antigos não passaram pela detecção; usa a extensão (um UPDATE por extensão)
+    GastoAnexo = apps.get_model('cartoes_app', 'GastoAnexo')
+    for tipo, extensoes in EXTENSOES.items():
+        for ext in extensoes:
+            GastoAnexo.objects.filter(tipo_conteudo='', arquivo__iendswith=ext).update(tipo_conteudo=tipo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0007_remocaoarquivopendente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gastoanexo',
+            name='tipo_conteudo',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.RunPython(preencher_tipo_por_extensao, migrations.RunPython.noop),
+    ]
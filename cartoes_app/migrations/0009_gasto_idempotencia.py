@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-19 14:40
+
+import datetime
+import hashlib
+import re
+import unicodedata
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+# Cópia de cartoes_app.duplicados na época desta migração: mudanças futuras
+# lá não podem alterar o que ela grava.
+def impressao_digital(usuario_id, cartao_id, valor, data, descricao):
+    texto = unicodedata.normalize('NFKD', descricao or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    descricao = re.sub(r'\s+', ' ', texto).strip().lower()
+    if isinstance(data, datetime.datetime):
+        data = data.date()
+    valor = Decimal(valor).quantize(Decimal('0.01'))
+    bruto = f'{usuario_id}|{cartao_id}|{valor}|{data.isoformat()}|{descricao}'
+    return hashlib.sha256(bruto.encode('utf-8')).hexdigest()
+
+
+def preencher_impressao_digital(apps, schema_editor):
+    Gasto = apps.get_model('cartoes_app', 'Gasto')
+    lote = []
+    for gasto in Gasto.objects.only('id', 'usuario_id', 'cartao_id', 'valor', 'data', 'descricao').iterator(chunk_size=2000):
+        gasto.impressao_digital = impressao_digital(
+            gasto.usuario_id, gasto.cartao_id, gasto.valor, gasto.data, gasto.descricao,
+        )
+        lote.append(gasto)
+        if len(lote) >= 2000:
+            Gasto.objects.bulk_update(lote, ['impressao_digital'])
+            lote = []
+    if lote:
+        Gasto.objects.bulk_update(lote, ['impressao_digital'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0008_gastoanexo_tipo_conteudo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gasto',
+            name='chave_idempotencia',
+            field=models.UUIDField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='gasto',
+            name='impressao_digital',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AddConstraint(
+            model_name='gasto',
+            constraint=models.UniqueConstraint(condition=models.Q(('chave_idempotencia__isnull', False)), fields=('chave_idempotencia',), name='gasto_chave_idempotencia_unica'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['cartao', 'valor', 'data'], name='gasto_cartao_valor_data_idx'),
+        ),
+        migrations.RunPython(preencher_impressao_digital, migrations.RunPython.noop),
+    ]
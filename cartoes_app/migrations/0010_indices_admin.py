@@ -0,0 +1,25 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0009_gasto_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['-data', '-id'], name='gasto_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['usuario', '-data', '-id'], name='gasto_usuario_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gastoanexo',
+            index=models.Index(fields=['uploaded_at'], name='gastoanexo_uploaded_at_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0010_indices_admin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gastoanexo',
+            name='tamanho_original',
+            field=models.PositiveBigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='gastoanexo',
+            name='arquivo_original',
+            field=models.FileField(blank=True, editable=False, upload_to='gastos/originais/'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def criar_organizacao_padrao(apps, schema_editor):
+    """Tudo o que já existe vai para a organização padrão."""
+    Organizacao = apps.get_model('cartoes_app', 'Organizacao')
+    PerfilUsuario = apps.get_model('cartoes_app', 'PerfilUsuario')
+    CartaoCredito = apps.get_model('cartoes_app', 'CartaoCredito')
+    Gasto = apps.get_model('cartoes_app', 'Gasto')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    padrao, _ = Organizacao.objects.get_or_create(slug=settings.ORGANIZACAO_PADRAO, defaults={'nome': 'Padrão'})
+    sem_perfil = User.objects.filter(perfil__isnull=True).values_list('pk', flat=True)
+    PerfilUsuario.objects.bulk_create(
+        [PerfilUsuario(usuario_id=pk, organizacao=padrao) for pk in sem_perfil.iterator(chunk_size=2000)],
+        batch_size=2000,
+    )
+    CartaoCredito.objects.filter(organizacao__isnull=True).update(organizacao=padrao)
+    Gasto.objects.filter(organizacao__isnull=True).update(organizacao=padrao)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cartoes_app', '0011_gastoanexo_tamanho_original'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Organizacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=120)),
+                ('slug', models.SlugField(unique=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'organização',
+                'verbose_name_plural': 'organizações',
+            },
+        ),
+        migrations.CreateModel(
+            name='PerfilUsuario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('organizacao', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='perfis', to='cartoes_app.organizacao')),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='perfil', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['organizacao', 'usuario'], name='perfil_org_usuario_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='cartaocredito',
+            name='organizacao',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='cartoes', to='cartoes_app.organizacao'),
+        ),
+        migrations.AddField(
+            model_name='gasto',
+            name='organizacao',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='gastos', to='cartoes_app.organizacao'),
+        ),
+        migrations.RunPython(criar_organizacao_padrao, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separada da 0012: no PostgreSQL o ALTER TABLE não pode rodar na mesma
+    # transação do UPDATE que preencheu a chave estrangeira.
+
+    dependencies = [
+        ('cartoes_app', '0012_organizacoes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cartaocredito',
+            name='organizacao',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='cartoes', to='cartoes_app.organizacao'),
+        ),
+        migrations.AlterField(
+            model_name='gasto',
+            name='organizacao',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='gastos', to='cartoes_app.organizacao'),
+        ),
+        migrations.RemoveIndex(
+            model_name='gasto',
+            name='gasto_usuario_data_idx',
+        ),
+        migrations.AddIndex(
+            model_name='cartaocredito',
+            index=models.Index(fields=['organizacao', 'usuario', 'nome'], name='cartao_org_usuario_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['organizacao', 'usuario', '-data', '-id'], name='gasto_org_usuario_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gasto',
+            index=models.Index(fields=['organizacao', 'data'], name='gasto_org_data_idx'),
+        ),
+    ]
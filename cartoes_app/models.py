@@ -1,9 +1,55 @@
 import datetime
+from django.conf import settings
 from django.db import models
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Group
 from django.utils import timezone
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save, m2m_changed
 from django.dispatch import receiver
+from .backends import invalidar_usuario_cache, invalidar_permissoes_cache
+from .duplicados import impressao_digital
+from .eventos import centavos, hub, publicar
+
+
+class Organizacao(models.Model):
+    """Empresa cliente: usuários, cartões e gastos de uma organização não aparecem para as outras."""
+    nome = models.CharField(max_length=120)
+    slug = models.SlugField(unique=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'organização'
+        verbose_name_plural = 'organizações'
+
+    def __str__(self):
+        return self.nome
+
+    @classmethod
+    def padrao(cls):
+        """Organização de quem ainda não tem perfil (a única, em instalações sem multiempresa)."""
+        organizacao, _ = cls.objects.get_or_create(
+            slug=settings.ORGANIZACAO_PADRAO, defaults={'nome': 'Padrão'},
+        )
+        return organizacao
+
+
+class PerfilUsuario(models.Model):
+    usuario = models.OneToOneField(User, on_delete=models.CASCADE, related_name='perfil')
+    organizacao = models.ForeignKey(Organizacao, on_delete=models.PROTECT, related_name='perfis')
+
+    class Meta:
+        indexes = [
+            # listagem dos usuários de uma organização
+            models.Index(fields=['organizacao', 'usuario'], name='perfil_org_usuario_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.usuario} ({self.organizacao})'
+
+
+class DaOrganizacaoQuerySet(models.QuerySet):
+    def da_organizacao(self, organizacao):
+        return self.filter(organizacao=organizacao)
 
 
 class CartaoCredito(models.Model):
@@ -26,6 +72,7 @@ class CartaoCredito(models.Model):
         ano_atual = datetime.date.today().year
         return [(ano, ano) for ano in range(ano_atual, ano_atual + 15)]
 
+    organizacao = models.ForeignKey(Organizacao, on_delete=models.PROTECT, related_name='cartoes')
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cartoes')
     nome = models.CharField(max_length=100)
     numero = models.CharField(max_length=16)
@@ -34,6 +81,14 @@ class CartaoCredito(models.Model):
     limite = models.DecimalField(max_digits=10, decimal_places=2)
     saldo_atual = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # ✅ Novo campo
     bandeira = models.CharField(max_length=20, choices=BANDEIRAS)
+    atualizado_em = models.DateTimeField(auto_now=True)  # versão usada no cache de fragmentos
+
+    objects = DaOrganizacaoQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['organizacao', 'usuario', 'nome'], name='cartao_org_usuario_nome_idx'),
+        ]
 
     def __str__(self):
         return f'{self.nome} - {self.bandeira.upper()}'
@@ -59,33 +114,209 @@ class CartaoCredito(models.Model):
 
 
 class Gasto(models.Model):
+    # Copiada do cartão no save(): filtros por organização sem JOIN
+    organizacao = models.ForeignKey(Organizacao, on_delete=models.PROTECT, related_name='gastos')
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='gastos')
     cartao = models.ForeignKey('CartaoCredito', on_delete=models.CASCADE, related_name='gastos')
     descricao = models.CharField(max_length=200)
     valor = models.DecimalField(max_digits=10, decimal_places=2)
     data = models.DateField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)  # versão usada no cache de fragmentos
+    # Chave enviada pelo formulário: o mesmo POST repetido (duplo clique) não cria outro gasto
+    chave_idempotencia = models.UUIDField(null=True, blank=True, editable=False)
+    # sha256 de (usuário, cartão, valor, data, descrição normalizada); ver cartoes_app.duplicados
+    impressao_digital = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+
+    objects = DaOrganizacaoQuerySet.as_manager()
 
     class Meta:
         ordering = ['-data', '-id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['chave_idempotencia'],
+                condition=models.Q(chave_idempotencia__isnull=False),
+                name='gasto_chave_idempotencia_unica',
+            ),
+        ]
+        indexes = [
+            # varredura ordenada do comando detectar_gastos_duplicados
+            models.Index(fields=['cartao', 'valor', 'data'], name='gasto_cartao_valor_data_idx'),
+            # listagem do admin (ordering e date_hierarchy)
+            models.Index(fields=['-data', '-id'], name='gasto_data_idx'),
+            # lista de gastos de um usuário e totais do período por organização
+            models.Index(fields=['organizacao', 'usuario', '-data', '-id'], name='gasto_org_usuario_data_idx'),
+            models.Index(fields=['organizacao', 'data'], name='gasto_org_data_idx'),
+        ]
 
     def __str__(self):
         return f'{self.usuario.username} - {self.descricao} - R$ {self.valor}'
 
+    def calcular_impressao_digital(self):
+        return impressao_digital(self.usuario_id, self.cartao_id, self.valor, self.data, self.descricao)
+
+    def save(self, *args, **kwargs):
+        if self.organizacao_id is None and self.cartao_id is not None:
+            self.organizacao_id = self.cartao.organizacao_id
+        self.impressao_digital = self.calcular_impressao_digital()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'impressao_digital' not in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'impressao_digital'}
+        super().save(*args, **kwargs)
+
 
 class GastoAnexo(models.Model):
     gasto = models.ForeignKey('Gasto', on_delete=models.CASCADE, related_name='anexos')
     arquivo = models.FileField(upload_to='gastos/')
     nome_original = models.CharField(max_length=255, blank=True)
+    # Tipo detectado pelo conteúdo no upload (cartoes_app.conteudo)
+    tipo_conteudo = models.CharField(max_length=50, blank=True)
+    # Tamanho antes da recompressão (cartoes_app.imagens); nulo se a imagem não passou por ela
+    tamanho_original = models.PositiveBigIntegerField(null=True, blank=True, editable=False)
+    # Upload original, guardado só com IMAGEM_MANTER_ORIGINAL
+    arquivo_original = models.FileField(upload_to='gastos/originais/', blank=True, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # date_hierarchy do admin
+            models.Index(fields=['uploaded_at'], name='gastoanexo_uploaded_at_idx'),
+        ]
+
+    @property
+    def eh_imagem(self):
+        return self.tipo_conteudo.startswith('image/')
+
     def __str__(self):
         base = self.nome_original or (self.arquivo.name.split('/')[-1] if self.arquivo else 'arquivo')
         return f'Anexo de {self.gasto_id} - {base}'
 
 
+class RemocaoArquivoPendente(models.Model):
+    """Arquivo de anexo cujo registro já foi apagado em lote; removido do storage pela varredura."""
+    arquivo = models.CharField(max_length=255)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.arquivo
+
+
 @receiver(post_delete, sender=GastoAnexo)
 def delete_file_on_anexo_delete(sender, instance, **kwargs):
     # Apaga o arquivo do storage quando o registro de anexo é deletado
     if instance.arquivo:
         instance.arquivo.delete(save=False)
+    if instance.arquivo_original:
+        instance.arquivo_original.delete(save=False)
+
+
+@receiver(post_save, sender=GastoAnexo)
+@receiver(post_delete, sender=GastoAnexo)
+def atualizar_versao_gasto(sender, instance, **kwargs):
+    # Anexos fazem parte da linha do gasto em cache: muda a versão do gasto
+    Gasto.objects.filter(pk=instance.gasto_id).update(atualizado_em=timezone.now())
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_cache_usuario(sender, instance, **kwargs):
+    # Remove do cache o usuário (e suas permissões) usado pelo CachedModelBackend
+    invalidar_usuario_cache(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def criar_perfil_usuario(sender, instance, created, raw=False, **kwargs):
+    # O cadastro pelo portal informa a organização de quem cadastrou em `_organizacao`;
+    # usuários criados fora dele (createsuperuser, admin) entram na organização padrão.
+    if created and not raw:
+        organizacao = getattr(instance, '_organizacao', None) or Organizacao.padrao()
+        PerfilUsuario.objects.create(usuario=instance, organizacao=organizacao)
+
+
+@receiver(post_save, sender=PerfilUsuario)
+@receiver(post_delete, sender=PerfilUsuario)
+def invalidar_cache_perfil(sender, instance, **kwargs):
+    # Mudou a organização do usuário
+    invalidar_usuario_cache(instance.usuario_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidar_cache_permissoes(sender, **kwargs):
+    if kwargs.get('action') in ('post_add', 'post_remove', 'post_clear'):
+        invalidar_permissoes_cache()
+
+
+# ===== Eventos de saldo (SSE do dashboard) =====
+# Só fazem algo se houver dashboards conectados neste processo.
+
+@receiver(pre_save, sender=Gasto)
+@receiver(pre_save, sender=CartaoCredito)
+def guardar_valores_anteriores(sender, instance, **kwargs):
+    # Em edições, o evento leva a diferença em relação ao valor gravado
+    if instance.pk and not instance._state.adding and hub.tem_assinantes():
+        campos = ('usuario_id', 'cartao_id', 'valor', 'data') if sender is Gasto else ('limite',)
+        instance._anterior = sender.objects.filter(pk=instance.pk).values(*campos).first()
+
+
+def _evento_gasto(organizacao_id, usuario_id, cartao_id, data, delta):
+    return {
+        'tipo': 'gasto',
+        'organizacao_id': organizacao_id,
+        'usuario_id': usuario_id,
+        'cartao_id': cartao_id,
+        'data': data.isoformat() if hasattr(data, 'isoformat') else str(data),
+        'delta': delta,
+    }
+
+
+@receiver(post_save, sender=Gasto)
+def publicar_gasto_salvo(sender, instance, created, **kwargs):
+    if not hub.tem_assinantes():
+        return
+    eventos = [_evento_gasto(
+        instance.organizacao_id, instance.usuario_id, instance.cartao_id, instance.data, centavos(instance.valor),
+    )]
+    anterior = getattr(instance, '_anterior', None)
+    if not created and anterior:
+        eventos.append(_evento_gasto(
+            instance.organizacao_id, anterior['usuario_id'], anterior['cartao_id'], anterior['data'], -centavos(anterior['valor']),
+        ))
+    transaction.on_commit(lambda: [publicar(evento) for evento in eventos])
+
+
+@receiver(post_delete, sender=Gasto)
+def publicar_gasto_excluido(sender, instance, **kwargs):
+    if hub.tem_assinantes():
+        evento = _evento_gasto(
+            instance.organizacao_id, instance.usuario_id, instance.cartao_id, instance.data, -centavos(instance.valor),
+        )
+        transaction.on_commit(lambda: publicar(evento))
+
+
+@receiver(post_save, sender=CartaoCredito)
+def publicar_cartao_salvo(sender, instance, created, **kwargs):
+    if not hub.tem_assinantes():
+        return
+    if created:
+        # cartão novo muda a lista da página: o dashboard recarrega
+        evento = {'tipo': 'recarregar', 'organizacao_id': instance.organizacao_id}
+    else:
+        anterior = getattr(instance, '_anterior', None) or {'limite': instance.limite}
+        evento = {
+            'tipo': 'cartao',
+            'organizacao_id': instance.organizacao_id,
+            'usuario_id': instance.usuario_id,
+            'cartao_id': instance.pk,
+            'saldo_atual': centavos(instance.saldo_atual),
+            'delta_limite': centavos(instance.limite) - centavos(anterior['limite']),
+        }
+    transaction.on_commit(lambda: publicar(evento))
+
+
+@receiver(post_delete, sender=CartaoCredito)
+def publicar_cartao_excluido(sender, instance, **kwargs):
+    if hub.tem_assinantes():
+        evento = {'tipo': 'recarregar', 'organizacao_id': instance.organizacao_id}
+        transaction.on_commit(lambda: publicar(evento))
@@ -0,0 +1,55 @@
+# cartoes_app/organizacoes.py
+"""
+Multiempresa: cada usuário pertence a uma organização (PerfilUsuario) e as
+views só consultam a fatia dela — request.organizacao + os filtros
+da_organizacao() dos managers de CartaoCredito e Gasto.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.utils.functional import SimpleLazyObject
+
+from .backends import chave_cache_organizacao
+from .models import Organizacao, PerfilUsuario
+
+
+def organizacao_do_usuario(user):
+    """Organização do usuário (em cache junto com o usuário, se USER_CACHE_TIMEOUT > 0)."""
+    if not user.is_authenticated:
+        return None
+    timeout = settings.USER_CACHE_TIMEOUT
+    chave = chave_cache_organizacao(user.pk)
+    if timeout > 0:
+        organizacao = cache.get(chave)
+        if organizacao is not None:
+            return organizacao
+
+    perfil = PerfilUsuario.objects.select_related('organizacao').filter(usuario_id=user.pk).first()
+    if perfil is not None:
+        organizacao = perfil.organizacao
+    else:
+        # usuário anterior ao signal criar_perfil_usuario (ex: fixtures carregadas com raw)
+        organizacao = Organizacao.padrao()
+        PerfilUsuario.objects.get_or_create(usuario_id=user.pk, defaults={'organizacao': organizacao})
+    if timeout > 0:
+        cache.set(chave, organizacao, timeout)
+    return organizacao
+
+
+def usuarios_comuns(organizacao):
+    """Usuários comuns (não staff) da organização."""
+    return User.objects.filter(is_staff=False, perfil__organizacao=organizacao)
+
+
+class OrganizacaoMiddleware:
+    """
+    Define request.organizacao, carregada só quando usada. Deve vir depois do
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.organizacao = SimpleLazyObject(lambda: organizacao_do_usuario(request.user))
+        return self.get_response(request)
@@ -0,0 +1,122 @@
+# cartoes_app/perfil.py
+import cProfile
+import io
+import os
+import pstats
+import resource
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
+
+PARAMETRO = '_perfil'         # ?_perfil=cpu | mem | tudo
+PARAMETRO_SALVAR = '_perfil_salvar'
+CABECALHO = 'X-Perfil'        # mesmo valores do parâmetro; "salvar" no X-Perfil-Salvar
+MODOS = {'cpu', 'mem', 'tudo', '1'}
+
+# tracemalloc e o profiler são globais no processo: um perfil por vez
+_lock = threading.Lock()
+
+# Frames que só poluem o relatório de alocações
+_FILTROS_MEMORIA = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+class PerfilMiddleware:
+    """
+    Perfil sob demanda de uma requisição, só para staff: roda a view sob
+    cProfile e/ou tracemalloc e devolve o relatório no lugar da página (ou o
+    grava em PERFIL_DIR e segue com a resposta normal, com _perfil_salvar=1).
+    Deve ficar no fim do MIDDLEWARE, depois de autenticação e CSRF.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        modo = request.GET.get(PARAMETRO) or request.headers.get(CABECALHO)
+        if not settings.PERFIL_HABILITADO or modo not in MODOS:
+            return None
+        if not request.user.is_staff:
+            return None
+        if not _lock.acquire(blocking=False):
+            response = view_func(request, *view_args, **view_kwargs)
+            response[CABECALHO] = 'ocupado'
+            return response
+        try:
+            response, relatorio = self._perfilar(request, modo, view_func, view_args, view_kwargs)
+        finally:
+            _lock.release()
+
+        salvar = request.GET.get(PARAMETRO_SALVAR) or request.headers.get(f'{CABECALHO}-Salvar')
+        if salvar:
+            response[CABECALHO] = self._salvar(request, relatorio)
+            return response
+        return HttpResponse(relatorio, content_type='text/plain; charset=utf-8')
+
+    def _perfilar(self, request, modo, view_func, view_args, view_kwargs):
+        cpu = modo in ('cpu', 'tudo', '1')
+        memoria = modo in ('mem', 'tudo', '1')
+        top = settings.PERFIL_TOP
+
+        if memoria:
+            tracemalloc.start(settings.PERFIL_FRAMES)
+            antes = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile() if cpu else None
+        rss_antes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        inicio = time.perf_counter()
+        try:
+            if profiler:
+                profiler.enable()
+            response = view_func(request, *view_args, **view_kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response = response.render()
+        finally:
+            if profiler:
+                profiler.disable()
+            duracao_ms = (time.perf_counter() - inicio) * 1000
+            if memoria:
+                depois = tracemalloc.take_snapshot()
+                atual, pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+        saida = io.StringIO()
+        saida.write(f'{request.method} {request.get_full_path()} -> {response.status_code}\n')
+        saida.write(f'duração: {duracao_ms:.1f} ms (com o profiler ligado)\n')
+        saida.write(f'resposta: {len(getattr(response, "content", b"")) / 1024:.1f} KiB\n')
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        saida.write(f'RSS máximo do worker: {rss / 1024:.1f} MiB (+{(rss - rss_antes) / 1024:.1f} MiB)\n')
+
+        if memoria:
+            saida.write(f'\n== Memória: pico {pico / 1024:.1f} KiB, retida {atual / 1024:.1f} KiB ==\n')
+            diferenca = depois.filter_traces(_FILTROS_MEMORIA).compare_to(
+                antes.filter_traces(_FILTROS_MEMORIA), 'lineno'
+            )
+            for estatistica in diferenca[:top]:
+                saida.write(f'{estatistica}\n')
+
+        if profiler:
+            saida.write(f'\n== CPU: {top} funções por tempo acumulado ==\n')
+            stats = pstats.Stats(profiler, stream=saida)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+            saida.write(f'\n== CPU: {top} funções por tempo próprio ==\n')
+            stats.sort_stats('tottime').print_stats(top)
+
+        return response, saida.getvalue()
+
+    def _salvar(self, request, relatorio):
+        os.makedirs(settings.PERFIL_DIR, exist_ok=True)
+        nome = f'{timezone.now():%Y%m%d-%H%M%S}-{os.getpid()}-{request.resolver_match.url_name or "view"}.txt'
+        with open(os.path.join(settings.PERFIL_DIR, nome), 'w', encoding='utf-8') as arquivo:
+            arquivo.write(relatorio)
+        return nome
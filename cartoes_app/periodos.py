@@ -0,0 +1,151 @@
+# cartoes_app/periodos.py
+"""
+Períodos de consulta (mês atual, últimos 30 dias, fatura, intervalo livre...)
+usados por dashboard e gastos, e totais de vários períodos numa única consulta.
+"""
+from calendar import monthrange
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q, Sum
+from django.utils.dateparse import parse_date
+
+ZERO = Decimal('0')
+
+OPCOES = [
+    ('mes_atual', 'Mês atual'),
+    ('mes_anterior', 'Mês anterior'),
+    ('ult_30', 'Últimos 30 dias'),
+    ('fatura', 'Fatura atual'),
+    ('personalizado', 'Personalizado'),
+    ('todos', 'Todos'),
+]
+PADRAO = 'mes_atual'
+
+
+def _somar_meses(ano, mes, quantidade):
+    indice = ano * 12 + (mes - 1) + quantidade
+    return indice // 12, indice % 12 + 1
+
+
+def _dia(ano, mes, dia):
+    """Data com o dia limitado ao último dia do mês (fechamento no dia 31 em fevereiro)."""
+    return date(ano, mes, min(dia, monthrange(ano, mes)[1]))
+
+
+class Periodo:
+    __slots__ = ('chave', 'inicio', 'fim')
+
+    def __init__(self, chave, inicio=None, fim=None):
+        self.chave = chave
+        self.inicio = inicio
+        self.fim = fim
+
+    def __repr__(self):
+        return f'Periodo({self.chave!r}, {self.inicio}, {self.fim})'
+
+    # ----- construção -----
+    @classmethod
+    def mes(cls, ano, mes, chave='mes_atual'):
+        return cls(chave, date(ano, mes, 1), date(ano, mes, monthrange(ano, mes)[1]))
+
+    @classmethod
+    def fatura(cls, referencia, dia_fechamento):
+        """Ciclo da fatura que contém `referencia`: do dia seguinte ao fechamento anterior até o fechamento."""
+        fechamento = _dia(referencia.year, referencia.month, dia_fechamento)
+        if referencia > fechamento:
+            fechamento = _dia(*_somar_meses(referencia.year, referencia.month, 1), dia_fechamento)
+        ano, mes = _somar_meses(fechamento.year, fechamento.month, -1)
+        return cls('fatura', _dia(ano, mes, dia_fechamento) + timedelta(days=1), fechamento)
+
+    @classmethod
+    def da_requisicao(cls, request, hoje=None):
+        """Lê ?periodo= (e ?inicio=&fim= no personalizado); desconhecido vira o padrão."""
+        return cls.dos_parametros(request.GET, hoje)
+
+    @classmethod
+    def dos_parametros(cls, dados, hoje=None):
+        """Como da_requisicao, a partir de um QueryDict/dict (request.POST, por exemplo)."""
+        hoje = hoje or date.today()
+        chave = dados.get('periodo', PADRAO)
+        if chave == 'mes_atual':
+            return cls.mes(hoje.year, hoje.month)
+        if chave == 'mes_anterior':
+            return cls.mes(*_somar_meses(hoje.year, hoje.month, -1), chave='mes_anterior')
+        if chave == 'ult_30':
+            return cls('ult_30', hoje - timedelta(days=30), hoje)
+        if chave == 'fatura':
+            return cls.fatura(hoje, settings.FATURA_DIA_FECHAMENTO)
+        if chave == 'personalizado':
+            try:
+                inicio = parse_date(dados.get('inicio', ''))
+                fim = parse_date(dados.get('fim', ''))
+            except ValueError:
+                inicio = fim = None
+            if inicio and fim and inicio <= fim:
+                return cls('personalizado', inicio, fim)
+            # recém-escolhido no seletor: começa pelo mês atual para o usuário ajustar
+            return cls.mes(hoje.year, hoje.month, chave='personalizado')
+        if chave == 'todos':
+            return cls('todos')
+        return cls.mes(hoje.year, hoje.month)
+
+    # ----- uso -----
+    @property
+    def limitado(self):
+        return self.inicio is not None and self.fim is not None
+
+    @property
+    def dias(self):
+        return (self.fim - self.inicio).days + 1 if self.limitado else None
+
+    def anterior(self):
+        """Período imediatamente anterior, do mesmo tipo (mês, fatura) ou da mesma duração."""
+        if not self.limitado:
+            return None
+        if self.chave in ('mes_atual', 'mes_anterior'):
+            ano, mes = _somar_meses(self.inicio.year, self.inicio.month, -1)
+            return Periodo.mes(ano, mes, chave='mes_anterior')
+        if self.chave == 'fatura':
+            return Periodo.fatura(self.inicio - timedelta(days=1), settings.FATURA_DIA_FECHAMENTO)
+        return Periodo(self.chave, self.inicio - timedelta(days=self.dias), self.inicio - timedelta(days=1))
+
+    def filtro(self, campo='data'):
+        """kwargs para .filter(); vazio em 'todos'."""
+        return {f'{campo}__range': (self.inicio, self.fim)} if self.limitado else {}
+
+    def q(self, campo='data'):
+        return Q(**self.filtro(campo))
+
+    def parametros(self):
+        """Query string que reproduz o período (redirects e links)."""
+        if self.chave == 'personalizado':
+            return f'periodo=personalizado&inicio={self.inicio.isoformat()}&fim={self.fim.isoformat()}'
+        return f'periodo={self.chave}'
+
+
+def totais_por_periodo(queryset, periodos, campo='valor', agrupar_por=None):
+    """
+    Soma `campo` em vários períodos de uma vez: uma consulta com um
+    Sum(filter=Q(...)) por período, restrita às datas que algum deles cobre.
+    `periodos` é {nome: Periodo}. Sem `agrupar_por` retorna {nome: total};
+    com ele, {valor_do_grupo: {nome: total}}.
+    """
+    periodos = {nome: p for nome, p in periodos.items() if p is not None}
+    if not periodos:
+        return {}
+    somas = {nome: Sum(campo, filter=p.q()) if p.limitado else Sum(campo) for nome, p in periodos.items()}
+    if all(p.limitado for p in periodos.values()):
+        queryset = queryset.filter(
+            data__range=(min(p.inicio for p in periodos.values()), max(p.fim for p in periodos.values()))
+        )
+    queryset = queryset.order_by()
+
+    if agrupar_por is None:
+        linha = queryset.aggregate(**somas)
+        return {nome: linha[nome] or ZERO for nome in periodos}
+    resultado = {}
+    for linha in queryset.values(agrupar_por).annotate(**somas):
+        resultado[linha[agrupar_por]] = {nome: linha[nome] or ZERO for nome in periodos}
+    return resultado
@@ -0,0 +1,136 @@
+# cartoes_app/resumos.py
+"""
+Resumos de leitura para dashboard e gastos, montados a partir de values():
+objetos pequenos com __slots__ em vez de instâncias de model ou dicts por linha.
+"""
+from decimal import Decimal
+
+from .models import CartaoCredito, Gasto
+from .periodos import totais_por_periodo
+
+ZERO = Decimal('0')
+BANDEIRAS_DISPLAY = dict(CartaoCredito.BANDEIRAS)
+
+
+class ResumoCartao:
+    CAMPOS = (
+        'id', 'usuario_id', 'nome', 'numero', 'bandeira', 'limite', 'saldo_atual',
+        'mes_vencimento', 'ano_vencimento', 'atualizado_em',
+    )
+    __slots__ = CAMPOS + ('gasto_total',)
+
+    # métodos do model que só dependem dos campos acima
+    vencimento_formatado = CartaoCredito.vencimento_formatado
+    numero_mascarado = CartaoCredito.numero_mascarado
+    bandeira_static_filename = CartaoCredito.bandeira_static_filename
+
+    def __init__(self, linha, gasto_total=ZERO):
+        for campo in self.CAMPOS:
+            setattr(self, campo, linha[campo])
+        if self.limite is None:
+            self.limite = ZERO
+        self.gasto_total = gasto_total
+
+    def get_bandeira_display(self):
+        return BANDEIRAS_DISPLAY.get(self.bandeira, self.bandeira)
+
+    @property
+    def bandeira_display(self):
+        return self.get_bandeira_display()
+
+    @property
+    def saldo_restante(self):
+        return self.limite - self.gasto_total
+
+    @property
+    def estourado(self):
+        return self.gasto_total > self.limite
+
+
+class ResumoUsuario:
+    __slots__ = ('id', 'username', 'cartoes', 'limite_total', 'gasto_total', 'gasto_anterior')
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+        self.cartoes = []
+        self.limite_total = ZERO
+        self.gasto_total = ZERO
+        self.gasto_anterior = None  # None quando o período não tem anterior ('todos')
+
+    @property
+    def saldo(self):
+        return self.limite_total - self.gasto_total
+
+    @property
+    def saldo_centavos(self):
+        return int(self.saldo * 100)
+
+    @property
+    def variacao(self):
+        """Diferença do gasto em relação ao período anterior."""
+        if self.gasto_anterior is None:
+            return None
+        return self.gasto_total - self.gasto_anterior
+
+    @property
+    def variacao_percentual(self):
+        if not self.gasto_anterior:
+            return None
+        return self.variacao / self.gasto_anterior * 100
+
+    def adicionar_cartao(self, cartao):
+        self.cartoes.append(cartao)
+        self.limite_total += cartao.limite
+
+
+def _periodos(periodo, comparar):
+    return {'atual': periodo, 'anterior': periodo.anterior() if comparar else None}
+
+
+def resumo_usuario(usuario, periodo, organizacao, comparar=False):
+    """
+    Cartões do usuário com o gasto de cada um no período e os totais (2 consultas).
+    Com comparar=True o gasto do período anterior sai da mesma consulta.
+    """
+    resumo = ResumoUsuario(usuario.pk, usuario.username)
+    periodos = _periodos(periodo, comparar)
+    gastos = Gasto.objects.da_organizacao(organizacao).filter(usuario=usuario)
+    por_cartao = totais_por_periodo(gastos, periodos, agrupar_por='cartao_id')
+    gasto_por_cartao = {cartao_id: totais['atual'] for cartao_id, totais in por_cartao.items()}
+    resumo.gasto_total = sum(gasto_por_cartao.values(), ZERO)
+    if periodos['anterior'] is not None:
+        resumo.gasto_anterior = sum((totais['anterior'] for totais in por_cartao.values()), ZERO)
+
+    cartoes = CartaoCredito.objects.da_organizacao(organizacao).filter(usuario=usuario).order_by('nome')
+    for linha in cartoes.values(*ResumoCartao.CAMPOS):
+        resumo.adicionar_cartao(ResumoCartao(linha, gasto_por_cartao.get(linha['id'], ZERO)))
+    return resumo
+
+
+def resumos_usuarios(usuarios, periodo, organizacao, comparar=False):
+    """
+    Um ResumoUsuario (com cartões e gasto no período) por usuário do queryset, em
+    3 consultas restritas à organização (índices que começam por ela).
+    """
+    resumos = [ResumoUsuario(pk, username) for pk, username in usuarios.values_list('id', 'username')]
+    por_id = {resumo.id: resumo for resumo in resumos}
+    if not por_id:
+        return resumos
+
+    ids = usuarios.values('id')
+    cartoes = CartaoCredito.objects.da_organizacao(organizacao).filter(usuario__in=ids).order_by('nome')
+    for linha in cartoes.values(*ResumoCartao.CAMPOS):
+        por_id[linha['usuario_id']].adicionar_cartao(ResumoCartao(linha))
+
+    periodos = _periodos(periodo, comparar)
+    if periodos['anterior'] is not None:
+        for resumo in resumos:
+            resumo.gasto_anterior = ZERO
+    gastos = Gasto.objects.da_organizacao(organizacao).filter(usuario__in=ids)
+    por_usuario = totais_por_periodo(gastos, periodos, agrupar_por='usuario_id')
+    for usuario_id, totais in por_usuario.items():
+        por_id[usuario_id].gasto_total = totais['atual']
+        if periodos['anterior'] is not None:
+            por_id[usuario_id].gasto_anterior = totais['anterior']
+    return resumos
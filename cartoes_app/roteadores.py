@@ -0,0 +1,85 @@
+# cartoes_app/roteadores.py
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+
+ALIAS_REPLICA = 'replica'
+COOKIE_FIXAR_PRIMARIO = 'fixar_primario'
+METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS')
+# Sessões são lidas logo após o login: nunca vão para a réplica
+APPS_SOMENTE_PRIMARIO = {'sessions'}
+
+_leitura_replica = ContextVar('leitura_replica', default=False)
+_fixado = ContextVar('fixado_primario', default=False)
+
+
+def usar_replica(view):
+    """
+    Faz as leituras de uma view GET/HEAD irem para a réplica. Use como o
+    decorator mais interno (depois de login_required/staff_member_required),
+    para que o usuário e a sessão continuem vindo do banco principal.
+    """
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        if request.method not in METODOS_SEGUROS:
+            return view(request, *args, **kwargs)
+        token = _leitura_replica.set(True)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _leitura_replica.reset(token)
+    return _view
+
+
+class RoteadorReplica:
+    """
+    Escritas sempre no 'default'. Leituras vão para a réplica somente dentro de
+    views com @usar_replica e enquanto o usuário não estiver fixado no principal
+    (escreveu há menos de REPLICA_PIN_SECONDS, ver FixarPrimarioMiddleware).
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            _leitura_replica.get()
+            and not _fixado.get()
+            and model._meta.app_label not in APPS_SOMENTE_PRIMARIO
+        ):
+            return ALIAS_REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # réplica e principal têm os mesmos dados
+        return True
+
+
+class FixarPrimarioMiddleware:
+    """
+    Toda requisição que não é GET/HEAD (as que gravam) lê do principal e deixa
+    um cookie curto; enquanto ele existir o usuário continua no principal,
+    sem ver dados atrasados pelo lag da replicação.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        escrita = request.method not in METODOS_SEGUROS
+        token = _fixado.set(escrita or COOKIE_FIXAR_PRIMARIO in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _fixado.reset(token)
+
+        if escrita:
+            response.set_cookie(
+                COOKIE_FIXAR_PRIMARIO, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+                secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
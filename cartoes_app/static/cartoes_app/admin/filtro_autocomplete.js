@@ -0,0 +1,15 @@
+// Filtros autocomplete da listagem do admin (cartoes_app.admin.FiltroAutocomplete):
+// ao escolher (ou limpar) um valor, recarrega a listagem com o parâmetro do filtro.
+'use strict';
+(function($) {
+    $(document).on('change', 'select.filtro-autocomplete', function() {
+        const params = new URLSearchParams(window.location.search);
+        params.delete('p');
+        if (this.value) {
+            params.set(this.name, this.value);
+        } else {
+            params.delete(this.name);
+        }
+        window.location.search = params.toString();
+    });
+})(django.jQuery);
@@ -0,0 +1,79 @@
+# cartoes_app/storage.py
+import gzip
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import brotli
+except ImportError:  # opcional: pip install brotli
+    brotli = None
+
+# Tipos que ainda ganham com compressão (JPEG/PNG/GIF/WEBP já são comprimidos)
+EXTENSOES_COMPRIMIVEIS = {'.svg', '.pdf', '.bmp', '.txt', '.csv', '.json', '.xml'}
+# Só grava a variante .gz/.br se ela economizar pelo menos 5%
+GANHO_MINIMO = 0.95
+
+# arquivo.<12 hex>.ext. No reenvio do mesmo conteúdo get_available_name acrescenta
+# _XXXXXXX: antes do hash (Django 5.2) ou depois dele, conforme a versão.
+RE_NOME_IMUTAVEL = re.compile(r'\.[0-9a-f]{12}(?:_[A-Za-z0-9]{7})?\.[A-Za-z0-9]+$')
+
+
+class MidiaImutavelStorage(FileSystemStorage):
+    """
+    FileSystemStorage para uploads com nome endereçado pelo conteúdo
+    (gastos/recibo.<hash>.pdf) e variantes pré-comprimidas .gz/.br ao lado,
+    no mesmo esquema do WhiteNoise. Como o conteúdo de um nome nunca muda,
+    os arquivos podem ser servidos com Cache-Control imutável.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        content.seek(0)
+
+        pasta, arquivo = os.path.split(name)
+        raiz, ext = os.path.splitext(arquivo)
+        sufixo = f'.{sha.hexdigest()[:12]}{ext.lower()}'
+        if max_length:
+            # reserva espaço para o hash e o sufixo aleatório de get_available_name
+            livre = max_length - len(os.path.join(pasta, sufixo)) - 8
+            raiz = raiz[:max(livre, 1)]
+        nome = super().save(os.path.join(pasta, raiz + sufixo), content, max_length=max_length)
+        self._pre_comprimir(nome)
+        return nome
+
+    def _pre_comprimir(self, nome):
+        if os.path.splitext(nome)[1].lower() not in EXTENSOES_COMPRIMIVEIS:
+            return
+        caminho = self.path(nome)
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+
+        variantes = [('.gz', gzip.compress(dados, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variantes.append(('.br', brotli.compress(dados)))
+
+        for extensao, comprimido in variantes:
+            if len(comprimido) < len(dados) * GANHO_MINIMO:
+                with open(caminho + extensao, 'wb') as f:
+                    f.write(comprimido)
+
+    def delete(self, name):
+        super().delete(name)
+        for extensao in ('.gz', '.br'):
+            if name and self.exists(name + extensao):
+                super().delete(name + extensao)
+
+
+def nome_imutavel(name):
+    return bool(RE_NOME_IMUTAVEL.search(name))
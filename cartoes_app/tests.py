@@ -1,3 +1,1442 @@
-from django.test import TestCase
+# cartoes_app/tests.py
+"""
+Orçamento de consultas e de tamanho de resposta das URLs de cartoes_app/urls.py.
 
-# Create your tests here.
+Cada teste faz a mesma requisição com a base em 1x e em 10x (ESCALAS). O número
+de consultas tem de ser o esperado nas duas escalas: um laço que consulta por
+usuário/cartão/gasto (N+1) muda a contagem em 10x e o teste falha. O HTML pode
+crescer só nas páginas que listam linhas, até ORCAMENTO_LINHA bytes por linha a
+mais; nas demais o tamanho fica igual (com FOLGA para números mais longos).
+
+Ao mudar uma view de propósito, ajuste o número esperado no teste dela.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+import tracemalloc
+import uuid
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, Group, Permission, User
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import re_path, reverse
+from django.utils import timezone
+
+from creditmanager import urls as urls_projeto
+
+from .models import CartaoCredito, Gasto, GastoAnexo, Organizacao, PerfilUsuario, RemocaoArquivoPendente
+from . import aquecimento, imagens
+from .aquecimento import aquecer
+from .backends import CachedModelBackend, chave_cache_usuario
+from .conteudo import ConteudoInvalido, detectar_tipo
+from .eventos import fluxo_sse, hub, publicar
+from .exclusao import excluir_lote_gastos
+from .forms import RegistrarUsuarioComumForm
+from .limites import concorrencia, consumir, limitar, verificar_cache_concorrencia
+from .logs import FiltroRequestId, FormatadorJSON, HandlerAssincrono, logger_acesso
+from .organizacoes import organizacao_do_usuario
+from .periodos import Periodo
+from .roteadores import ALIAS_REPLICA, COOKIE_FIXAR_PRIMARIO, FixarPrimarioMiddleware, usar_replica
+from .storage import MidiaImutavelStorage, nome_imutavel
+from .views import _importar_cartoes_csv, servir_midia
+
+ESCALAS = (1, 10)
+# bytes a mais por linha listada (usuário, cartão ou gasto) e folga das páginas fixas
+ORCAMENTO_LINHA = 2500
+FOLGA = 64
+
+PDF = b'%PDF-1.4\n1 0 obj <<>> endobj\ntrailer <<>>\n%%EOF\n'
+SENHA = 'Senha-de-teste-123'
+
+Custo = namedtuple('Custo', 'escala consultas bytes status')
+
+
+def _png(largura, altura):
+    """Só o cabeçalho (assinatura + IHDR): basta para detectar_tipo."""
+    ihdr = struct.pack('>II', largura, altura) + b'\x08\x02\x00\x00\x00'
+    return b'\x89PNG\r\n\x1a\n' + b'\x00\x00\x00\rIHDR' + ihdr + b'\x00' * 4
+
+MEDIA_TESTES = tempfile.mkdtemp(prefix='cartoes-testes-')
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_TESTES,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    # contagens sem o cache de usuário/organização e com a sessão no banco
+    AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'],
+    USER_CACHE_TIMEOUT=0,
+    SESSION_ENGINE='django.contrib.sessions.backends.db',
+    RATE_LIMIT_ENABLED=False,
+    IMAGEM_OTIMIZAR=False,
+)
+class OrcamentoConsultasTests(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_TESTES, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizacao = Organizacao.padrao()
+        cls.staff = User.objects.create_user('admin', password=SENHA, is_staff=True)
+        cls.comum = User.objects.create_user('comum', password=SENHA)
+        cls.cartoes_comum = [cls._cartao(cls.comum, nome) for nome in ('Principal', 'Reserva')]
+
+    def setUp(self):
+        self.escala = 0
+        self.client.force_login(self.staff)
+
+    # ===== Dados =====
+    @classmethod
+    def _cartao(cls, usuario, nome='Cartão'):
+        return CartaoCredito.objects.create(
+            organizacao=cls.organizacao, usuario=usuario, nome=nome, numero='4111111111111111',
+            mes_vencimento=12, ano_vencimento=timezone.now().year + 2,
+            limite=Decimal('5000'), saldo_atual=Decimal('0'), bandeira='visa',
+        )
+
+    def _gastos(self, cartao, quantidade, comprovante=False):
+        for i in range(quantidade):
+            gasto = Gasto.objects.create(
+                usuario_id=cartao.usuario_id, cartao=cartao,
+                descricao=f'Compra {cartao.pk}-{i}', valor=Decimal('12.34') + i,
+            )
+            if comprovante:
+                GastoAnexo.objects.create(
+                    gasto=gasto, arquivo=ContentFile(PDF, name='comprovante.pdf'),
+                    nome_original='comprovante.pdf', tipo_conteudo='application/pdf',
+                )
+
+    def _popular(self, escala):
+        """
+        Acrescenta unidades de dados até chegar a `escala`. Cada unidade: 2 usuários
+        comuns com 2 cartões e 3 gastos por cartão, e mais 5 gastos com comprovante
+        em cada cartão do usuário 'comum'.
+        """
+        for unidade in range(self.escala, escala):
+            for i in range(2):
+                usuario = User.objects.create(username=f'usuario{unidade:03d}{i}')
+                for nome in ('Visa', 'Master'):
+                    self._gastos(self._cartao(usuario, nome), 3)
+            for cartao in self.cartoes_comum:
+                self._gastos(cartao, 5, comprovante=True)
+        self.escala = escala
+
+    def _usuarios(self, escala):
+        return 1 + 2 * escala
+
+    def _cartoes(self, escala):
+        return 2 + 4 * escala
+
+    def _usuarios_e_cartoes(self, escala):
+        return self._usuarios(escala) + self._cartoes(escala)
+
+    def _gastos_comum(self, escala):
+        return 10 * escala
+
+    # ===== Medição =====
+    def _medir(self, preparar):
+        """
+        `preparar()` roda fora da contagem e devolve (método, url, dados): assim cada
+        escala usa objetos novos quando a requisição altera ou apaga dados.
+        """
+        custos = []
+        for escala in ESCALAS:
+            self._popular(escala)
+            metodo, url, dados = preparar()
+            with CaptureQueriesContext(connection) as consultas:
+                resposta = getattr(self.client, metodo)(url, dados)
+            custos.append(Custo(escala, len(consultas.captured_queries), len(resposta.content), resposta.status_code))
+        return custos
+
+    def assertCusto(self, custos, consultas, status=200, linhas=None):
+        """
+        `consultas` exatas em todas as escalas. `linhas(escala)` é quantas linhas a
+        página lista; sem ela o tamanho da resposta não pode variar com os dados.
+        """
+        for custo in custos:
+            self.assertEqual(custo.status, status, custos)
+            self.assertEqual(custo.consultas, consultas, f'consultas por escala: {custos}')
+        menor, maior = custos[0], custos[-1]
+        if linhas is None:
+            limite = menor.bytes + FOLGA
+        else:
+            limite = menor.bytes + ORCAMENTO_LINHA * (linhas(maior.escala) - linhas(menor.escala))
+        self.assertLessEqual(maior.bytes, limite, f'tamanho da resposta por escala: {custos}')
+
+    def _get(self, url):
+        return lambda: ('get', url, None)
+
+    # ===== Login / logout =====
+    def test_login_get(self):
+        self.client.logout()
+        self.assertCusto(self._medir(self._get(reverse('login'))), 0)
+
+    def test_login_post(self):
+        def preparar():
+            self.client.logout()
+            return 'post', reverse('login'), {'username': 'comum', 'password': SENHA}
+        self.assertCusto(self._medir(preparar), 9, status=302)
+
+    def test_logout(self):
+        def preparar():
+            self.client.force_login(self.staff)
+            return 'post', reverse('logout'), None
+        self.assertCusto(self._medir(preparar), 4, status=302)
+
+    # ===== Dashboard =====
+    def test_dashboard_staff(self):
+        # cada usuário com os seus cartões
+        self.assertCusto(self._medir(self._get(reverse('dashboard'))), 9, linhas=self._usuarios_e_cartoes)
+
+    def test_dashboard_comum(self):
+        self.client.force_login(self.comum)
+        self.assertCusto(self._medir(self._get(reverse('dashboard'))), 5)
+
+    def test_eventos_sem_asgi(self):
+        self.assertCusto(self._medir(self._get(reverse('eventos_saldos'))), 0, status=204)
+
+    # ===== Cartões =====
+    def test_recarregar_cartao_get(self):
+        url = reverse('recarregar_cartao', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(self._get(url)), 4)
+
+    def test_recarregar_cartao_post(self):
+        url = reverse('recarregar_cartao', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(lambda: ('post', url, {'valor': '10.00'})), 5, status=302)
+
+    def _dados_cartao(self, nome):
+        return {
+            'usuario': self.comum.pk, 'nome': nome, 'numero': '4111111111111111',
+            'mes_vencimento': 12, 'ano_vencimento': timezone.now().year + 1, 'limite': '1000', 'bandeira': 'visa',
+        }
+
+    def test_editar_cartao_get(self):
+        url = reverse('editar_cartao', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(self._get(url)), 5, linhas=self._usuarios)
+
+    def test_editar_cartao_post(self):
+        url = reverse('editar_cartao', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(lambda: ('post', url, self._dados_cartao('Principal'))), 7, status=302)
+
+    def test_criar_cartao_get(self):
+        self.assertCusto(self._medir(self._get(reverse('criar_cartao'))), 4, linhas=self._usuarios)
+
+    def test_criar_cartao_post(self):
+        url = reverse('criar_cartao')
+        self.assertCusto(self._medir(lambda: ('post', url, self._dados_cartao('Novo'))), 6, status=302)
+
+    def _cartao_com_gastos(self):
+        cartao = self._cartao(self.comum, 'Descartável')
+        self._gastos(cartao, 5 * self.escala, comprovante=True)
+        return cartao
+
+    def test_excluir_cartao_get(self):
+        url = reverse('excluir_cartao', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(self._get(url)), 4)
+
+    def test_excluir_cartao_post(self):
+        # o cartão excluído tem 5 gastos com comprovante por unidade de escala
+        def preparar():
+            return 'post', reverse('excluir_cartao', args=[self._cartao_com_gastos().pk]), None
+        self.assertCusto(self._medir(preparar), 18, status=302)
+
+    def test_excluir_cartao_progresso_get(self):
+        url = reverse('excluir_cartao_progresso', args=[self.cartoes_comum[0].pk])
+        self.assertCusto(self._medir(self._get(url)), 5)
+
+    def test_excluir_cartao_progresso_post(self):
+        def preparar():
+            return 'post', reverse('excluir_cartao_progresso', args=[self._cartao_com_gastos().pk]), None
+        self.assertCusto(self._medir(preparar), 18)
+
+    def test_cartoes_lote_get(self):
+        # tabela de cartões e filtro por usuário
+        self.assertCusto(self._medir(self._get(reverse('cartoes_lote'))), 5, linhas=self._usuarios_e_cartoes)
+
+    def test_cartoes_lote_recarregar(self):
+        def preparar():
+            ids = list(CartaoCredito.objects.values_list('pk', flat=True))
+            return 'post', reverse('cartoes_lote'), {'acao': 'recarregar', 'valor': '5.00', 'cartoes': ids}
+        self.assertCusto(self._medir(preparar), 7, status=302)
+
+    def test_cartoes_lote_importar(self):
+        def preparar():
+            linhas = ['usuario,nome,numero,mes_vencimento,ano_vencimento,limite,bandeira']
+            ano = timezone.now().year + 1
+            linhas += [f'comum,Importado {i},4111111111111111,6,{ano},800,visa' for i in range(5 * self.escala)]
+            arquivo = SimpleUploadedFile('cartoes.csv', '\n'.join(linhas).encode(), content_type='text/csv')
+            return 'post', reverse('cartoes_lote'), {'importar': '1', 'arquivo': arquivo}
+        self.assertCusto(self._medir(preparar), 7, status=302)
+
+    def test_cartoes_lote_excluir_grande(self):
+        # acima de LOTE_EXCLUSAO gastos a exclusão segue para a página de progresso
+        def preparar():
+            ids = [self._cartao_com_gastos().pk, self._cartao_com_gastos().pk]
+            return 'post', reverse('cartoes_lote'), {'acao': 'excluir', 'cartoes': ids}
+        with mock.patch('cartoes_app.views.LOTE_EXCLUSAO', 1):
+            custos = self._medir(preparar)
+        self.assertCusto(custos, 9, status=302)
+        self.assertEqual(len(self.client.session['exclusao_lote']), 2)
+        self.assertEqual(CartaoCredito.objects.filter(nome='Descartável').count(), 4)
+
+    def _selecionar_para_exclusao(self):
+        sessao = self.client.session
+        sessao['exclusao_lote'] = [self._cartao_com_gastos().pk, self._cartao_com_gastos().pk]
+        sessao.save()
+        return reverse('excluir_cartoes_lote_progresso')
+
+    def test_excluir_cartoes_lote_progresso_get(self):
+        self.assertCusto(self._medir(lambda: ('get', self._selecionar_para_exclusao(), None)), 5)
+
+    def test_excluir_cartoes_lote_progresso_post(self):
+        def preparar():
+            return 'post', self._selecionar_para_exclusao(), None
+        self.assertCusto(self._medir(preparar), 21)
+        self.assertFalse(CartaoCredito.objects.filter(nome='Descartável').exists())
+
+    # ===== Usuários =====
+    def test_registrar_usuario_get(self):
+        self.assertCusto(self._medir(self._get(reverse('registrar_usuario'))), 2)
+
+    def test_registrar_usuario_post(self):
+        def preparar():
+            return 'post', reverse('registrar_usuario'), {
+                'username': f'novo{self.escala}', 'email': '', 'password1': SENHA, 'password2': SENHA,
+            }
+        self.assertCusto(self._medir(preparar), 7, status=302)
+
+    def test_usuarios(self):
+        url = f"{reverse('usuarios')}?usuario={self.comum.pk}"
+        self.assertCusto(self._medir(self._get(url)), 7, linhas=self._usuarios)
+
+    # ===== Gastos =====
+    def test_gastos_staff(self):
+        url = f"{reverse('gastos')}?usuario={self.comum.pk}"
+
+        def linhas(escala):
+            return self._gastos_comum(escala) + self._usuarios(escala)
+        self.assertCusto(self._medir(self._get(url)), 10, linhas=linhas)
+
+    def test_gastos_comum(self):
+        self.client.force_login(self.comum)
+        self.assertCusto(self._medir(self._get(reverse('gastos'))), 8, linhas=self._gastos_comum)
+
+    def test_gastos_registrar(self):
+        self.client.force_login(self.comum)
+
+        def preparar():
+            return 'post', reverse('gastos'), {
+                'cartao': self.cartoes_comum[0].pk, 'descricao': f'Mercado {self.escala}',
+                'valor': '45.90', 'data': timezone.localdate().isoformat(),
+                'anexos': SimpleUploadedFile('nota.pdf', PDF, content_type='application/pdf'),
+            }
+        self.assertCusto(self._medir(preparar), 13, status=302)
+
+    def test_excluir_anexo(self):
+        self.client.force_login(self.comum)
+
+        def preparar():
+            anexo = GastoAnexo.objects.filter(gasto__usuario=self.comum).order_by('-pk').first()
+            return 'post', reverse('excluir_anexo_gasto', args=[anexo.pk]), {'periodo': 'mes_atual'}
+        self.assertCusto(self._medir(preparar), 7, status=302)
+
+    # ===== Admin =====
+    def _admin(self, model):
+        # o admin exige permissões; o staff da suíte não as tem
+        User.objects.filter(pk=self.staff.pk).update(is_superuser=True)
+        return self._get(reverse(f'admin:cartoes_app_{model}_changelist'))
+
+    def _linhas_pagina(self, linhas):
+        return lambda escala: min(linhas(escala), 100)
+
+    def test_admin_gastos(self):
+        linhas = self._linhas_pagina(lambda escala: 12 * escala + self._gastos_comum(escala))
+        self.assertCusto(self._medir(self._admin('gasto')), 7, linhas=linhas)
+
+    def test_admin_cartoes(self):
+        self.assertCusto(self._medir(self._admin('cartaocredito')), 6, linhas=self._cartoes)
+
+    # ===== Deploy =====
+    def test_github_deploy_get(self):
+        # o POST dispara o script de deploy; só o GET é exercitado aqui
+        self.assertCusto(self._medir(self._get(reverse('github_deploy'))), 0, status=400)
+
+
+class MidiaImutavelTests(SimpleTestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+
+    def test_nome_imutavel(self):
+        self.assertTrue(nome_imutavel('gastos/recibo.0123456789ab.pdf'))
+        self.assertTrue(nome_imutavel('gastos/recibo_Ab12cD3.0123456789ab.pdf'))
+        self.assertTrue(nome_imutavel('gastos/recibo.0123456789ab_Ab12cD3.pdf'))
+        self.assertFalse(nome_imutavel('gastos/recibo.pdf'))
+        self.assertFalse(nome_imutavel('gastos/recibo_Ab12cD3.pdf'))
+
+    def test_reenvio_do_mesmo_conteudo_continua_imutavel(self):
+        storage = MidiaImutavelStorage(location=self.pasta)
+        nomes = [storage.save('gastos/recibo.pdf', ContentFile(PDF)) for _ in range(2)]
+        self.assertNotEqual(nomes[0], nomes[1])
+        for nome in nomes:
+            self.assertTrue(nome_imutavel(nome), nome)
+
+
+@override_settings(ROOT_URLCONF=__name__, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ServirMidiaTests(TestCase):
+    """servir_midia é roteada só com MEDIA_STORAGE_MODE=imutavel; aqui pelo urlpatterns deste módulo."""
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            STORAGES={
+                'default': {'BACKEND': 'cartoes_app.storage.MidiaImutavelStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+        self.organizacao = Organizacao.padrao()
+        self.dono = User.objects.create(username='maria')
+        cartao = CartaoCredito.objects.create(
+            organizacao=self.organizacao, usuario=self.dono, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+        gasto = Gasto.objects.create(usuario=self.dono, cartao=cartao, descricao='Mercado', valor=Decimal('10'))
+        self.anexo = GastoAnexo.objects.create(
+            gasto=gasto, arquivo=ContentFile(PDF, name='recibo.pdf'), tipo_conteudo='application/pdf',
+        )
+        self.url = '/media/' + self.anexo.arquivo.name
+
+    def _usuario(self, username, organizacao=None, **extra):
+        usuario = User.objects.create(username=username, **extra)
+        if organizacao is not None:
+            PerfilUsuario.objects.filter(usuario=usuario).update(organizacao=organizacao)
+        return usuario
+
+    def test_anonimo_vai_para_o_login(self):
+        resposta = self.client.get(self.url)
+        self.assertEqual(resposta.status_code, 302)
+        self.assertTrue(resposta['Location'].startswith('/login/'))
+
+    def test_outra_organizacao_recebe_404(self):
+        outra = Organizacao.objects.create(slug='outra', nome='Outra')
+        self.client.force_login(self._usuario('chefe', outra, is_staff=True))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_outro_usuario_comum_recebe_404(self):
+        self.client.force_login(self._usuario('joao'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_arquivo_sem_anexo_recebe_404(self):
+        self.client.force_login(self.dono)
+        self.anexo.arquivo.storage.save('gastos/solto.pdf', ContentFile(PDF))
+        self.assertEqual(self.client.get('/media/gastos/solto.pdf').status_code, 404)
+
+    def test_dono_e_staff_recebem_o_arquivo_imutavel(self):
+        for usuario in (self.dono, self._usuario('chefe', is_staff=True)):
+            self.client.force_login(usuario)
+            resposta = self.client.get(self.url)
+            self.assertEqual(resposta.status_code, 200)
+            self.assertEqual(b''.join(resposta.streaming_content), PDF)
+            self.assertEqual(
+                resposta['Cache-Control'], f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable',
+            )
+
+class ImportarCartoesCsvTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.organizacao = Organizacao.padrao()
+        User.objects.create(username='maria')
+
+    def _csv(self, nome):
+        ano = timezone.now().year + 1
+        return (
+            'usuario;nome;numero;mes_vencimento;ano_vencimento;limite;bandeira\n'
+            f'maria;{nome};4111111111111111;6;{ano};800;visa\n'
+        )
+
+    def test_utf8_com_bom(self):
+        arquivo = io.BytesIO(self._csv('Cartão').encode('utf-8-sig'))
+        self.assertEqual(_importar_cartoes_csv(arquivo, self.organizacao), (1, []))
+        self.assertTrue(CartaoCredito.objects.filter(nome='Cartão').exists())
+
+    def test_cp1252_do_excel(self):
+        arquivo = io.BytesIO(self._csv('Cartão Pão').encode('cp1252'))
+        self.assertEqual(_importar_cartoes_csv(arquivo, self.organizacao), (1, []))
+        self.assertTrue(CartaoCredito.objects.filter(nome='Cartão Pão').exists())
+
+    def test_bytes_invalidos_viram_falha_da_linha_0(self):
+        # 0x81 não existe em UTF-8 nem em cp1252
+        arquivo = io.BytesIO(self._csv('Cartão').encode('cp1252') + b'\x81\x8d')
+        criados, falhas = _importar_cartoes_csv(arquivo, self.organizacao)
+        self.assertEqual(criados, 0)
+        self.assertEqual([linha for linha, _ in falhas], [0])
+        self.assertFalse(CartaoCredito.objects.exists())
+
+
+class ColetarMidiaOrfaTests(TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            STORAGES={'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}},
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_faltantes_apagar_atualiza_gasto_e_enfileira_original(self):
+        usuario = User.objects.create(username='maria')
+        cartao = CartaoCredito.objects.create(
+            organizacao=Organizacao.padrao(), usuario=usuario, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+        gasto = Gasto.objects.create(usuario=usuario, cartao=cartao, descricao='Mercado', valor=Decimal('10'))
+        anexo = GastoAnexo.objects.create(
+            gasto=gasto, arquivo=ContentFile(PDF, name='recibo.pdf'),
+            arquivo_original=ContentFile(PDF, name='original.pdf'), tipo_conteudo='application/pdf',
+        )
+        anexo.arquivo.storage.delete(anexo.arquivo.name)
+        Gasto.objects.filter(pk=gasto.pk).update(atualizado_em=timezone.now() - timedelta(days=1))
+        versao = Gasto.objects.get(pk=gasto.pk).atualizado_em
+
+        call_command('coletar_midia_orfa', '--faltantes', '--apagar', stdout=io.StringIO())
+
+        self.assertFalse(GastoAnexo.objects.exists())
+        self.assertGreater(Gasto.objects.get(pk=gasto.pk).atualizado_em, versao)
+        self.assertEqual(
+            list(RemocaoArquivoPendente.objects.values_list('arquivo', flat=True)), [anexo.arquivo_original.name],
+        )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class RegistrarUsuarioTests(TestCase):
+
+    def test_perfil_criado_uma_vez_na_organizacao_de_quem_cadastrou(self):
+        Organizacao.objects.all().delete()  # a padrão vem da migração; não pode ser recriada aqui
+        outra = Organizacao.objects.create(slug='outra', nome='Outra')
+        form = RegistrarUsuarioComumForm(
+            {'username': 'novo', 'email': '', 'password1': SENHA, 'password2': SENHA}, organizacao=outra,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        usuario = form.save()
+        self.assertEqual(usuario.perfil.organizacao, outra)
+        self.assertEqual(PerfilUsuario.objects.filter(usuario=usuario).count(), 1)
+        self.assertFalse(Organizacao.objects.exclude(pk=outra.pk).exists())
+
+    def test_usuario_criado_fora_do_portal_vai_para_a_padrao(self):
+        usuario = User.objects.create(username='admin2')
+        self.assertEqual(usuario.perfil.organizacao, Organizacao.padrao())
+
+
+class DetectarTipoTests(SimpleTestCase):
+
+    def _tipo(self, dados):
+        return detectar_tipo(io.BytesIO(dados))
+
+    def _jpeg(self, largura, altura):
+        app0 = b'\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+        sof = b'\xff\xc0\x00\x11\x08' + struct.pack('>HH', altura, largura) + b'\x03' + b'\x00' * 9
+        return b'\xff\xd8' + app0 + sof + b'\xff\xd9'
+
+    def test_pdf(self):
+        self.assertEqual(self._tipo(PDF), 'application/pdf')
+        self.assertEqual(self._tipo(b'\xef\xbb\xbf\r\n' + PDF), 'application/pdf')
+
+    def test_pdf_no_meio_do_arquivo_nao_vale(self):
+        for dados in (b'<html><body>%PDF-1.4</body></html>', b'texto qualquer\n' + PDF):
+            with self.assertRaises(ConteudoInvalido):
+                self._tipo(dados)
+
+    def test_imagens(self):
+        self.assertEqual(self._tipo(_png(800, 600)), 'image/png')
+        self.assertEqual(self._tipo(self._jpeg(800, 600)), 'image/jpeg')
+        self.assertEqual(self._tipo(b'GIF89a' + struct.pack('<HH', 10, 10) + b'\x00' * 8), 'image/gif')
+
+    def test_imagem_gigante_ou_sem_dimensoes(self):
+        for dados in (_png(20000, 10), _png(10000, 10000), _png(0, 10), self._jpeg(0, 0)):
+            with self.assertRaises(ConteudoInvalido):
+                self._tipo(dados)
+
+    def test_corrompidos(self):
+        for dados in (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff\xe0\x00', b'GIF89a', b'RIFF\x00\x00\x00\x00WEBPVP8 ', b''):
+            with self.assertRaises(ConteudoInvalido):
+                self._tipo(dados)
+
+    def test_posicao_do_arquivo_preservada(self):
+        arquivo = io.BytesIO(PDF)
+        arquivo.seek(5)
+        detectar_tipo(arquivo)
+        self.assertEqual(arquivo.tell(), 5)
+
+
+class HandlerAssincronoTests(SimpleTestCase):
+
+    def _registro(self, mensagem):
+        return logging.LogRecord('teste', logging.INFO, __file__, 0, mensagem, (), None)
+
+    def test_descartados_sao_avisados_quando_a_fila_libera(self):
+        handler = HandlerAssincrono(tamanho_fila=2)
+        handler._pid = os.getpid()  # sem a thread de escrita: a fila só esvazia aqui
+        for i in range(3):
+            handler.handle(self._registro(f'r{i}'))
+        self.assertEqual(handler.descartados, 1)
+
+        handler.queue.get_nowait()
+        handler.queue.get_nowait()
+        handler.handle(self._registro('r3'))
+        aviso, registro = handler.queue.get_nowait(), handler.queue.get_nowait()
+        self.assertEqual(aviso.levelno, logging.WARNING)
+        self.assertEqual(aviso.descartados, 1)
+        self.assertEqual(registro.getMessage(), 'r3')
+        self.assertEqual(handler.descartados, 0)
+
+
+
+@override_settings(
+    MIDDLEWARE=['cartoes_app.logs.LogAcessoMiddleware', *settings.MIDDLEWARE],
+    LOG_ACESSO_AMOSTRAGEM=1,
+    LOG_ACESSO_LENTO_MS=60000,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+class LogAcessoMiddlewareTests(TestCase):
+    """Registros do log de acesso como em LOG_FORMAT=json: FormatadorJSON + HandlerAssincrono."""
+
+    def setUp(self):
+        self.handler = HandlerAssincrono()
+        self.handler._pid = os.getpid()  # sem a thread de escrita: os registros ficam na fila
+        self.handler.setFormatter(FormatadorJSON())
+        self.handler.addFilter(FiltroRequestId())
+        logger_acesso.addHandler(self.handler)
+        self.addCleanup(logger_acesso.removeHandler, self.handler)
+        propagacao = mock.patch.object(logger_acesso, 'propagate', False)
+        propagacao.start()
+        self.addCleanup(propagacao.stop)
+        self.usuario = User.objects.create(username='chefe', is_staff=True)
+
+    def _registros(self):
+        registros = []
+        while not self.handler.queue.empty():
+            registros.append(json.loads(self.handler.queue.get_nowait().msg))
+        return registros
+
+    def test_registro_json_com_os_campos_do_acesso(self):
+        self.client.force_login(self.usuario)
+        resposta = self.client.get(reverse('dashboard'), headers={'X-Request-ID': 'req-123'})
+        self.assertEqual(resposta['X-Request-ID'], 'req-123')
+
+        [registro] = self._registros()
+        self.assertEqual(
+            set(registro),
+            {'ts', 'nivel', 'logger', 'msg', 'request_id', 'metodo', 'caminho', 'status', 'duracao_ms',
+             'banco_ms', 'consultas', 'usuario_id', 'view', 'amostragem'},
+        )
+        self.assertEqual(registro['logger'], 'creditmanager.acesso')
+        self.assertEqual(registro['request_id'], 'req-123')
+        self.assertEqual(
+            (registro['metodo'], registro['caminho'], registro['status'], registro['view']),
+            ('GET', '/dashboard/', 200, 'dashboard'),
+        )
+        self.assertEqual(registro['usuario_id'], self.usuario.pk)
+        self.assertGreater(registro['consultas'], 0)
+
+    def test_request_id_invalido_e_trocado(self):
+        resposta = self.client.get(reverse('login'), headers={'X-Request-ID': 'não vale!'})
+        [registro] = self._registros()
+        self.assertRegex(registro['request_id'], r'^[0-9a-f]{32}$')
+        self.assertEqual(resposta['X-Request-ID'], registro['request_id'])
+        self.assertNotIn('usuario_id', registro)  # anônimo: None fica de fora
+
+    @override_settings(LOG_ACESSO_AMOSTRAGEM=0)
+    def test_amostragem_mantem_erros(self):
+        self.client.get(reverse('login'))
+        self.client.get('/nao-existe/')
+        self.assertEqual([registro['status'] for registro in self._registros()], [404])
+
+@override_settings(
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    RATE_LIMIT_ENABLED=False,
+)
+class EventosLoteTests(TransactionTestCase):
+    """Sem a transação do TestCase: o on_commit roda de verdade ao fim das escritas."""
+
+    def setUp(self):
+        self.organizacao = Organizacao.padrao()
+        usuario = User.objects.create(username='maria')
+        self.cartoes = [
+            CartaoCredito.objects.create(
+                organizacao=self.organizacao, usuario=usuario, nome=f'Cartão {i}', numero='4111111111111111',
+                mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'),
+                saldo_atual=Decimal('0'), bandeira='visa',
+            )
+            for i in range(2)
+        ]
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+
+    def _postar(self, acao, ao_publicar):
+        ids = [cartao.pk for cartao in self.cartoes]
+        with mock.patch('cartoes_app.views.publicar', side_effect=ao_publicar) as publicar:
+            resposta = self.client.post(reverse('cartoes_lote'), {'acao': acao, 'valor': '5', 'cartoes': ids})
+        self.assertEqual(resposta.status_code, 302)
+        publicar.assert_called_once_with({'tipo': 'recarregar', 'organizacao_id': self.organizacao.pk})
+
+    def test_recarregar_publica_depois_do_update(self):
+        def ao_publicar(evento):
+            saldos = set(CartaoCredito.objects.values_list('saldo_atual', flat=True))
+            self.assertEqual(saldos, {Decimal('5')})
+        self._postar('recarregar', ao_publicar)
+
+    def test_excluir_publica_depois_da_exclusao(self):
+        def ao_publicar(evento):
+            self.assertFalse(CartaoCredito.objects.exists())
+        self._postar('excluir', ao_publicar)
+
+
+class PeriodoTests(SimpleTestCase):
+
+    def _datas(self, periodo):
+        return periodo.inicio, periodo.fim
+
+    def test_fatura_fechamento_31_em_fevereiro(self):
+        self.assertEqual(self._datas(Periodo.fatura(date(2024, 3, 10), 31)), (date(2024, 3, 1), date(2024, 3, 31)))
+        self.assertEqual(self._datas(Periodo.fatura(date(2024, 2, 10), 31)), (date(2024, 2, 1), date(2024, 2, 29)))
+        self.assertEqual(self._datas(Periodo.fatura(date(2023, 2, 28), 31)), (date(2023, 2, 1), date(2023, 2, 28)))
+
+    def test_fatura_depois_do_fechamento_vai_para_o_proximo_ciclo(self):
+        self.assertEqual(self._datas(Periodo.fatura(date(2024, 1, 25), 25)), (date(2023, 12, 26), date(2024, 1, 25)))
+        self.assertEqual(self._datas(Periodo.fatura(date(2024, 1, 26), 25)), (date(2024, 1, 26), date(2024, 2, 25)))
+        self.assertEqual(self._datas(Periodo.fatura(date(2023, 12, 28), 25)), (date(2023, 12, 26), date(2024, 1, 25)))
+
+    @override_settings(FATURA_DIA_FECHAMENTO=31)
+    def test_anterior_da_fatura(self):
+        anterior = Periodo.fatura(date(2024, 3, 10), 31).anterior()
+        self.assertEqual(self._datas(anterior), (date(2024, 2, 1), date(2024, 2, 29)))
+        self.assertEqual(self._datas(anterior.anterior()), (date(2024, 1, 1), date(2024, 1, 31)))
+
+    def test_anterior_do_mes_vira_o_ano(self):
+        anterior = Periodo.mes(2024, 1).anterior()
+        self.assertEqual((anterior.chave, *self._datas(anterior)), ('mes_anterior', date(2023, 12, 1), date(2023, 12, 31)))
+
+    def test_anterior_do_intervalo_tem_a_mesma_duracao(self):
+        anterior = Periodo('personalizado', date(2024, 3, 1), date(2024, 3, 10)).anterior()
+        self.assertEqual(self._datas(anterior), (date(2024, 2, 20), date(2024, 2, 29)))
+        self.assertIsNone(Periodo('todos').anterior())
+
+    def test_dos_parametros(self):
+        hoje = date(2024, 2, 15)
+        periodo = Periodo.dos_parametros({'periodo': 'personalizado', 'inicio': '2024-01-05', 'fim': '2024-01-20'}, hoje)
+        self.assertEqual(periodo.parametros(), 'periodo=personalizado&inicio=2024-01-05&fim=2024-01-20')
+        self.assertEqual(Periodo.dos_parametros({'periodo': 'xyz'}, hoje).parametros(), 'periodo=mes_atual')
+
+    def test_dos_parametros_invalidos_nao_passam_para_a_url(self):
+        dados = {'periodo': 'personalizado', 'inicio': '2024-01-01&usuario=9', 'fim': '2024-01-31'}
+        periodo = Periodo.dos_parametros(dados, date(2024, 2, 15))
+        self.assertEqual(periodo.parametros(), 'periodo=personalizado&inicio=2024-02-01&fim=2024-02-29')
+
+
+class ImagensTests(TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            RATE_LIMIT_ENABLED=False,
+            IMAGEM_OTIMIZAR=True,
+            IMAGEM_MANTER_ORIGINAL=False,
+            IMAGEM_LADO_MAXIMO=2000,
+            IMAGEM_PROCESSOS=1,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.usuario = User.objects.create(username='maria')
+        self.cartao = CartaoCredito.objects.create(
+            organizacao=Organizacao.padrao(), usuario=self.usuario, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+
+    def _jpeg(self, largura, altura):
+        saida = io.BytesIO()
+        imagens.Image.effect_noise((largura, altura), 64).convert('RGB').save(saida, 'JPEG', quality=100)
+        return saida.getvalue()
+
+    @mock.patch('cartoes_app.views.agendar_imagens')
+    def test_upload_grava_como_veio_e_agenda_depois_do_commit(self, agendar):
+        self.client.force_login(self.usuario)
+        dados = _png(800, 600)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(reverse('gastos'), {
+                'cartao': self.cartao.pk, 'descricao': 'Mercado', 'valor': '10',
+                'data': timezone.localdate().isoformat(),
+                'anexos': SimpleUploadedFile('nota.png', dados, content_type='image/png'),
+            })
+        self.assertEqual(resposta.status_code, 302)
+        anexo = GastoAnexo.objects.get()
+        agendar.assert_called_once_with([anexo.pk])
+        self.assertIsNone(anexo.tamanho_original)
+        self.assertEqual(anexo.arquivo.size, len(dados))
+
+    @skipIf(imagens.Image is None, 'requer Pillow')
+    def test_otimizar_anexo(self):
+        dados = self._jpeg(3000, 300)
+        gasto = Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='Foto', valor=Decimal('1'))
+        anexo = GastoAnexo.objects.create(
+            gasto=gasto, arquivo=ContentFile(dados, name='foto.jpg'), nome_original='foto.jpg', tipo_conteudo='image/jpeg',
+        )
+        antigo = anexo.arquivo.name
+
+        self.assertTrue(imagens.otimizar_anexo(anexo))
+
+        anexo.refresh_from_db()
+        self.assertEqual(anexo.tamanho_original, len(dados))
+        self.assertLess(anexo.arquivo.size, len(dados))
+        with imagens.Image.open(anexo.arquivo.path) as imagem:
+            self.assertEqual(imagem.size, (2000, 200))
+        self.assertFalse(anexo.arquivo.storage.exists(antigo))
+
+    def test_anexo_apagado_durante_a_recompressao_nao_deixa_arquivo(self):
+        gasto = Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='Foto', valor=Decimal('1'))
+        anexo = GastoAnexo.objects.create(
+            gasto=gasto, arquivo=ContentFile(_png(800, 600), name='foto.png'), tipo_conteudo='image/png',
+        )
+
+        def apagar_no_meio(futuro):
+            GastoAnexo.objects.filter(pk=anexo.pk).delete()
+            return b'menor'
+
+        with mock.patch.object(imagens, 'submeter'), mock.patch.object(imagens, 'resultado', apagar_no_meio):
+            self.assertFalse(imagens.otimizar_anexo(anexo))
+        self.assertEqual(os.listdir(os.path.join(self.pasta, 'gastos')), [])
+
+    def test_timeout_cancela_ou_encerra_o_pool(self):
+        futuro = mock.Mock()
+        futuro.result.side_effect = imagens.TempoEsgotado
+        with mock.patch.object(imagens, '_descartar_pool') as descartar:
+            futuro.cancel.return_value = True
+            with self.assertRaises(imagens.TempoEsgotado):
+                imagens.resultado(futuro)
+            descartar.assert_not_called()
+
+            futuro.cancel.return_value = False  # já estava rodando
+            with self.assertRaises(imagens.TempoEsgotado):
+                imagens.resultado(futuro)
+            descartar.assert_called_once_with(encerrar=True)
+
+
+@override_settings(
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMIT_CACHE='default',
+    RATE_LIMIT_TRUST_X_FORWARDED_FOR=False,
+    RATE_LIMIT_LOGIN='2/m',
+    LOGIN_MAX_CONCORRENTES=1,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'limites-testes'}},
+)
+class LimitesTests(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.fabrica = RequestFactory()
+        self.respostas_internas = []
+
+        @limitar('login', 'RATE_LIMIT_LOGIN', 'LOGIN_MAX_CONCORRENTES', campo_usuario='username')
+        def view(request, reentrar=False):
+            if reentrar:
+                self.respostas_internas.append(view(self._post()))
+            return HttpResponse('ok')
+        self.view = view
+
+    def _post(self, ip='10.0.0.1', username='maria', **extra):
+        request = self.fabrica.post('/login/', {'username': username}, REMOTE_ADDR=ip, **extra)
+        request.user = AnonymousUser()
+        return request
+
+    def test_excesso_responde_429_com_retry_after(self):
+        self.assertEqual([self.view(self._post()).status_code for _ in range(2)], [200, 200])
+        resposta = self.view(self._post())
+        self.assertEqual(resposta.status_code, 429)
+        self.assertTrue(1 <= int(resposta['Retry-After']) <= 60)
+
+    def test_janela_deslizante_conta_parte_da_janela_anterior(self):
+        inicio = 60 * 1000
+        with mock.patch('cartoes_app.limites.time.time', return_value=inicio):
+            self.assertEqual(consumir('k', 2, 60), 0)
+            self.assertEqual(consumir('k', 2, 60), 0)
+        with mock.patch('cartoes_app.limites.time.time', return_value=inicio + 90):
+            # metade da janela anterior (2 * 0.5) + 1 ainda cabe; a seguinte não
+            self.assertEqual(consumir('k', 2, 60), 0)
+            self.assertEqual(consumir('k', 2, 60), 30)
+        with mock.patch('cartoes_app.limites.time.time', return_value=inicio + 150):
+            self.assertEqual(consumir('k', 2, 60), 0)
+
+    def test_conta_e_limitada_por_ip(self):
+        for _ in range(2):
+            self.view(self._post(ip='10.0.0.1'))
+        self.assertEqual(self.view(self._post(ip='10.0.0.1')).status_code, 429)
+        # tentativas de outro IP não bloqueiam a conta de quem está em 10.0.0.2
+        self.assertEqual(self.view(self._post(ip='10.0.0.2')).status_code, 200)
+
+    @override_settings(RATE_LIMIT_TRUST_X_FORWARDED_FOR=True)
+    def test_ip_do_x_forwarded_for(self):
+        for ip in ('1.1.1.1', '2.2.2.2'):
+            for _ in range(2):
+                resposta = self.view(self._post(ip='127.0.0.1', HTTP_X_FORWARDED_FOR=f'9.9.9.9, {ip}'))
+                self.assertEqual(resposta.status_code, 200)
+
+    @override_settings(RATE_LIMIT_LOGIN='')
+    def test_concorrencia_acima_do_maximo_responde_429(self):
+        self.assertEqual(self.view(self._post(), reentrar=True).status_code, 200)
+        self.assertEqual(self.respostas_internas[0].status_code, 429)
+        self.assertEqual(self.respostas_internas[0]['Retry-After'], '1')
+        self.assertEqual(self.view(self._post()).status_code, 200)
+        self.assertEqual(caches['default'].get('concorrencia:login'), 0)
+
+    def test_concorrencia_renova_o_timeout_a_cada_entrada(self):
+        with mock.patch('time.time', return_value=1000.0):
+            primeira = concorrencia('c', 5)
+            primeira.__enter__()
+        with mock.patch('time.time', return_value=1100.0):
+            segunda = concorrencia('c', 5)
+            segunda.__enter__()
+        with mock.patch('time.time', return_value=1150.0):
+            self.assertEqual(caches['default'].get('concorrencia:c'), 2)
+            primeira.__exit__(None, None, None)
+            segunda.__exit__(None, None, None)
+            self.assertEqual(caches['default'].get('concorrencia:c'), 0)
+
+    def test_concorrencia_nunca_fica_negativa(self):
+        with concorrencia('c', 5):
+            caches['default'].set('concorrencia:c', 0)  # contagem reiniciada por outro worker
+        self.assertEqual(caches['default'].get('concorrencia:c'), 0)
+
+    def test_check_exige_cache_compartilhado(self):
+        self.assertEqual([erro.id for erro in verificar_cache_concorrencia(None)], ['cartoes_app.E001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://x'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(verificar_cache_concorrencia(None), [])
+        with override_settings(LOGIN_MAX_CONCORRENTES=0, GASTOS_MAX_CONCORRENTES=0):
+            self.assertEqual(verificar_cache_concorrencia(None), [])
+
+
+class GastosDuplicadosTests(TestCase):
+
+    def setUp(self):
+        self.usuario = User.objects.create(username='maria')
+        self.cartao = CartaoCredito.objects.create(
+            organizacao=Organizacao.padrao(), usuario=self.usuario, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+        self.client.force_login(self.usuario)
+
+    def _post(self, chave=None, **extra):
+        dados = {
+            'cartao': self.cartao.pk, 'descricao': 'Mercado', 'valor': '45.90',
+            'data': date(2026, 3, 10).isoformat(), 'chave_idempotencia': str(chave or uuid.uuid4()),
+        }
+        dados.update(extra)
+        return self.client.post(reverse('gastos'), dados)
+
+    def test_reenvio_da_mesma_chave_nao_duplica(self):
+        chave = uuid.uuid4()
+        self.assertEqual(self._post(chave).status_code, 302)
+        resposta = self._post(chave)
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(Gasto.objects.count(), 1)
+        self.assertIn('já havia sido registrado', str(list(get_messages(resposta.wsgi_request))))
+
+    def test_envio_simultaneo_barrado_pela_constraint_devolve_o_existente(self):
+        chave = uuid.uuid4()
+        self._post(chave)
+        existente = Gasto.objects.get()
+        # o outro envio passou pela verificação antes deste gravar
+        with mock.patch('cartoes_app.views._gasto_ja_registrado', side_effect=[None, existente]):
+            resposta = self._post(chave, descricao='Mercado (2)')
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(list(Gasto.objects.values_list('pk', flat=True)), [existente.pk])
+
+    def test_chave_unica_no_banco(self):
+        chave = uuid.uuid4()
+        Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='A', valor=1, chave_idempotencia=chave)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='B', valor=1, chave_idempotencia=chave)
+        Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='C', valor=1)
+        Gasto.objects.create(usuario=self.usuario, cartao=self.cartao, descricao='D', valor=1)
+
+    def test_duplicado_exige_confirmacao(self):
+        self._post()
+        resposta = self._post(descricao='  mercado ')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('confirmar_duplicado', resposta.context['form'].errors)
+        self.assertEqual(Gasto.objects.count(), 1)
+
+        self.assertEqual(self._post(descricao='  mercado ', confirmar_duplicado='on').status_code, 302)
+        self.assertEqual(Gasto.objects.count(), 2)
+
+    def test_comando_detectar_gastos_duplicados(self):
+        dia = date(2026, 3, 10)
+        for data in (dia, dia, dia + timedelta(days=1), dia + timedelta(days=10)):
+            Gasto.objects.create(
+                usuario=self.usuario, cartao=self.cartao, descricao='Mercado', valor=Decimal('45.90'), data=data,
+            )
+        saida = io.StringIO()
+        call_command('detectar_gastos_duplicados', stdout=saida)
+        texto = saida.getvalue()
+        self.assertIn('1 grupos de gastos idênticos.', texto)
+        self.assertIn('1 pares de gastos quase idênticos (janela de 3 dias).', texto)
+
+
+@override_settings(
+    DATABASE_ROUTERS=['cartoes_app.roteadores.RoteadorReplica'],
+    MIDDLEWARE=[
+        *settings.MIDDLEWARE[:2], 'cartoes_app.roteadores.FixarPrimarioMiddleware',
+        *[m for m in settings.MIDDLEWARE[2:] if m != 'cartoes_app.roteadores.FixarPrimarioMiddleware'],
+    ],
+    USER_CACHE_TIMEOUT=0,
+    AUTHENTICATION_BACKENDS=['django.contrib.auth.backends.ModelBackend'],
+)
+class RoteadorReplicaTests(TransactionTestCase):
+    """
+    Réplica como no settings com DATABASE_REPLICA_URL: um segundo alias com
+    TEST MIRROR 'default'. TransactionTestCase para a outra conexão ver os dados.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # criado só aqui, depois do banco de teste: o runner e os checks não conhecem o alias
+        if ALIAS_REPLICA not in connections.settings:
+            connections.settings[ALIAS_REPLICA] = {
+                **connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'},
+            }
+            cls.addClassCleanup(cls._remover_replica)
+        cls.databases = {'default', ALIAS_REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def _remover_replica(cls):
+        connections[ALIAS_REPLICA].close()
+        del connections[ALIAS_REPLICA]
+        del connections.settings[ALIAS_REPLICA]
+
+    def setUp(self):
+        self.fabrica = RequestFactory()
+
+    def _banco_de_leitura(self, request, view_decorada=True):
+        def view(request):
+            return HttpResponse(router.db_for_read(Gasto))
+        if view_decorada:
+            view = usar_replica(view)
+        return FixarPrimarioMiddleware(view)(request).content.decode()
+
+    def test_db_for_read(self):
+        self.assertEqual(self._banco_de_leitura(self.fabrica.get('/')), ALIAS_REPLICA)
+        self.assertEqual(self._banco_de_leitura(self.fabrica.get('/'), view_decorada=False), 'default')
+        self.assertEqual(self._banco_de_leitura(self.fabrica.post('/')), 'default')
+        fixado = self.fabrica.get('/')
+        fixado.COOKIES[COOKIE_FIXAR_PRIMARIO] = '1'
+        self.assertEqual(self._banco_de_leitura(fixado), 'default')
+        self.assertEqual(router.db_for_read(Gasto), 'default')  # fora da view
+        self.assertEqual(router.db_for_write(Gasto), 'default')
+
+    def test_dashboard_le_da_replica_ate_a_primeira_escrita(self):
+        self.client.force_login(User.objects.create(username='chefe', is_staff=True))
+        with CaptureQueriesContext(connections[ALIAS_REPLICA]) as replica:
+            self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+        self.assertGreater(len(replica), 0)
+
+        resposta = self.client.post(reverse('dashboard'))
+        self.assertIn(COOKIE_FIXAR_PRIMARIO, resposta.cookies)
+        with CaptureQueriesContext(connections[ALIAS_REPLICA]) as replica:
+            self.assertEqual(self.client.get(reverse('dashboard')).status_code, 200)
+        self.assertEqual(len(replica), 0)
+
+
+@override_settings(
+    AUTHENTICATION_BACKENDS=['cartoes_app.backends.CachedModelBackend'],
+    USER_CACHE_TIMEOUT=300,
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'usuarios-testes'}},
+)
+class CachedModelBackendTests(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.backend = CachedModelBackend()
+        self.usuario = User.objects.create(username='maria')
+        self.permissao = Permission.objects.get(codename='view_gasto')
+
+    def _consultas_auth_user(self, contexto):
+        return [q['sql'] for q in contexto.captured_queries if 'FROM "auth_user"' in q['sql']]
+
+    def test_cache_evita_consulta_do_usuario(self):
+        with self.assertNumQueries(1):
+            self.backend.get_user(self.usuario.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.usuario.pk), self.usuario)
+
+        self.client.force_login(self.usuario)
+        self.client.get(reverse('gastos'))
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.client.get(reverse('gastos')).status_code, 200)
+        self.assertEqual(self._consultas_auth_user(contexto), [])
+
+    def test_save_e_desativacao_removem_do_cache(self):
+        self.backend.get_user(self.usuario.pk)
+        self.usuario.first_name = 'Maria'
+        self.usuario.save()
+        self.assertIsNone(caches['default'].get(chave_cache_usuario(self.usuario.pk)))
+        self.assertEqual(self.backend.get_user(self.usuario.pk).first_name, 'Maria')
+
+        self.usuario.is_active = False
+        self.usuario.save()
+        self.assertIsNone(self.backend.get_user(self.usuario.pk))
+
+    def test_permissoes_do_usuario_e_do_grupo(self):
+        def permissoes():
+            return self.backend.get_all_permissions(User.objects.get(pk=self.usuario.pk))
+
+        self.assertEqual(permissoes(), set())
+        self.usuario.user_permissions.add(self.permissao)
+        self.assertEqual(permissoes(), {'cartoes_app.view_gasto'})
+        self.usuario.user_permissions.clear()
+
+        grupo = Group.objects.create(name='financeiro')
+        self.usuario.groups.add(grupo)
+        self.assertEqual(permissoes(), set())
+        grupo.permissions.add(self.permissao)
+        self.assertEqual(permissoes(), {'cartoes_app.view_gasto'})
+
+    def test_troca_de_organizacao_remove_do_cache(self):
+        self.assertEqual(organizacao_do_usuario(self.usuario), Organizacao.padrao())
+        outra = Organizacao.objects.create(slug='outra', nome='Outra')
+        perfil = self.usuario.perfil
+        perfil.organizacao = outra
+        perfil.save()
+        self.assertEqual(organizacao_do_usuario(self.usuario), outra)
+
+
+class SaldosAoVivoTests(TestCase):
+
+    def setUp(self):
+        self.chefe = User.objects.create(username='chefe', is_staff=True)
+
+    async def test_hub_entrega_evento_ao_assinante_da_organizacao(self):
+        fluxo = fluxo_sse(1)
+        self.assertEqual(await anext(fluxo), 'retry: 5000\n\n')
+        proximo = asyncio.ensure_future(anext(fluxo))
+        await asyncio.sleep(0)  # assinatura feita no primeiro passo do gerador
+        self.assertTrue(hub.tem_assinantes())
+
+        # publicado de outra thread, como nas views síncronas
+        await asyncio.to_thread(publicar, {'tipo': 'gasto', 'organizacao_id': 2, 'delta': 100})
+        await asyncio.to_thread(publicar, {'tipo': 'gasto', 'organizacao_id': 1, 'delta': 250})
+        mensagem = await asyncio.wait_for(proximo, 5)
+        self.assertTrue(mensagem.startswith('event: gasto\ndata: '))
+        self.assertEqual(json.loads(mensagem.split('data: ', 1)[1])['delta'], 250)
+
+        await fluxo.aclose()
+        self.assertFalse(hub.tem_assinantes())
+
+    def test_wsgi_nao_abre_o_eventsource(self):
+        self.client.force_login(self.chefe)
+        with override_settings(SALDOS_AO_VIVO=True):
+            self.assertNotContains(self.client.get(reverse('dashboard')), 'data-eventos=')
+            self.assertEqual(self.client.get(reverse('eventos_saldos')).status_code, 204)
+
+    async def test_asgi_abre_o_eventsource_so_com_a_configuracao(self):
+        await self.async_client.aforce_login(self.chefe)
+        url = reverse('eventos_saldos')
+        self.assertNotContains(await self.async_client.get(reverse('dashboard')), 'data-eventos=')
+        with override_settings(SALDOS_AO_VIVO=True):
+            self.assertContains(await self.async_client.get(reverse('dashboard')), f'data-eventos="{url}"')
+
+
+class _ConexaoPostgres:
+    """Conexão falsa só para o PaginadorEstimado: devolve `reltuples` do pg_class."""
+    vendor = 'postgresql'
+
+    def __init__(self, reltuples):
+        self.reltuples = reltuples
+        self.consultas = 0
+
+    @contextmanager
+    def cursor(self):
+        self.consultas += 1
+        cursor = mock.Mock()
+        cursor.fetchone.return_value = (self.reltuples,)
+        yield cursor
+
+
+@override_settings(
+    ADMIN_CONTAGEM_ESTIMADA_MINIMA=10000,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+class ListaGrandeAdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        cls.usuarios = [User.objects.create(username=f'usuario{i}') for i in range(3)]
+        for usuario in cls.usuarios:
+            cartao = CartaoCredito.objects.create(
+                organizacao=Organizacao.padrao(), usuario=usuario, nome='Visa', numero='4111111111111111',
+                mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+            )
+            Gasto.objects.create(usuario=usuario, cartao=cartao, descricao='Mercado', valor=Decimal('10'))
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def _contagem(self, parametros='', reltuples=None):
+        url = reverse('admin:cartoes_app_gasto_changelist') + parametros
+        conexao = _ConexaoPostgres(reltuples)
+        if reltuples is None:
+            resposta = self.client.get(url)
+        else:
+            with mock.patch('cartoes_app.admin.connections', {'default': conexao}):
+                resposta = self.client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.context['cl'].result_count, conexao.consultas
+
+    def test_estimativa_na_tabela_grande_sem_filtro(self):
+        self.assertEqual(self._contagem(reltuples=50000), (50000, 1))
+
+    def test_tabela_pequena_ou_nao_analisada_conta_exato(self):
+        self.assertEqual(self._contagem(reltuples=9999), (3, 1))
+        self.assertEqual(self._contagem(reltuples=-1), (3, 1))
+
+    def test_filtro_ou_busca_conta_exato(self):
+        filtro = f'?usuario__id__exact={self.usuarios[0].pk}'
+        self.assertEqual(self._contagem(filtro, reltuples=50000), (1, 0))
+        self.assertEqual(self._contagem('?q=Mercado', reltuples=50000), (3, 0))
+
+    def test_outros_bancos_contam_exato(self):
+        self.assertEqual(self._contagem(), (3, 0))
+
+    def test_filtro_autocomplete_nao_lista_os_usuarios(self):
+        usuario = self.usuarios[1]
+        url = reverse('admin:cartoes_app_gasto_changelist')
+        resposta = self.client.get(f'{url}?usuario__id__exact={usuario.pk}')
+        self.assertContains(resposta, 'id="filtro_usuario__id__exact"')
+        self.assertContains(resposta, f'<option value="{usuario.pk}" selected>{usuario.username}</option>', html=True)
+        self.assertNotContains(resposta, f'?usuario__id__exact={self.usuarios[2].pk}')
+
+
+@override_settings(
+    MIDDLEWARE=[*settings.MIDDLEWARE, 'cartoes_app.perfil.PerfilMiddleware'],
+    PERFIL_HABILITADO=True,
+    PERFIL_TOP=5,
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+class PerfilMiddlewareTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.chefe = User.objects.create(username='chefe', is_staff=True)
+        cls.comum = User.objects.create(username='comum')
+
+    def _get(self, usuario, parametros):
+        self.client.force_login(usuario)
+        return self.client.get(reverse('dashboard') + parametros)
+
+    def test_staff_recebe_o_relatorio_de_cpu(self):
+        resposta = self._get(self.chefe, '?_perfil=cpu')
+        self.assertEqual(resposta['Content-Type'], 'text/plain; charset=utf-8')
+        relatorio = resposta.content.decode()
+        self.assertIn('GET /dashboard/?_perfil=cpu -> 200', relatorio)
+        self.assertIn('== CPU: 5 funções por tempo acumulado ==', relatorio)
+        self.assertIn('cumulative', relatorio)  # cabeçalho das colunas do pstats
+        self.assertNotIn('== Memória', relatorio)
+
+    def test_staff_recebe_o_relatorio_de_memoria(self):
+        relatorio = self._get(self.chefe, '?_perfil=mem').content.decode()
+        self.assertIn('== Memória: pico', relatorio)
+        self.assertNotIn('== CPU', relatorio)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_salvar_grava_o_relatorio_e_devolve_a_pagina(self):
+        pasta = tempfile.mkdtemp(prefix='cartoes-perfis-')
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        with override_settings(PERFIL_DIR=pasta):
+            resposta = self._get(self.chefe, '?_perfil=tudo&_perfil_salvar=1')
+        self.assertContains(resposta, 'painel-usuarios')
+        self.assertEqual(os.listdir(pasta), [resposta['X-Perfil']])
+        with open(os.path.join(pasta, resposta['X-Perfil']), encoding='utf-8') as arquivo:
+            relatorio = arquivo.read()
+        self.assertIn('== Memória', relatorio)
+        self.assertIn('== CPU', relatorio)
+
+    def test_so_staff_e_so_com_a_configuracao(self):
+        self.assertNotIn('X-Perfil', self._get(self.comum, '?_perfil=cpu'))
+        self.assertEqual(self._get(self.comum, '?_perfil=cpu')['Content-Type'], 'text/html; charset=utf-8')
+        with override_settings(PERFIL_HABILITADO=False):
+            self.assertContains(self._get(self.chefe, '?_perfil=cpu'), 'painel-usuarios')
+        self.assertContains(self._get(self.chefe, '?_perfil=outro'), 'painel-usuarios')
+
+
+@override_settings(
+    TEMPLATE_FRAGMENT_TIMEOUT=600,
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragmentos-testes-padrao'},
+        'template_fragments': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'fragmentos-testes',
+        },
+    },
+)
+class CacheFragmentosTests(TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        caches['template_fragments'].clear()
+
+        usuario = User.objects.create(username='maria')
+        cartao = CartaoCredito.objects.create(
+            organizacao=Organizacao.padrao(), usuario=usuario, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+        self.gasto = Gasto.objects.create(usuario=usuario, cartao=cartao, descricao='Mercado', valor=Decimal('10'))
+        self.client.force_login(usuario)
+
+    def _pagina(self):
+        return self.client.get(reverse('gastos')).content.decode()
+
+    def test_edicao_do_gasto_troca_a_linha(self):
+        self.assertIn('Mercado', self._pagina())
+        # sem mudar atualizado_em a linha continua vindo do cache
+        Gasto.objects.filter(pk=self.gasto.pk).update(descricao='Padaria')
+        self.assertIn('Mercado', self._pagina())
+
+        self.gasto.descricao = 'Feira'
+        self.gasto.save()
+        pagina = self._pagina()
+        self.assertIn('Feira', pagina)
+        self.assertNotIn('Mercado', pagina)
+
+    def test_edicao_do_cartao_troca_o_resumo_e_as_linhas(self):
+        cartao = self.gasto.cartao
+        self._pagina()
+        # sem mudar atualizado_em o resumo e as linhas continuam com o nome antigo
+        CartaoCredito.objects.filter(pk=cartao.pk).update(nome='Elo')
+        self.assertIn('Visa', self._pagina())
+
+        cartao.nome = 'Elo'
+        cartao.save()
+        self.assertEqual(self._pagina().count('Visa'), 0)
+
+    def test_anexo_novo_ou_removido_troca_a_linha(self):
+        self.assertNotIn('Arquivo 1', self._pagina())
+        anexo = GastoAnexo.objects.create(
+            gasto=self.gasto, arquivo=ContentFile(PDF, name='nota.pdf'), tipo_conteudo='application/pdf',
+        )
+        url = anexo.arquivo.url
+        self.assertIn(url, self._pagina())
+        anexo.delete()
+        self.assertNotIn(url, self._pagina())
+
+
+class VarrerArquivosRemovidosTests(TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp(prefix='cartoes-midia-')
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        configuracao = override_settings(
+            MEDIA_ROOT=self.pasta,
+            STORAGES={'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}},
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def test_remove_arquivo_e_original_da_fila(self):
+        usuario = User.objects.create(username='maria')
+        cartao = CartaoCredito.objects.create(
+            organizacao=Organizacao.padrao(), usuario=usuario, nome='Visa', numero='4111111111111111',
+            mes_vencimento=1, ano_vencimento=timezone.now().year + 1, limite=Decimal('100'), bandeira='visa',
+        )
+        gasto = Gasto.objects.create(usuario=usuario, cartao=cartao, descricao='Mercado', valor=Decimal('10'))
+        anexo = GastoAnexo.objects.create(
+            gasto=gasto, arquivo=ContentFile(PDF, name='recibo.pdf'),
+            arquivo_original=ContentFile(PDF, name='original.pdf'), tipo_conteudo='application/pdf',
+        )
+        nomes = [anexo.arquivo.name, anexo.arquivo_original.name]
+
+        self.assertEqual(excluir_lote_gastos([cartao.pk]), 1)
+        self.assertCountEqual(RemocaoArquivoPendente.objects.values_list('arquivo', flat=True), nomes)
+        for nome in nomes:
+            self.assertTrue(anexo.arquivo.storage.exists(nome))
+
+        saida = io.StringIO()
+        call_command('varrer_arquivos_removidos', stdout=saida)
+        self.assertEqual(saida.getvalue().strip(), '2 arquivos removidos; 0 ainda na fila.')
+        for nome in nomes:
+            self.assertFalse(anexo.arquivo.storage.exists(nome))
+
+
+class AquecimentoTests(SimpleTestCase):
+    """SimpleTestCase: qualquer consulta ao banco falha o teste (o --preload depende disso)."""
+
+    def test_aquecer_sem_consultar_o_banco(self):
+        with self.assertLogs('cartoes_app.aquecimento', 'INFO') as logs:
+            aquecer()
+        quantidade = len(list(Path(aquecimento.__file__).with_name('templates').rglob('*.html')))
+        self.assertEqual(
+            logs.output, [f'INFO:cartoes_app.aquecimento:Aquecimento concluído: {quantidade} templates compilados.'],
+        )
+
+
+# urlconf do ServirMidiaTests: a do projeto mais a rota de MEDIA_STORAGE_MODE=imutavel
+urlpatterns = [re_path(r'^media/(?P<path>.+)$', servir_midia)] + urls_projeto.urlpatterns
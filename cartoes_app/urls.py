@@ -5,15 +5,19 @@ from django.contrib.auth.views import LogoutView
 from .views import (
     # acesso_view,
     dashboard_view,
+    eventos_saldos_view,
     PortalLoginView,
     editar_cartao_view,
     confirmar_exclusao_view,
+    excluir_cartao_progresso_view,
     registrar_usuario_view,
     usuarios_view,
     gastos_view,
     criar_cartao_view,
     excluir_anexo_gasto,
     recarregar_cartao_view,
+    cartoes_lote_view,
+    excluir_cartoes_lote_progresso_view,
     github_deploy,
 )
 
@@ -23,6 +27,7 @@ urlpatterns = [
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
 
     path('dashboard/', dashboard_view, name='dashboard'),
+    path('dashboard/eventos/', eventos_saldos_view, name='eventos_saldos'),
 
     # path('acesso/', acesso_view, name='acesso'),
     path('cartoes/<int:cartao_id>/recarregar/', recarregar_cartao_view, name='recarregar_cartao'),
@@ -30,7 +35,10 @@ urlpatterns = [
     # Cartões
     path('editar-cartao/<int:cartao_id>/', editar_cartao_view, name='editar_cartao'),
     path('excluir-cartao/<int:cartao_id>/', confirmar_exclusao_view, name='excluir_cartao'),
+    path('excluir-cartao/<int:cartao_id>/progresso/', excluir_cartao_progresso_view, name='excluir_cartao_progresso'),
     path('cartoes/novo/', criar_cartao_view, name='criar_cartao'),
+    path('cartoes/lote/', cartoes_lote_view, name='cartoes_lote'),
+    path('cartoes/lote/excluir/', excluir_cartoes_lote_progresso_view, name='excluir_cartoes_lote_progresso'),
 
     # Usuários
     path('registrar-usuario/', registrar_usuario_view, name='registrar_usuario'),  # admin-only
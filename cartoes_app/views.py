@@ -1,27 +1,53 @@
 # cartoes_app/views.py
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.models import User
-from django.db.models import Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
 from django.urls import reverse
 from django.contrib.auth.views import LoginView
-from django.http import HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+import csv
+import io
+import mimetypes
+import os
 import subprocess
-from datetime import date, timedelta
-from calendar import monthrange
 from decimal import Decimal
 from .models import CartaoCredito, Gasto, GastoAnexo
-from .forms import CartaoCreditoAdminForm, RegistrarUsuarioComumForm, GastoForm, RecargaSaldoForm
-import subprocess
+from .forms import (
+    CartaoCreditoAdminForm, RegistrarUsuarioComumForm, GastoForm, RecargaSaldoForm,
+    CartaoCreditoLoteForm, ImportarCartoesForm, OperacaoLoteCartoesForm,
+)
+from .conteudo import nome_com_extensao
+from .imagens import agendar as agendar_imagens
+from .storage import nome_imutavel
+from .exclusao import LOTE_EXCLUSAO, excluir_cartoes, excluir_lote_gastos
+from .roteadores import usar_replica
+from .periodos import OPCOES as PERIODOS, Periodo
+from .limites import limitar
+from .resumos import resumo_usuario, resumos_usuarios
+from .eventos import fluxo_sse, publicar
+from .organizacoes import organizacao_do_usuario, usuarios_comuns
 
 
 @staff_member_required
 def recarregar_cartao_view(request, cartao_id):
-    cartao = get_object_or_404(CartaoCredito, id=cartao_id)
+    cartao = get_object_or_404(CartaoCredito.objects.da_organizacao(request.organizacao), id=cartao_id)
 
     if request.method == "POST":
         form = RecargaSaldoForm(request.POST)
@@ -55,6 +81,10 @@ def recarregar_cartao_view(request, cartao_id):
 #     })
 
 
+@method_decorator(
+    limitar('login', 'RATE_LIMIT_LOGIN', 'LOGIN_MAX_CONCORRENTES', campo_usuario='username'),
+    name='dispatch',
+)
 class PortalLoginView(LoginView):
     """
     Login unificado. Após autenticar:
@@ -71,88 +101,76 @@ class PortalLoginView(LoginView):
 
 # ========== Dashboard ==========
 @login_required
+@usar_replica
 def dashboard_view(request):
     if request.user.is_staff:
-        # Admin vê todos os usuários comuns e seus cartões
-        usuarios = (
-            User.objects.filter(is_staff=False)
-            .order_by('username')
-            .prefetch_related('cartoes')  # cartoes = related_name no model CartaoCredito(usuario)
-        )
-
-        hoje = date.today()
-        periodo = request.GET.get('periodo', 'mes_atual')
-        if periodo == 'mes_atual':
-            start = date(hoje.year, hoje.month, 1)
-            end = date(hoje.year, hoje.month, monthrange(hoje.year, hoje.month)[1])
-        elif periodo == 'ult_30':
-            start = hoje - timedelta(days=30)
-            end = hoje
-        else:
-            start, end = None, None
-
-        date_filter = {}
-        if start and end:
-            date_filter = {'data__range': (start, end)}
+        # Admin vê os usuários comuns da sua organização e seus cartões
+        usuarios = usuarios_comuns(request.organizacao).order_by('username')
+        periodo = Periodo.da_requisicao(request)
 
-        # Calcula saldo de cada usuário
-        for u in usuarios:
-            limite_total = CartaoCredito.objects.filter(usuario=u).aggregate(total=Sum('limite'))['total'] or Decimal('0')
-            gasto_total = Gasto.objects.filter(usuario=u, **date_filter).aggregate(total=Sum('valor'))['total'] or Decimal('0')
-            u.saldo = limite_total - gasto_total
-            u.limite_total = limite_total
-            u.gasto_total = gasto_total
+        # Saldo de cada usuário: cartões e gastos do período em consultas agregadas
+        usuarios = resumos_usuarios(usuarios, periodo, request.organizacao)
 
-        total_usuarios = usuarios.count()
-        total_cartoes = CartaoCredito.objects.count()
-        limite_total = CartaoCredito.objects.aggregate(total=Sum('limite'))['total'] or Decimal('0')
+        totais = CartaoCredito.objects.da_organizacao(request.organizacao).aggregate(
+            quantidade=Count('id'), limite=Sum('limite'),
+        )
+        total_usuarios = len(usuarios)
+        total_cartoes = totais['quantidade']
+        limite_total = totais['limite'] or Decimal('0')
 
         context = {
             'usuarios': usuarios,
             'total_usuarios': total_usuarios,
             'total_cartoes': total_cartoes,
             'limite_total': limite_total,
-            'periodo': periodo,
-            'periodo_inicio': start,
-            'periodo_fim': end,
+            'periodo': periodo.chave,
+            'periodo_inicio': periodo.inicio,
+            'periodo_fim': periodo.fim,
+            'saldos_ao_vivo': _saldos_ao_vivo(request),
         }
 
     else:
         # Usuário comum
-        cartoes = CartaoCredito.objects.filter(usuario=request.user).order_by('nome')
-
-        hoje = date.today()
-        periodo = request.GET.get('periodo', 'mes_atual')
-        if periodo == 'mes_atual':
-            start = date(hoje.year, hoje.month, 1)
-            end = date(hoje.year, hoje.month, monthrange(hoje.year, hoje.month)[1])
-        elif periodo == 'ult_30':
-            start = hoje - timedelta(days=30)
-            end = hoje
-        else:
-            start, end = None, None
-
-        date_filter = {}
-        if start and end:
-            date_filter = {'data__range': (start, end)}
-
-        limite_total = cartoes.aggregate(total=Sum('limite'))['total'] or Decimal('0')
-        gasto_total = Gasto.objects.filter(usuario=request.user, **date_filter).aggregate(total=Sum('valor'))['total'] or Decimal('0')
-        saldo = limite_total - gasto_total
+        periodo = Periodo.da_requisicao(request)
+        resumo = resumo_usuario(request.user, periodo, request.organizacao)
 
         context = {
-            'cartoes': cartoes,
-            'limite_total': limite_total,
-            'gasto_total': gasto_total,
-            'saldo': saldo,
-            'periodo': periodo,
-            'periodo_inicio': start,
-            'periodo_fim': end,
+            'cartoes': resumo.cartoes,
+            'limite_total': resumo.limite_total,
+            'gasto_total': resumo.gasto_total,
+            'saldo': resumo.saldo,
+            'periodo': periodo.chave,
+            'periodo_inicio': periodo.inicio,
+            'periodo_fim': periodo.fim,
         }
 
     return render(request, 'cartoes_app/dashboard.html', context)
 
 
+def _saldos_ao_vivo(request):
+    """SSE de saldos ligado (SALDOS_AO_VIVO) e requisição servida pelo ASGI."""
+    return settings.SALDOS_AO_VIVO and isinstance(request, ASGIRequest)
+
+
+async def eventos_saldos_view(request):
+    """
+    Server-sent events com as alterações de saldo para o dashboard do admin.
+    Só funciona com SALDOS_AO_VIVO servindo pelo ASGI; fora disso responde 204
+    e o navegador não reconecta.
+    """
+    if not _saldos_ao_vivo(request):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_staff:
+        return HttpResponseForbidden()
+    organizacao = await sync_to_async(organizacao_do_usuario)(user)
+    return StreamingHttpResponse(
+        fluxo_sse(organizacao.pk),
+        content_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 # ========== CRUD de Cartões (admin) ==========
 @staff_member_required
 def criar_cartao_view(request):
@@ -160,42 +178,230 @@ def criar_cartao_view(request):
     Página dedicada para o admin criar um novo cartão (com seleção de usuário dono).
     """
     if request.method == 'POST':
-        form = CartaoCreditoAdminForm(request.POST)
+        form = CartaoCreditoAdminForm(request.POST, organizacao=request.organizacao)
         if form.is_valid():
             form.save()
             messages.success(request, 'Cartão criado e vinculado ao usuário selecionado.')
             return redirect('dashboard')
     else:
-        form = CartaoCreditoAdminForm()
+        form = CartaoCreditoAdminForm(organizacao=request.organizacao)
 
     return render(request, 'cartoes_app/cartao_form.html', {'form': form, 'titulo': 'Adicionar Novo Cartão'})
 
 
 @staff_member_required
 def editar_cartao_view(request, cartao_id):
-    cartao = get_object_or_404(CartaoCredito, id=cartao_id)
+    cartao = get_object_or_404(CartaoCredito.objects.da_organizacao(request.organizacao), id=cartao_id)
     if request.method == 'POST':
-        form = CartaoCreditoAdminForm(request.POST, instance=cartao)
+        form = CartaoCreditoAdminForm(request.POST, instance=cartao, organizacao=request.organizacao)
         if form.is_valid():
             form.save()
             messages.success(request, 'Cartão atualizado com sucesso!')
             return redirect('dashboard')
     else:
-        form = CartaoCreditoAdminForm(instance=cartao)
+        form = CartaoCreditoAdminForm(instance=cartao, organizacao=request.organizacao)
     return render(request, 'cartoes_app/editar_cartao.html', {'form': form})
 
 
 @staff_member_required
 def confirmar_exclusao_view(request, cartao_id):
-    cartao = get_object_or_404(CartaoCredito, id=cartao_id)
+    cartao = get_object_or_404(CartaoCredito.objects.da_organizacao(request.organizacao), id=cartao_id)
     if request.method == 'POST':
+        # Cartões com muitos gastos são apagados lote a lote na página de progresso
+        if Gasto.objects.filter(cartao=cartao).count() > LOTE_EXCLUSAO:
+            return redirect('excluir_cartao_progresso', cartao_id=cartao.id)
         nome = cartao.nome
-        cartao.delete()
+        excluir_cartoes([cartao.id])
         messages.success(request, f'Cartão "{nome}" foi excluído com sucesso.')
         return redirect('dashboard')
     return render(request, 'cartoes_app/confirmar_exclusao.html', {'cartao': cartao})
 
 
+@staff_member_required
+def excluir_cartao_progresso_view(request, cartao_id):
+    """
+    Exclusão de cartões grandes: a página chama este endpoint via POST repetidamente;
+    cada chamada apaga um lote de gastos e devolve o progresso em JSON.
+    """
+    cartao = get_object_or_404(CartaoCredito.objects.da_organizacao(request.organizacao), id=cartao_id)
+    if request.method == 'POST':
+        removidos = excluir_lote_gastos([cartao.id])
+        restantes = Gasto.objects.filter(cartao=cartao).count() if removidos else 0
+        if restantes == 0:
+            nome = cartao.nome
+            excluir_cartoes([cartao.id])
+            messages.success(request, f'Cartão "{nome}" foi excluído com sucesso.')
+            return JsonResponse({'removidos': removidos, 'restantes': 0, 'concluido': True, 'url': reverse('dashboard')})
+        return JsonResponse({'removidos': removidos, 'restantes': restantes, 'concluido': False})
+
+    return render(request, 'cartoes_app/excluir_cartao_progresso.html', {
+        'cartao': cartao,
+        'total_gastos': Gasto.objects.filter(cartao=cartao).count(),
+    })
+
+
+# ========== Cartões em lote (admin) ==========
+MAX_LINHAS_CSV = 5000
+
+
+def _decodificar_csv(dados):
+    """UTF-8 (com ou sem BOM) ou, se falhar, cp1252 — o padrão do Excel em pt-BR. None se nenhum servir."""
+    for codificacao in ('utf-8-sig', 'cp1252'):
+        try:
+            return dados.decode(codificacao)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def _importar_cartoes_csv(arquivo, organizacao):
+    """
+    Valida todas as linhas do CSV com as regras do CartaoCreditoAdminForm e, se não
+    houver falhas, cria os cartões com um bulk_create numa única transação.
+    Retorna (quantidade_criada, falhas), onde falhas = [(linha, [mensagens])].
+    """
+    texto = _decodificar_csv(arquivo.read())
+    if texto is None:
+        return 0, [(0, ['Arquivo CSV inválido: salve-o em UTF-8 ou Windows-1252 (padrão do Excel).'])]
+    try:
+        dialeto = csv.Sniffer().sniff(texto[:4096], delimiters=',;')
+    except csv.Error:
+        dialeto = csv.excel
+
+    try:
+        linhas = list(csv.DictReader(io.StringIO(texto, newline=''), dialect=dialeto))
+    except csv.Error as exc:
+        return 0, [(0, [f'Arquivo CSV inválido: {exc}'])]
+    if len(linhas) > MAX_LINHAS_CSV:
+        return 0, [(0, [f'O arquivo tem {len(linhas)} linhas; o máximo por importação é {MAX_LINHAS_CSV}.'])]
+
+    # Donos resolvidos numa única consulta para todas as linhas
+    usernames = {(linha.get('usuario') or '').strip() for linha in linhas}
+    usuarios = {
+        u.username: u
+        for u in usuarios_comuns(organizacao).filter(username__in=usernames)
+    }
+
+    cartoes, falhas = [], []
+    for numero_linha, linha in enumerate(linhas, start=2):  # linha 1 = cabeçalho
+        dados = {chave.strip(): (valor or '').strip() for chave, valor in linha.items() if chave}
+        form = CartaoCreditoLoteForm(dados, usuarios_por_username=usuarios, organizacao=organizacao)
+        if form.is_valid():
+            cartoes.append(form.save(commit=False))
+        else:
+            falhas.append((numero_linha, [
+                f'{campo}: {erro}' if campo != '__all__' else erro
+                for campo, erros in form.errors.items() for erro in erros
+            ]))
+
+    if falhas or not cartoes:
+        return 0, falhas
+    with transaction.atomic():
+        CartaoCredito.objects.bulk_create(cartoes, batch_size=500)
+    return len(cartoes), []
+
+
+@staff_member_required
+def cartoes_lote_view(request):
+    """
+    Administração de cartões em lote: importação por CSV e recarga/limite/exclusão
+    de uma seleção, cada operação em poucas instruções SQL dentro de uma transação.
+    """
+    usuarios = usuarios_comuns(request.organizacao).order_by('username')
+    usuario_id = request.GET.get('usuario') or ''
+    cartoes = (
+        CartaoCredito.objects.da_organizacao(request.organizacao)
+        .select_related('usuario')
+        .order_by('usuario__username', 'nome')
+    )
+    if usuario_id.isdigit():
+        cartoes = cartoes.filter(usuario_id=int(usuario_id))
+
+    importar_form = ImportarCartoesForm()
+    operacao_form = OperacaoLoteCartoesForm(organizacao=request.organizacao)
+    falhas = []
+
+    if request.method == 'POST' and 'importar' in request.POST:
+        importar_form = ImportarCartoesForm(request.POST, request.FILES)
+        if importar_form.is_valid():
+            criados, falhas = _importar_cartoes_csv(importar_form.cleaned_data['arquivo'], request.organizacao)
+            if criados:
+                messages.success(request, f'{criados} cartões importados com sucesso.')
+                return redirect(request.get_full_path())
+            messages.error(request, 'Nenhum cartão foi importado. Corrija as linhas abaixo e envie novamente.')
+
+    elif request.method == 'POST':
+        operacao_form = OperacaoLoteCartoesForm(request.POST, organizacao=request.organizacao)
+        if operacao_form.is_valid():
+            acao = operacao_form.cleaned_data['acao']
+            valor = operacao_form.cleaned_data['valor']
+            selecionados = operacao_form.cleaned_data['cartoes']
+            # update()/exclusão em lote não disparam signals: dashboards abertos recarregam,
+            # avisados só depois que as escritas foram gravadas
+            evento = {'tipo': 'recarregar', 'organizacao_id': request.organizacao.pk}
+            if acao == 'excluir':
+                # Gastos/anexos apagados em lotes; arquivos vão para a fila de varredura
+                ids = list(selecionados.values_list('pk', flat=True))
+                if Gasto.objects.filter(cartao_id__in=ids).count() > LOTE_EXCLUSAO:
+                    # Seleções grandes seguem na página de progresso, lote a lote
+                    request.session['exclusao_lote'] = ids
+                    return redirect('excluir_cartoes_lote_progresso')
+                excluir_cartoes(ids)
+                transaction.on_commit(lambda: publicar(evento))
+                messages.success(request, f'{len(ids)} cartões excluídos.')
+            else:
+                with transaction.atomic():
+                    transaction.on_commit(lambda: publicar(evento))
+                    if acao == 'recarregar':
+                        total = selecionados.update(saldo_atual=F('saldo_atual') + valor, atualizado_em=timezone.now())
+                        messages.success(request, f'{total} cartões recarregados em R$ {valor:.2f}.')
+                    else:
+                        total = selecionados.update(limite=valor, atualizado_em=timezone.now())
+                        messages.success(request, f'Limite de {total} cartões definido em R$ {valor:.2f}.')
+            return redirect(request.get_full_path())
+
+    return render(request, 'cartoes_app/cartoes_lote.html', {
+        'usuarios': usuarios,
+        'usuario_id': usuario_id,
+        'cartoes': cartoes,
+        'importar_form': importar_form,
+        'operacao_form': operacao_form,
+        'falhas': falhas,
+    })
+
+
+@staff_member_required
+def excluir_cartoes_lote_progresso_view(request):
+    """
+    Exclusão em lote com muitos gastos: mesma página de progresso da exclusão de um
+    cartão, para os cartões guardados na sessão por cartoes_lote_view.
+    """
+    ids = list(
+        CartaoCredito.objects.da_organizacao(request.organizacao)
+        .filter(pk__in=request.session.get('exclusao_lote', []))
+        .values_list('pk', flat=True)
+    )
+    if request.method == 'POST':
+        removidos = excluir_lote_gastos(ids) if ids else 0
+        restantes = Gasto.objects.filter(cartao_id__in=ids).count() if removidos else 0
+        if restantes == 0:
+            excluir_cartoes(ids)
+            request.session.pop('exclusao_lote', None)
+            publicar({'tipo': 'recarregar', 'organizacao_id': request.organizacao.pk})
+            messages.success(request, f'{len(ids)} cartões excluídos.')
+            return JsonResponse({
+                'removidos': removidos, 'restantes': 0, 'concluido': True, 'url': reverse('cartoes_lote'),
+            })
+        return JsonResponse({'removidos': removidos, 'restantes': restantes, 'concluido': False})
+
+    if not ids:
+        return redirect('cartoes_lote')
+    return render(request, 'cartoes_app/excluir_cartao_progresso.html', {
+        'quantidade_cartoes': len(ids),
+        'total_gastos': Gasto.objects.filter(cartao_id__in=ids).count(),
+    })
+
+
 # ========== Usuários (admin) ==========
 @staff_member_required
 def registrar_usuario_view(request):
@@ -203,13 +409,13 @@ def registrar_usuario_view(request):
     Registrar usuário comum (sem listar usuários aqui; listagem fica na página 'usuarios').
     """
     if request.method == 'POST':
-        form = RegistrarUsuarioComumForm(request.POST)
+        form = RegistrarUsuarioComumForm(request.POST, organizacao=request.organizacao)
         if form.is_valid():
             form.save()
             messages.success(request, "Usuário comum registrado!")
             return redirect('dashboard')
     else:
-        form = RegistrarUsuarioComumForm()
+        form = RegistrarUsuarioComumForm(organizacao=request.organizacao)
 
     return render(request, 'cartoes_app/registrar_usuario.html', {
         'form': form,
@@ -217,11 +423,12 @@ def registrar_usuario_view(request):
 
 
 @staff_member_required
+@usar_replica
 def usuarios_view(request):
     """
     Página para o admin selecionar um usuário comum e visualizar os cartões dele.
     """
-    usuarios = User.objects.filter(is_staff=False).order_by('username')
+    usuarios = usuarios_comuns(request.organizacao).order_by('username')
     usuario_id = request.GET.get('usuario')
     usuario_selecionado = None
     cartoes = CartaoCredito.objects.none()
@@ -230,7 +437,11 @@ def usuarios_view(request):
     if usuario_id:
         try:
             usuario_selecionado = usuarios.get(id=int(usuario_id))
-            cartoes = CartaoCredito.objects.filter(usuario=usuario_selecionado).select_related('usuario')
+            cartoes = (
+                CartaoCredito.objects.da_organizacao(request.organizacao)
+                .filter(usuario=usuario_selecionado)
+                .select_related('usuario')
+            )
             limite_total = cartoes.aggregate(total=Sum('limite'))['total'] or 0
         except (ValueError, User.DoesNotExist):
             usuario_selecionado = None
@@ -245,11 +456,23 @@ def usuarios_view(request):
 
 
 # ========== Gastos ==========
+def _gasto_ja_registrado(organizacao, usuario, chave_idempotencia):
+    """Gasto já gravado com a chave de idempotência do formulário, ou None."""
+    if not chave_idempotencia:
+        return None
+    return (
+        Gasto.objects.da_organizacao(organizacao)
+        .filter(usuario=usuario, chave_idempotencia=chave_idempotencia)
+        .first()
+    )
+
+
 @login_required
+@limitar('gastos', 'RATE_LIMIT_GASTOS', 'GASTOS_MAX_CONCORRENTES')
 def gastos_view(request):
     # ===== Definição do usuário alvo =====
     if request.user.is_staff:
-        usuarios = User.objects.filter(is_staff=False).order_by('username')
+        usuarios = usuarios_comuns(request.organizacao).order_by('username')
         usuario_id = request.GET.get('usuario')
 
         user_alvo = None
@@ -269,59 +492,25 @@ def gastos_view(request):
         user_alvo = request.user
 
     # ===== Período =====
-    periodo = request.GET.get('periodo', 'mes_atual')  # mes_atual | ult_30 | todos
-    hoje = date.today()
-    if periodo == 'mes_atual':
-        start = date(hoje.year, hoje.month, 1)
-        end = date(hoje.year, hoje.month, monthrange(hoje.year, hoje.month)[1])
-    elif periodo == 'ult_30':
-        start = hoje - timedelta(days=30)
-        end = hoje
-    else:
-        start, end = None, None
-
-    date_filter = {}
-    if start and end:
-        date_filter = {'data__range': (start, end)}
+    periodo = Periodo.da_requisicao(request)
 
     # ===== Dados base =====
-    cartoes = CartaoCredito.objects.filter(usuario=user_alvo).order_by('nome') if user_alvo else CartaoCredito.objects.none()
-    gastos_qs = Gasto.objects.filter(usuario=user_alvo) if user_alvo else Gasto.objects.none()
+    gastos_qs = (
+        Gasto.objects.da_organizacao(request.organizacao).filter(usuario=user_alvo)
+        if user_alvo else Gasto.objects.none()
+    )
 
-    # Totais do usuário
-    limite_total_cartoes = cartoes.aggregate(total=Sum('limite'))['total'] or Decimal('0')
-    total_gasto_periodo = gastos_qs.filter(**date_filter).aggregate(total=Sum('valor'))['total'] or Decimal('0')
+    # Resumo por cartão e totais do usuário no período (e no anterior, para comparação)
+    resumo = resumo_usuario(user_alvo, periodo, request.organizacao, comparar=True) if user_alvo else None
+    cartoes_resumo = resumo.cartoes if resumo else []
+    limite_total_cartoes = resumo.limite_total if resumo else Decimal('0')
+    total_gasto_periodo = resumo.gasto_total if resumo else Decimal('0')
 
     # Saldo total do período
     saldo_total = limite_total_cartoes - total_gasto_periodo
     saldo_total_negativo = saldo_total < 0
     saldo_total_zero = saldo_total == 0
 
-    # Resumo por cartão
-    cartoes_resumo = []
-    if user_alvo:
-        gastos_por_cartao = (
-            gastos_qs.filter(**date_filter)
-            .values('cartao_id')
-            .annotate(gasto_total=Sum('valor'))
-        )
-        gasto_map = {row['cartao_id']: (row['gasto_total'] or Decimal('0')) for row in gastos_por_cartao}
-
-        for c in cartoes:
-            gasto = gasto_map.get(c.id, Decimal('0'))
-            limite = c.limite or Decimal('0')
-            saldo = limite - gasto
-            cartoes_resumo.append({
-                'id': c.id,
-                'nome': c.nome,
-                'bandeira_display': c.get_bandeira_display(),
-                'limite': limite,
-                'gasto_total': gasto,
-                'saldo_restante': saldo,
-                'estourado': gasto > limite,
-                'numero_mascarado': getattr(c, 'numero_mascarado', None),
-            })
-
     # ===== POST: registrar gasto (com anexos) =====
     if request.method == 'POST':
         if not user_alvo:
@@ -332,31 +521,59 @@ def gastos_view(request):
         if form.is_valid():
             gasto = form.save(commit=False)
             gasto.usuario = user_alvo
+            gasto.chave_idempotencia = form.cleaned_data['chave_idempotencia']
+
+            # Redireciona preservando filtros e usuário (se admin)
+            base = reverse('gastos')
+            params = []
+            if request.user.is_staff and user_alvo:
+                params.append(f'usuario={user_alvo.id}')
+            params.append(periodo.parametros())
+            url = base + ('?' + '&'.join(params) if params else '')
 
             if gasto.cartao.usuario_id != user_alvo.id:
                 form.add_error('cartao', 'Este cartão não pertence ao usuário selecionado.')
+            elif _gasto_ja_registrado(request.organizacao, user_alvo, gasto.chave_idempotencia) is not None:
+                # Mesmo formulário enviado de novo (duplo clique, recarregar a página)
+                messages.info(request, 'Este gasto já havia sido registrado.')
+                return redirect(url)
+            elif (
+                not form.cleaned_data['confirmar_duplicado']
+                and Gasto.objects.filter(impressao_digital=gasto.calcular_impressao_digital()).exists()
+            ):
+                form.add_error(
+                    'confirmar_duplicado',
+                    'Já existe um gasto com o mesmo cartão, valor, data e descrição.',
+                )
             else:
-                gasto.save()
-                files = request.FILES.getlist('anexos')
-                for f in files:
-                    GastoAnexo.objects.create(gasto=gasto, arquivo=f, nome_original=f.name)
+                try:
+                    with transaction.atomic():
+                        gasto.save()
+                        anexo_ids = []
+                        for f, tipo in form.cleaned_data['anexos']:
+                            nome_original = f.name
+                            f.name = nome_com_extensao(f.name, tipo)
+                            anexo = GastoAnexo.objects.create(
+                                gasto=gasto, arquivo=f, nome_original=nome_original, tipo_conteudo=tipo,
+                            )
+                            anexo_ids.append(anexo.pk)
+                        # Recompressão das fotos (opcional) em segundo plano, depois do commit
+                        transaction.on_commit(lambda: agendar_imagens(anexo_ids))
+                except IntegrityError:
+                    # Envio simultâneo com a mesma chave: a constraint única barrou este e o outro já gravou
+                    if _gasto_ja_registrado(request.organizacao, user_alvo, gasto.chave_idempotencia) is None:
+                        raise
+                    messages.info(request, 'Este gasto já havia sido registrado.')
+                    return redirect(url)
 
                 messages.success(request, 'Gasto registrado com sucesso.')
-                # Redireciona preservando filtros e usuário (se admin)
-                base = reverse('gastos')
-                params = []
-                if request.user.is_staff and user_alvo:
-                    params.append(f'usuario={user_alvo.id}')
-                if periodo:
-                    params.append(f'periodo={periodo}')
-                url = base + ('?' + '&'.join(params) if params else '')
                 return redirect(url)
     else:
         form = GastoForm(user_alvo=user_alvo)
 
     # Lista de gastos otimizada
     gastos_listados = (
-        gastos_qs.filter(**date_filter)
+        gastos_qs.filter(**periodo.filtro())
         .select_related('cartao')
         .prefetch_related('anexos')
         .order_by('-data', '-id')
@@ -365,18 +582,22 @@ def gastos_view(request):
     context = {
         'usuarios': usuarios,
         'user_alvo': user_alvo,
-        'cartoes': cartoes,
         'gastos': gastos_listados,
         'limite_total_cartoes': limite_total_cartoes,
         'total_gasto_periodo': total_gasto_periodo,
         'form': form,
-        'periodo': periodo,
-        'periodo_inicio': start,
-        'periodo_fim': end,
+        'periodo': periodo.chave,
+        'periodo_inicio': periodo.inicio,
+        'periodo_fim': periodo.fim,
+        'periodos': PERIODOS,
+        'periodo_anterior': periodo.anterior() if resumo else None,
+        'resumo': resumo,
         'cartoes_resumo': cartoes_resumo,
         'saldo_total': saldo_total,
         'saldo_total_negativo': saldo_total_negativo,
         'saldo_total_zero': saldo_total_zero,
+        'pode_remover_anexos': request.user.is_staff or user_alvo == request.user,
+        'fragment_timeout': settings.TEMPLATE_FRAGMENT_TIMEOUT,
     }
     return render(request, 'cartoes_app/gastos.html', context)
 
@@ -389,7 +610,7 @@ def excluir_anexo_gasto(request, anexo_id):
     Permissões: admin (staff) ou dono do gasto (gasto.usuario == request.user).
     Apenas via POST.
     """
-    an = get_object_or_404(GastoAnexo, id=anexo_id)
+    an = get_object_or_404(GastoAnexo.objects.filter(gasto__organizacao=request.organizacao), id=anexo_id)
 
     if not (request.user.is_staff or an.gasto.usuario_id == request.user.id):
         return HttpResponseForbidden('Você não tem permissão para remover este anexo.')
@@ -403,15 +624,71 @@ def excluir_anexo_gasto(request, anexo_id):
         params = []
         if request.user.is_staff:
             params.append(f'usuario={gasto.usuario_id}')
-        periodo = request.POST.get('periodo')
-        if periodo:
-            params.append(f'periodo={periodo}')
+        if request.POST.get('periodo'):
+            # refeito a partir dos valores validados, não do texto enviado
+            params.append(Periodo.dos_parametros(request.POST).parametros())
         url = base + ('?' + '&'.join(params) if params else '')
         return redirect(url)
 
     return redirect('gastos')
 
 
+# ========== Uploads (media) ==========
+def _codificacoes_aceitas(request):
+    aceitas = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        codificacao, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            aceitas.add(codificacao.strip().lower())
+    return aceitas
+
+
+@login_required
+def servir_midia(request, path):
+    """
+    Serve anexos de MEDIA_ROOT. Permissões: como em excluir_anexo_gasto — staff da
+    organização ou dono do gasto; qualquer outro caminho é 404. Nomes com hash
+    (MidiaImutavelStorage) recebem Cache-Control imutável de longa duração;
+    variantes .br/.gz pré-comprimidas são entregues quando o navegador aceita.
+    """
+    if path.endswith(('.gz', '.br')):
+        raise Http404
+    dono = (
+        GastoAnexo.objects.filter(Q(arquivo=path) | Q(arquivo_original=path), gasto__organizacao=request.organizacao)
+        .values_list('gasto__usuario_id', flat=True).first()
+    )
+    if dono is None or not (request.user.is_staff or dono == request.user.id):
+        raise Http404
+    try:
+        caminho = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(caminho):
+        raise Http404
+
+    stat = os.stat(caminho)
+    if not was_modified_since(request.headers.get('If-Modified-Since'), stat.st_mtime):
+        return HttpResponseNotModified()
+
+    content_type, _ = mimetypes.guess_type(caminho)
+    arquivo, codificacao = caminho, None
+    aceitas = _codificacoes_aceitas(request)
+    for extensao, nome in (('.br', 'br'), ('.gz', 'gzip')):
+        if nome in aceitas and os.path.isfile(caminho + extensao):
+            arquivo, codificacao = caminho + extensao, nome
+            break
+
+    response = FileResponse(open(arquivo, 'rb'), content_type=content_type or 'application/octet-stream')
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if codificacao:
+        response['Content-Encoding'] = codificacao
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if nome_imutavel(path):
+        # comprovantes são privados: só o navegador guarda, nunca proxies/CDN
+        response['Cache-Control'] = f'private, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable'
+    return response
+
+
 @csrf_exempt
 def github_deploy(request):
     """
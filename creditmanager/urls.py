@@ -1,10 +1,20 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from cartoes_app.views import servir_midia
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+]
+
+# ✅ uploads com nome imutável: servidos com cache longo e variantes .br/.gz
+if settings.MEDIA_STORAGE_MODE == 'imutavel':
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.+)$' % settings.MEDIA_URL.lstrip('/'), servir_midia),
+    ]
+
+urlpatterns += [
     path('', include('cartoes_app.urls')),
 ]
 
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'creditmanager.settings')
 
 application = get_wsgi_application()
+
+# Aquecimento opcional: importa views, compila templates e popula as URLs antes
+# da primeira requisição. Com gunicorn --preload (ou GUNICORN_CMD_ARGS="--preload")
+# roda uma única vez no master e os workers herdam tudo pronto após o fork.
+if os.getenv('WARMUP_ON_START', 'False').lower() == 'true':
+    from cartoes_app.aquecimento import aquecer
+    aquecer()